@@ -0,0 +1,308 @@
+from typing import Dict, List, Optional
+from pathlib import Path
+from contextlib import redirect_stdout
+import argparse, asyncio, json, os, platform, random, shutil, statistics, subprocess, sys, tempfile, time
+
+from .git_check import git_check, git_check_directories, GitOptions
+from .discovery import find_repos, SearchOptions
+from .runner import AsyncGitRunner
+from .remotes import FetchOptions
+from .profiling import Profiler
+
+
+# Benchmark of git_check against a synthetic farm of local repositories. #
+# Every repository gets a bare "remote" in the farm, reached through      #
+# file://, so it runs offline. Usage:                                     #
+#     python -m MyModules.git.benchmark --repos 200 --jobs 1 8 32         #
+# With --import-time it measures instead how long a fresh interpreter    #
+# takes to import git_check, and fails if that is over --import-budget   #
+# or if a module that only some flags need was imported.                 #
+
+KINDS : List[str] = ["clean", "dirty", "ahead", "behind", "diverged"]
+
+GIT_ENV : Dict[str, str] = {
+    "GIT_AUTHOR_NAME" : "benchmark", "GIT_AUTHOR_EMAIL" : "benchmark@localhost",
+    "GIT_COMMITTER_NAME" : "benchmark", "GIT_COMMITTER_EMAIL" : "benchmark@localhost",
+    "GIT_CONFIG_NOSYSTEM" : "1",
+}
+
+
+def git(args : List[str], cwd : Path) -> None:
+    subprocess.run(
+        ["git", *args], cwd=cwd, env={**os.environ, **GIT_ENV},
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True,
+    )
+
+
+def commit(repo : Path, text : str) -> None:
+    with open(repo / "file.txt", "a") as fout:
+        fout.write(text + "\n")
+    git(["add", "file.txt"], repo)
+    git(["commit", "-q", "-m", text], repo)
+
+
+def make_repo(work : Path, remote : Path, kind : str) -> None:
+    git(["init", "-q", "--bare", str(remote)], remote.parent)
+    work.mkdir(parents=True)
+    git(["init", "-q", "-b", "main"], work)
+    commit(work, "first")
+    git(["remote", "add", "origin", remote.as_uri()], work)
+    git(["push", "-q", "-u", "origin", "main"], work)
+
+    if kind == "dirty":
+        with open(work / "file.txt", "a") as fout:
+            fout.write("uncommitted\n")
+        (work / "untracked.txt").write_text("untracked\n")
+    elif kind == "ahead":
+        commit(work, "local")
+    elif kind in ["behind", "diverged"]:
+        commit(work, "remote")
+        git(["push", "-q"], work)
+        git(["reset", "-q", "--hard", "HEAD~1"], work)
+        if kind == "diverged":
+            commit(work, "local")
+
+
+# Creates the farm in root, unless root already holds one with the same #
+# parameters. Returns the paths of the working repositories.            #
+def make_farm(
+    root : Path,
+    repos : int,
+    mix : Dict[str, int],
+    depth : int,
+    noise : int,
+    seed : int,
+) -> List[Path]:
+    params = {"repos" : repos, "mix" : mix, "depth" : depth, "noise" : noise, "seed" : seed}
+    manifest = root / "farm.json"
+    if manifest.is_file():
+        with manifest.open() as fin:
+            data = json.load(fin)
+        if data.get("params") == params:
+            return [Path(p) for p in data["repos"]]
+        shutil.rmtree(root)
+
+    rng = random.Random(seed)
+    kinds : List[str] = []
+    for kind in KINDS:
+        kinds += [kind] * mix.get(kind, 0)
+    if len(kinds) == 0:
+        kinds = ["clean"]
+
+    (root / "remotes").mkdir(parents=True, exist_ok=True)
+    work_root = root / "work"
+    repo_list : List[Path] = []
+    for i in range(repos):
+        # Spread the repositories over nested groups of up to 10 #
+        parts = [f"group{(i // 10 ** (level + 1)) % 10}" for level in range(depth)]
+        work = work_root.joinpath(*parts, f"repo{i:05d}")
+        make_repo(work, root / "remotes" / f"repo{i:05d}.git", kinds[i % len(kinds)])
+        repo_list.append(work)
+
+    # Directories without repositories that the search has to walk #
+    for i in range(noise):
+        parts = [f"noise{rng.randrange(max(1, noise // 10))}" for _ in range(rng.randint(1, depth + 1))]
+        d = work_root.joinpath(*parts, f"dir{i:05d}")
+        d.mkdir(parents=True, exist_ok=True)
+        (d / "data.txt").write_text("noise\n")
+
+    with manifest.open("w") as fout:
+        json.dump({"params" : params, "repos" : [str(p) for p in repo_list]}, fout)
+    return repo_list
+
+
+# Modules that git_check_main imports only for the flags that use them, #
+# and the standard modules imported only once git commands are run     #
+LAZY_MODULES : List[str] = [
+    "psutil", "Levenshtein", "ctypes", "multiprocessing",
+    "asyncio", "concurrent.futures", "hashlib",
+    "MyModules.git.console", "MyModules.git.daemon", "MyModules.git.processes",
+    "MyModules.git.distributed", "MyModules.git.ssh_mux",
+]
+if os.name != "nt":
+    # Only needed by Windows consoles #
+    LAZY_MODULES.append("colorama")
+
+
+# Imports module in runs fresh interpreters with -X importtime. Returns #
+# the cumulative import times of module and the lazy modules imported. #
+def import_times(module : str, runs : int) -> dict:
+    package_root = Path(__file__).resolve().parents[2]
+    python_path = os.environ.get("PYTHONPATH")
+    env = {**os.environ, "PYTHONPATH" : str(package_root) + ("" if not python_path else os.pathsep + python_path)}
+    times : List[float] = []
+    loaded : set = set()
+    # The first run may have to write the .pyc files #
+    for run in range(runs + 1):
+        proc = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+            env=env, capture_output=True, text=True, check=True,
+        )
+        for line in proc.stderr.splitlines():
+            # "import time: <self us> | <cumulative us> | <indented name>" #
+            fields = line[len("import time:"):].split("|")
+            if not line.startswith("import time:") or len(fields) != 3 or not fields[1].strip().isdigit():
+                continue
+            name = fields[2].strip()
+            loaded.add(name)
+            if name == module and run > 0:
+                times.append(int(fields[1]) / 1e6)
+    return {
+        "module" : module,
+        "runs" : len(times),
+        "median_s" : round(statistics.median(times), 6),
+        "min_s" : round(min(times), 6),
+        "max_s" : round(max(times), 6),
+        "lazy_imported" : sorted(loaded & set(LAZY_MODULES)),
+    }
+
+
+def timed_runs(function, runs : int) -> List[float]:
+    times : List[float] = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+            function()
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def run_benchmark(
+    farm : Path,
+    repo_list : List[Path],
+    jobs_list : List[int],
+    runs : int,
+    fetch : bool,
+) -> dict:
+    options = GitOptions(status=True, commit=False, push=False, pull=False)
+    search_root = farm / "work"
+    n = len(repo_list)
+    results : dict = {"discovery" : {}, "git_check" : {}, "git_check_directories" : {}}
+
+    # Discovery only #
+    def discover() -> None:
+        find_repos([search_root], set(), True, None, set(), SearchOptions(skip_names=set()))
+    results["discovery"] = summarize(timed_runs(discover, runs), n)
+
+    for jobs in jobs_list:
+        fetch_options = FetchOptions(enabled=fetch)
+
+        # Explicit list of repositories #
+        def check_list() -> None:
+            git_check(repo_list, [], set(), options, False, 0, jobs, fetch_options=fetch_options)
+        results["git_check"][str(jobs)] = summarize(timed_runs(check_list, runs), n)
+
+        # Search from the farm root, with a per-step profile of the last run #
+        profiler = Profiler()
+        def check_search() -> None:
+            profiler.records.clear()
+            runner = AsyncGitRunner(max_processes=jobs, profiler=profiler)
+            asyncio.run(git_check_directories(
+                [search_root], set(), options, True, None, set(), runner, jobs,
+                SearchOptions(skip_names=set()), fetch_options,
+            ))
+        summary = summarize(timed_runs(check_search, runs), n)
+        summary["steps"] = {
+            step : round(sum(times), 6) for step, times in profiler.steps().items()
+        }
+        results["git_check_directories"][str(jobs)] = summary
+
+    return results
+
+
+def summarize(times : List[float], repos : int) -> dict:
+    median = statistics.median(times)
+    return {
+        "runs" : len(times),
+        "median_s" : round(median, 6),
+        "min_s" : round(min(times), 6),
+        "max_s" : round(max(times), 6),
+        "repos_per_s" : round(repos / median, 2) if median > 0 else None,
+    }
+
+
+def print_results(results : dict) -> None:
+    d = results["discovery"]
+    print(f"\ndiscovery                    median {d['median_s']:8.3f} s  min {d['min_s']:8.3f} s")
+    for name in ["git_check", "git_check_directories"]:
+        for jobs, r in results[name].items():
+            print(
+                f"{name:<22} jobs {jobs:>3}  median {r['median_s']:8.3f} s  min {r['min_s']:8.3f} s  "
+                f"{r['repos_per_s']:>8} repos/s"
+            )
+            for step, seconds in sorted(r.get("steps", {}).items(), key=lambda item: -item[1]):
+                print(f"        {step:<24} {seconds:8.3f} s")
+
+
+def parse_mix(text : str) -> Dict[str, int]:
+    mix : Dict[str, int] = dict()
+    for item in text.split(","):
+        kind, _, weight = item.partition("=")
+        if kind not in KINDS or not weight.isdigit():
+            raise argparse.ArgumentTypeError(f"invalid mix item: {item}")
+        mix[kind] = int(weight)
+    return mix
+
+
+def main(argv : Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(prog="python -m MyModules.git.benchmark", description="Benchmark git_check on a synthetic repository farm.")
+    parser.add_argument("--repos", type=int, default=100, help="number of repositories (default 100)")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix("clean=4,dirty=2,ahead=1,behind=1,diverged=1"),
+                        help="weights of each kind of repository (default clean=4,dirty=2,ahead=1,behind=1,diverged=1)")
+    parser.add_argument("--depth", type=int, default=2, help="nesting depth of the repositories (default 2)")
+    parser.add_argument("--noise", type=int, default=200, help="number of directories without repositories (default 200)")
+    parser.add_argument("--seed", type=int, default=0, help="random seed of the farm layout (default 0)")
+    parser.add_argument("--jobs", type=int, nargs="+", default=[1, 8], help="values of --jobs to measure (default 1 8)")
+    parser.add_argument("--runs", type=int, default=3, help="runs per measurement (default 3)")
+    parser.add_argument("--no-fetch", action="store_true", help="measure without git fetch")
+    parser.add_argument("--farm", type=Path, default=None, help="directory of the farm; reused between runs if given")
+    parser.add_argument("--json", type=Path, default=None, help="also write the results to this JSON file")
+    parser.add_argument("--import-time", action="store_true", help="only measure the import time of git_check")
+    parser.add_argument("--import-budget", type=float, default=150.0, help="maximum median import time in ms (default 150)")
+    args = parser.parse_args(argv)
+
+    if args.import_time:
+        results = import_times("MyModules.git", args.runs)
+        median_ms = results["median_s"] * 1000
+        print(f"import {results['module']:<22} median {median_ms:8.1f} ms  min {results['min_s'] * 1000:8.1f} ms  budget {args.import_budget:.1f} ms")
+        failures : List[str] = []
+        if median_ms > args.import_budget:
+            failures.append(f"median import time over the budget of {args.import_budget:g} ms")
+        if len(results["lazy_imported"]) > 0:
+            failures.append("imported at start: " + ", ".join(results["lazy_imported"]))
+        for failure in failures:
+            print(f"FAIL: {failure}")
+        if args.json is not None:
+            with args.json.open("w") as fout:
+                json.dump({"python" : platform.python_version(), "platform" : platform.platform(), "import" : results}, fout, indent=4)
+        exit(1 if len(failures) > 0 else 0)
+
+    farm : Path = args.farm if args.farm is not None else Path(tempfile.mkdtemp(prefix="git_check_bench-"))
+    try:
+        start = time.perf_counter()
+        repo_list = make_farm(farm.absolute(), args.repos, args.mix, args.depth, args.noise, args.seed)
+        print(f"Farm of {len(repo_list)} repositories in {farm} ({time.perf_counter() - start:.1f} s to prepare)")
+
+        results = run_benchmark(farm.absolute(), repo_list, args.jobs, args.runs, not args.no_fetch)
+        print_results(results)
+
+        if args.json is not None:
+            data = {
+                "params" : {
+                    "repos" : args.repos, "mix" : args.mix, "depth" : args.depth, "noise" : args.noise,
+                    "seed" : args.seed, "runs" : args.runs, "fetch" : not args.no_fetch,
+                },
+                "python" : platform.python_version(),
+                "platform" : platform.platform(),
+                "git" : subprocess.run(["git", "--version"], capture_output=True, text=True).stdout.strip(),
+                "results" : results,
+            }
+            with args.json.open("w") as fout:
+                json.dump(data, fout, indent=4)
+    finally:
+        if args.farm is None:
+            shutil.rmtree(farm, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
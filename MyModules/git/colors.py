@@ -1,30 +1,37 @@
 from typing import Set
-import colorama, os, psutil
+import os
 
-# Init colorama if windows #
-if ("cmd" in str(psutil.Process(os.getpid()).parent().name)):
+# Init colorama if running in a Windows console (cmd.exe or PowerShell). #
+# Terminals that understand ANSI codes (mintty, MSYS, Windows Terminal)  #
+# set TERM or WT_SESSION. Elsewhere colorama is not even imported.       #
+if os.name == "nt" and "TERM" not in os.environ and "WT_SESSION" not in os.environ:
+    import colorama
     colorama.init(autoreset=True)
 
 
+# ANSI escape codes, as colorama.Fore and colorama.Style give them #
+_RESET_ALL = "\033[0m"
+_BRIGHT    = "\033[1m"
+
 stdcolors : Set[str] = {
-    "red" : colorama.Fore.RED,
-    "green" : colorama.Fore.GREEN,
-    "yellow" : colorama.Fore.YELLOW,
-    "blue" : colorama.Fore.BLUE,
-    "magenta" : colorama.Fore.MAGENTA,
-    "cyan" : colorama.Fore.CYAN,
-    "brightgreen" : colorama.Style.BRIGHT + colorama.Fore.GREEN,
-    "brightyellow" : colorama.Style.BRIGHT + colorama.Fore.YELLOW,
-    "brightred" : colorama.Style.BRIGHT + colorama.Fore.RED,
+    "red" : "\033[31m",
+    "green" : "\033[32m",
+    "yellow" : "\033[33m",
+    "blue" : "\033[34m",
+    "magenta" : "\033[35m",
+    "cyan" : "\033[36m",
+    "brightgreen" : _BRIGHT + "\033[32m",
+    "brightyellow" : _BRIGHT + "\033[33m",
+    "brightred" : _BRIGHT + "\033[31m",
     
-    "reset" : colorama.Style.RESET_ALL,
+    "reset" : _RESET_ALL,
 }
 
 
 def printColor(
     text : str,
     color : str,
-    endcolor : str = colorama.Style.RESET_ALL,
+    endcolor : str = _RESET_ALL,
     flush:bool=True,
     **kwargs
 ) -> None:
@@ -0,0 +1,227 @@
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+
+def edit_distance(a : str, b : str) -> int:
+    # Only needed for suggestions, so not imported with the console #
+    from Levenshtein import distance
+    return distance(a, b)
+
+
+class CharNode:
+    __slots__ = ("terminal", "children")
+
+    def __init__(self) -> None:
+        self.terminal : bool = False
+        self.children : Dict[str, "CharNode"] = dict()
+
+
+# Trie of words, to list the ones that start with a prefix without #
+# looking at the rest                                              #
+class WordTrie:
+    def __init__(self, words : Iterable[str] = ()) -> None:
+        self.root = CharNode()
+        for word in words:
+            self.add(word)
+
+    def add(self, word : str) -> None:
+        node = self.root
+        for c in word:
+            child = node.children.get(c)
+            if child is None:
+                child = CharNode()
+                node.children[c] = child
+            node = child
+        node.terminal = True
+
+    def complete(self, prefix : str) -> List[str]:
+        node = self.root
+        for c in prefix:
+            node = node.children.get(c)
+            if node is None:
+                return []
+        words : List[str] = []
+        stack : List[Tuple[str, CharNode]] = [(prefix, node)]
+        while len(stack) > 0:
+            word, node = stack.pop()
+            if node.terminal:
+                words.append(word)
+            for c, child in node.children.items():
+                stack.append((word + c, child))
+        return sorted(words)
+
+
+# Burkhard-Keller tree: finds the words within an edit distance of a #
+# word comparing it with only a few of them, thanks to the triangle  #
+# inequality. Nodes are [word, {distance: child}].                   #
+class BKTree:
+    def __init__(self, words : Iterable[str] = (), distance : Callable[[str, str], int] = edit_distance) -> None:
+        self.distance = distance
+        self.root : Optional[list] = None
+        for word in words:
+            self.add(word)
+
+    def add(self, word : str) -> None:
+        if self.root is None:
+            self.root = [word, dict()]
+            return
+        node = self.root
+        while True:
+            d = self.distance(word, node[0])
+            if d == 0:
+                return
+            child = node[1].get(d)
+            if child is None:
+                node[1][d] = [word, dict()]
+                return
+            node = child
+
+    # (distance, word) of the words within max_distance, closest first #
+    def search(self, word : str, max_distance : int) -> List[Tuple[int, str]]:
+        found : List[Tuple[int, str]] = []
+        stack : List[list] = [] if self.root is None else [self.root]
+        while len(stack) > 0:
+            node = stack.pop()
+            d = self.distance(word, node[0])
+            if d <= max_distance:
+                found.append((d, node[0]))
+            for child_d, child in node[1].items():
+                if d - max_distance <= child_d <= d + max_distance:
+                    stack.append(child)
+        return sorted(found)
+
+
+# Words indexed for completion and for suggestions after a typo #
+class WordIndex:
+    def __init__(self, words : Iterable[str] = ()) -> None:
+        self.words : List[str] = list(words)
+        self._set = set(self.words)
+        self.trie = WordTrie(self.words)
+        # Built on the first typo #
+        self._tree : Optional[BKTree] = None
+
+    def __contains__(self, word : str) -> bool:
+        return word in self._set
+
+    def complete(self, prefix : str) -> List[str]:
+        return self.trie.complete(prefix)
+
+    # Closest words to word, up to limit, if any is close enough #
+    def suggest(self, word : str, limit : int = 3) -> List[str]:
+        if self._tree is None:
+            self._tree = BKTree(self.words)
+        max_distance = 1 if len(word) <= 3 else 2
+        return [w for _, w in self._tree.search(word, max_distance)[:limit]]
+
+
+def joinOr(words : Sequence[str]) -> str:
+    if len(words) <= 1:
+        return "".join(words)
+    return ", ".join(words[:-1]) + " or " + words[-1]
+
+
+class Command:
+    def __init__(
+        self,
+        name : str,
+        handler : Optional[Callable] = None,
+        subcommands : Optional[Dict[str, Callable]] = None,
+        words : Sequence[str] = (),
+        config_args : bool = False,
+    ) -> None:
+        self.name = name
+        self.handler = handler
+        self.subcommands = subcommands
+        self.sub_index = WordIndex(subcommands) if subcommands is not None else None
+        # Arguments offered by completion #
+        self.words = WordIndex(words)
+        # Whether the arguments are names of saved configurations #
+        self.config_args = config_args
+
+
+# Console commands, with their subcommands (ADD REPO, DEL IGNORE...), and #
+# the names of the saved configurations, indexed for tab completion and  #
+# for "Did you mean...?" suggestions. config_names() gives the names and #
+# config_stamp() changes whenever they may have changed, so that they    #
+# are only indexed again after a change.                                 #
+class CommandRegistry:
+    def __init__(self, config_names : Callable[[], List[str]], config_stamp : Callable[[], object]) -> None:
+        self.commands : Dict[str, Command] = dict()
+        self._index : Optional[WordIndex] = None
+        self._config_names = config_names
+        self._config_stamp = config_stamp
+        self._configs : Optional[WordIndex] = None
+        self._configs_stamp : object = None
+
+    def register(self, name : str, handler : Optional[Callable] = None, **kwargs) -> None:
+        self.commands[name] = Command(name, handler, **kwargs)
+        self._index = None
+
+    @property
+    def index(self) -> WordIndex:
+        if self._index is None:
+            self._index = WordIndex(self.commands)
+        return self._index
+
+    def configs(self) -> WordIndex:
+        stamp = self._config_stamp()
+        if self._configs is None or stamp != self._configs_stamp:
+            self._configs = WordIndex(self._config_names())
+            self._configs_stamp = stamp
+        return self._configs
+
+    # Runs the command line already split in words #
+    def dispatch(self, words : List[str], config) -> None:
+        name = words[0].upper()
+        command = self.commands.get(name)
+        if command is None:
+            print(f"Unknown command: {name}")
+            printSuggestions(self.index.suggest(name))
+            return
+        args = words[1:]
+        if command.subcommands is None:
+            command.handler(args, config)
+            return
+        options = joinOr(list(command.subcommands))
+        if len(args) == 0:
+            print(f"Missing arguments for {name}. Needs to be {options}")
+            return
+        sub = args[0].upper()
+        if sub not in command.subcommands:
+            print(f"Error: {args[0]} is not a valid argument for {name}")
+            printSuggestions(command.sub_index.suggest(sub))
+            return
+        command.subcommands[sub](args[1:], config)
+
+    # Reports name as not a saved configuration, with the closest ones #
+    def unknownConfig(self, name : str) -> None:
+        print(f"Error: {name} is not a configuration")
+        printSuggestions(self.configs().suggest(name))
+
+    # Candidates for the last word of line, the input up to the cursor #
+    def complete(self, line : str) -> List[str]:
+        # Only the last of the commands separated by ";" #
+        segment = line[line.rfind(";") + 1:]
+        words = segment.split()
+        if segment == "" or segment[-1].isspace():
+            before, text = words, ""
+        else:
+            before, text = words[:-1], words[-1]
+        if len(before) == 0:
+            return self.index.complete(text.upper())
+        command = self.commands.get(before[0].upper())
+        if command is None:
+            return []
+        if command.sub_index is not None:
+            return command.sub_index.complete(text.upper()) if len(before) == 1 else []
+        candidates = command.words.complete(text.upper())
+        if command.config_args:
+            candidates += self.configs().complete(text)
+        return candidates
+
+
+def printSuggestions(words : List[str]) -> None:
+    if len(words) > 0:
+        print("\nDid you mean any of the following?\n    ", end="")
+        for k in words:
+            print(k, " ", end="")
+        print("")
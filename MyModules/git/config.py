@@ -1,12 +1,14 @@
 from pathlib import Path
 
+from .pathsets import PathSet
+
 class Config:
     idx = {"repos" : 0, "search": 1, "ignore": 2}
     
     def __init__(self, repos = [], search = [], ignore = []):
-        self.repos  = {Path(d) for d in repos}
-        self.search = {Path(d) for d in search}
-        self.ignore = {Path(d) for d in ignore}
+        self.repos  = PathSet(Path(d) for d in repos)
+        self.search = PathSet(Path(d) for d in search)
+        self.ignore = PathSet(Path(d) for d in ignore)
         self.all = [self.repos, self.search, self.ignore]
     
     def isEmpty(self) -> bool:
@@ -1,9 +1,14 @@
-import shlex
+from typing import Iterable, List, Optional
 from pathlib import Path
-from Levenshtein import distance as levenshtein_distance
-
-from .git_check import git_check, GitOptions
-from .json_readwrite import readJSON, writeJSON, getConfigList, listAllConfigs, purgeJSON_Console
+import asyncio, io, shlex, sys, threading, time
+
+from .git_check import git_check, git_check_repo, collect_repos, GitOptions
+from .report import RepoResult
+from .runner import AsyncGitRunner
+from .discovery import SearchOptions
+from .patterns import is_pattern, split_ignores
+from .json_readwrite import readJSON, writeJSON, getConfigList, listAllConfigs, purgeJSON_Console, config_store
+from .commands import CommandRegistry
 from .colors import *
 from .config import Config
 
@@ -42,7 +47,9 @@ def addIgnore(cmds, config: Config) -> None:
         return
     for d in cmds:
         p = Path(d)
-        if not p.is_dir():
+        if is_pattern(d):
+            config.addIgnore(d)
+        elif not p.is_dir():
             print(f"Error: {d} is not a directory.")
         else:
             config.addIgnore(d)
@@ -84,36 +91,6 @@ def delIgnore(cmds, config : Config) -> None:
             config.removeIgnore(d)
 
 
-def add(cmds, config: Config) -> None:
-    if len(cmds) == 0:
-        print("Missing arguments for ADD. Needs to be REPO, SEARCH or IGNORE")
-        return
-    
-    if cmds[0].upper() == "REPO":
-        addRepo(cmds[1:], config)
-    elif cmds[0].upper() == "SEARCH":
-        addSearch(cmds[1:], config)
-    elif cmds[0].upper() == "IGNORE":
-        addIgnore(cmds[1:], config)
-    else:
-        print(f"Error: {cmds[0]} is not a valid argument for ADD")
-
-
-def delete(cmds, config: Config) -> None:
-    if len(cmds) == 0:
-        print("Missing arguments for DEL. Needs to be REPO, SEARCH or IGNORE")
-        return
-    
-    if cmds[0].upper() == "REPO":
-        delRepo(cmds[1:], config)
-    elif cmds[0].upper() == "SEARCH":
-        delSearch(cmds[1:], config)
-    elif cmds[0].upper() == "IGNORE":
-        delIgnore(cmds[1:], config)
-    else:
-        print(f"Error: {cmds[0]} is not a valid argument for DEL")
-
-
 def useConfig(cmds, config: Config) -> None:
     if len(cmds) == 0:
         print("Missing arguments for USE")
@@ -126,7 +103,7 @@ def useConfig(cmds, config: Config) -> None:
     json_config_list = getConfigList()
     for name in cmds:
         if not name in json_config_list:
-            print(f"Error: {name} is not a configuration")
+            registry.unknownConfig(name)
         else:
             config_list.append(name)
     if (len(config_list) > 0):
@@ -184,7 +161,7 @@ def listConfigsVerbose(cmds, config: Config) -> None:
         json_config_list = getConfigList()
         for name in cmds:
             if not name in json_config_list:
-                print(f"Error: {name} is not a configuration")
+                registry.unknownConfig(name)
             else:
                 config_list.append(name)
         if (len(config_list) > 0):
@@ -210,7 +187,92 @@ def resetConfig(cmds, config: Config) -> None:
     print ("Configuration resetted")
 
 
+# A RUN BACKGROUND sweep, checked by a thread with an event loop of its #
+# own. Reports are kept as repositories finish and shown by STATUS and  #
+# WAIT, so that they do not get mixed with the prompt.                  #
+class BackgroundRun:
+    def __init__(self, repos : List[Path], search : List[Path], ignore : set, search_options : SearchOptions, options : GitOptions) -> None:
+        self.start_time = time.perf_counter()
+        self.end_time : Optional[float] = None
+        # Repositories to check, once the search is done #
+        self.total : Optional[int] = None
+        self.reports : List[RepoResult] = []
+        self.cancelled : bool = False
+        self.error : Optional[str] = None
+        self._shown : int = 0
+        self._lock = threading.Lock()
+        self._loop : Optional[asyncio.AbstractEventLoop] = None
+        self._task : Optional[asyncio.Task] = None
+        self._thread = threading.Thread(
+            target=self._main, args=(repos, search, ignore, search_options, options), daemon=True
+        )
+        self._thread.start()
+
+    def _main(self, *args) -> None:
+        try:
+            asyncio.run(self._sweep(*args))
+        except asyncio.CancelledError:
+            self.cancelled = True
+        except Exception as e:
+            self.error = str(e)
+        self.end_time = time.perf_counter()
+
+    async def _sweep(self, repos, search, ignore, search_options, options) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._task = asyncio.current_task()
+        if self.cancelled:
+            return
+        repo_list = collect_repos(repos, search, ignore, False, None, search_options)
+        self.total = len(repo_list)
+        runner = AsyncGitRunner(max_processes=1)
+        for dir in repo_list:
+            out = io.StringIO()
+            report = await git_check_repo(dir, options, runner, out)
+            report.output = out.getvalue()
+            with self._lock:
+                self.reports.append(report)
+
+    @property
+    def running(self) -> bool:
+        return self._thread.is_alive()
+
+    def cancel(self) -> None:
+        self.cancelled = True
+        if self._loop is not None and self._task is not None:
+            self._loop.call_soon_threadsafe(self._task.cancel)
+
+    # Waits up to timeout seconds, or until the run ends if None #
+    def wait(self, timeout : Optional[float] = None) -> None:
+        if timeout is not None:
+            self._thread.join(timeout)
+            return
+        # Short joins, so that Ctrl+C still reaches the console #
+        while self._thread.is_alive():
+            self._thread.join(0.2)
+
+    # Reports that finished since the last call #
+    def newReports(self) -> List[RepoResult]:
+        with self._lock:
+            reports = self.reports[self._shown:]
+            self._shown = len(self.reports)
+        return reports
+
+    def progress(self) -> str:
+        total = "?" if self.total is None else str(self.total)
+        end = time.perf_counter() if self.end_time is None else self.end_time
+        return f"{len(self.reports)}/{total} repositories checked in {end - self.start_time:.1f} s"
+
+
+background_run : Optional[BackgroundRun] = None
+
+
+def printNewReports(run : BackgroundRun) -> None:
+    for report in run.newReports():
+        print(report.output, end="")
+
+
 def run(cmds, config: Config) -> None:
+    global background_run
     if config.isEmpty():
         print("Error: Cannot run empty configuration")
         return
@@ -218,6 +280,7 @@ def run(cmds, config: Config) -> None:
     commit = False
     push = False
     pull = False
+    background = False
     for c in cmds:
         cmd = c.upper()
         if cmd in ["STATUS", "NOCOMMIT", "NOPUSH", "NOPULL"]:
@@ -230,84 +293,163 @@ def run(cmds, config: Config) -> None:
             push = True
         elif cmd == "PULL":
             pull = True
+        elif cmd == "BACKGROUND":
+            background = True
         else:
             print(f"Error: {cmd} is not a valid argument for RUN")
             return
 
     options = GitOptions(status, commit, push, pull)
+    ignore, ignore_patterns = split_ignores(config.ignore)
+    search_options = SearchOptions(ignore_patterns=ignore_patterns)
+
+    if background:
+        if background_run is not None and background_run.running:
+            print("Error: A background run is already running. Use WAIT or CANCEL first")
+            return
+        background_run = BackgroundRun(sorted(config.repos), sorted(config.search), set(ignore), search_options, options)
+        print("Background run started. Use STATUS, WAIT or CANCEL")
+        return
 
     try:
         git_check(
             sorted(config.repos),
             sorted(config.search),
-            config.ignore,
+            set(ignore),
             options,
             recursive = False,
-            recursive_max_level = None
+            recursive_max_level = None,
+            search_options = search_options
         )
     except KeyboardInterrupt:
         print("\nRun interrupted")
 
 
-input_method = {
-    "EXIT" : lambda _, __: exit(1),
-    "HELP" : help,
+def runStatus(cmds, config: Config) -> None:
+    if len(cmds) > 0:
+        print("STATUS takes no arguments")
+        return
+    if background_run is None:
+        print("No background run")
+        return
+    printNewReports(background_run)
+    state = "running" if background_run.running else "finished"
+    print(f"\nBackground run {state}: {background_run.progress()}")
+
+
+def runWait(cmds, config: Config) -> None:
+    if len(cmds) > 0:
+        print("WAIT takes no arguments")
+        return
+    if background_run is None:
+        print("No background run")
+        return
+    try:
+        # Reports are shown as they arrive #
+        while background_run.running:
+            printNewReports(background_run)
+            background_run.wait(0.2)
+    except KeyboardInterrupt:
+        print("\nStopped waiting. The run goes on in the background")
+        return
+    printNewReports(background_run)
+    finishMessage(background_run)
 
-    "ADD"  : add,
-    "DEL"  : delete,
 
-    "USE" : useConfig,
-    "SET" : setConfig,
+def runCancel(cmds, config: Config) -> None:
+    if len(cmds) > 0:
+        print("CANCEL takes no arguments")
+        return
+    if background_run is None or not background_run.running:
+        print("No background run is running")
+        return
+    background_run.cancel()
+    background_run.wait()
+    printNewReports(background_run)
+    finishMessage(background_run)
+
 
-    "SHOW": showConfig,
-    "LIST": listConfigs,
-    "VERBOSE": listConfigsVerbose,
+def finishMessage(run : BackgroundRun) -> None:
+    if run.error is not None:
+        print(f"\nBackground run failed: {run.error}")
+    elif run.cancelled:
+        print(f"\nBackground run cancelled: {run.progress()}")
+    else:
+        print(f"\nBackground run finished: {run.progress()}")
 
-    "PURGE": purgeConfigs,
 
-    "RESET": resetConfig,
+# A background run is not left behind: its git commands run in sessions #
+# of their own and would outlive the console                             #
+def stopBackgroundRun() -> None:
+    if background_run is not None and background_run.running:
+        background_run.cancel()
+        background_run.wait()
 
-    "RUN": run,
-}
 
+def exitConsole(cmds, config: Config) -> None:
+    stopBackgroundRun()
+    exit(1)
+
+
+registry = CommandRegistry(getConfigList, config_store.stamp)
+registry.register("EXIT", exitConsole)
+registry.register("HELP", help)
+registry.register("ADD", subcommands={"REPO" : addRepo, "SEARCH" : addSearch, "IGNORE" : addIgnore})
+registry.register("DEL", subcommands={"REPO" : delRepo, "SEARCH" : delSearch, "IGNORE" : delIgnore})
+registry.register("USE", useConfig, config_args=True)
+registry.register("SET", setConfig, config_args=True)
+registry.register("SHOW", showConfig)
+registry.register("LIST", listConfigs)
+registry.register("VERBOSE", listConfigsVerbose, config_args=True)
+registry.register("PURGE", purgeConfigs)
+registry.register("RESET", resetConfig)
+registry.register("RUN", run, words=["STATUS", "NO-STATUS", "COMMIT", "PUSH", "PULL", "BACKGROUND"])
+registry.register("STATUS", runStatus)
+registry.register("WAIT", runWait)
+registry.register("CANCEL", runCancel)
 
-def keyError(key: str) -> None:
-    print(f"Unknown command: {key}")
-    # Find closest matches in input_methods
-    matches = [i for i in input_method if levenshtein_distance(i, key) <= 1]
-    if len(matches) > 0:
-        print("\nDid you mean any of the following?\n    ", end="")
-        for k in matches:
-            print(k, " ", end="")
-        print("")
+
+# Words of a command. A trailing backslash of any of them is dropped #
+def splitCommand(cmd : str) -> List[str]:
+    return [word.rstrip("\\") for word in shlex.split(cmd.rstrip("\\"))]
 
 
 def interpretInput(input_str: str, config: Config) -> None:
     # Get command from user, that might be a list of commands separated by ";"
     cmd_set = [i.strip() for i in input_str.split(";") if i.strip() != ""]
     for cmd in cmd_set:
-        # Split command into command and arguments
-        while cmd[-1] == "\\":
-            cmd = cmd[:-1]
-        cmd_split = shlex.split(cmd)
-        for i in range(1, len(cmd_split)):
-            while cmd_split[i][-1] == "\\":
-                cmd_split[i] = cmd_split[i][:-1]
-        
-        current_cmd = cmd_split[0].upper()
-        key_ok = False
         try:
-            # Reach method for each command
-            method = input_method[current_cmd]
-            key_ok = True
-        except KeyError:
-            keyError(current_cmd)
-        
-        if key_ok:
-            method(cmd_split[1:], config)
+            words = splitCommand(cmd)
+        except ValueError as e:
+            print(f"Error: {e}")
+            continue
+        if len(words) > 0:
+            registry.dispatch(words, config)
+
+
+# Tab completion of commands, subcommands and configuration names, where #
+# readline is available                                                  #
+def enableCompletion() -> None:
+    try:
+        import readline
+    except ImportError:
+        return
+    matches : List[str] = []
+
+    def completer(text : str, state : int) -> Optional[str]:
+        nonlocal matches
+        if state == 0:
+            matches = registry.complete(readline.get_line_buffer()[:readline.get_endidx()])
+        return matches[state] if state < len(matches) else None
+
+    readline.set_completer_delims(" \t;")
+    readline.set_completer(completer)
+    readline.parse_and_bind("tab: complete")
 
 
 def loop(config: Config) -> None:
+    if sys.stdin.isatty():
+        enableCompletion()
     # Loop over all commands except for a Keyboard interrupt
     try:
         while True:
@@ -317,9 +459,48 @@ def loop(config: Config) -> None:
     except KeyboardInterrupt:
         print("\nKeyboardInterrupt")
         exit(1)
+    except EOFError:
+        # Input piped from a file #
+        print("")
+        if background_run is not None and background_run.running:
+            runWait([], config)
+
+
+# Runs the commands in lines, one per line, as if typed. Empty lines and #
+# lines starting with "#" are skipped. A script that leaves a background #
+# run running waits for it at the end.                                   #
+def runScript(lines : Iterable[str], config: Config) -> None:
+    try:
+        for line in lines:
+            line = line.strip()
+            if line == "" or line.startswith("#"):
+                continue
+            print(f">>> {line}")
+            interpretInput(line, config)
+        if background_run is not None and background_run.running:
+            runWait([], config)
+    except KeyboardInterrupt:
+        print("\nKeyboardInterrupt")
+        exit(1)
 
 
-def main() -> None:
+# script is a file of commands, "-" for stdin, or None for the prompt #
+def main(script : Optional[str] = None) -> None:
     # Create an empty config and begin loop
-    loop(Config())
+    config = Config()
+    try:
+        if script is None:
+            loop(config)
+        elif script == "-":
+            runScript(sys.stdin, config)
+        else:
+            try:
+                fin = open(script, "r")
+            except OSError as e:
+                print(f"Error: Could not read script {script}: {e}")
+                exit(1)
+            with fin:
+                runScript(fin, config)
+    finally:
+        stopBackgroundRun()
     exit(0)
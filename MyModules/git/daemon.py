@@ -0,0 +1,208 @@
+from typing import Dict, List, Optional, Set, Tuple
+from pathlib import Path
+import io, json, os, socket, tempfile, time
+
+from .git_check import git_check_repo, collect_repos, GitOptions
+from .discovery import SearchOptions
+from .remotes import FetchOptions
+from .report import RepoResult
+from .runner import AsyncGitRunner
+from .watch import watch_repos, WatchOptions
+
+
+# git_check --daemon keeps the latest result of every repository in     #
+# memory, kept up to date by the --watch machinery, and answers queries  #
+# on a Unix socket. Protocol: one JSON object per line in each direction #
+#                                                                        #
+#   {"cmd": "ping"}                     -> {"ok": true}                  #
+#   {"cmd": "status", "path": <dir>}    -> {"ok": true, "result": {...}} #
+#   {"cmd": "list"}                     -> {"ok": true, "results": []}   #
+#   {"cmd": "refresh"[, "path": <dir>][, "fetch": true]}                 #
+#                                       -> as "status", or as "list"     #
+#   {"cmd": "stop"}                     -> {"ok": true}                  #
+#                                                                        #
+# "path" may be any directory inside a repository. Results are the       #
+# RepoResult.to_dict() of the last check, plus its "age" in seconds.     #
+# Errors are answered with {"ok": false, "error": <message>}.            #
+
+
+def supported() -> bool:
+    return os.name == "posix" and hasattr(socket, "AF_UNIX")
+
+
+def default_socket_path() -> Path:
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR")
+    if runtime_dir:
+        return Path(runtime_dir) / "git_check.sock"
+    return Path(tempfile.gettempdir()) / f"git_check-{os.getuid()}.sock"
+
+
+# Sends one request and returns the answer. Raises OSError if there is no #
+# daemon listening on socket_path.                                        #
+def query(request : dict, socket_path : Optional[Path] = None, timeout : Optional[float] = 5.0) -> dict:
+    if socket_path is None:
+        socket_path = default_socket_path()
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(str(socket_path))
+        sock.sendall((json.dumps(request) + "\n").encode())
+        data = b""
+        while not data.endswith(b"\n"):
+            chunk = sock.recv(64 * 1024)
+            if len(chunk) == 0:
+                break
+            data += chunk
+    return json.loads(data.decode())
+
+
+class DaemonState:
+    def __init__(self, repo_list : List[Path]) -> None:
+        self.repo_list = repo_list
+        # repository -> (time of the check, result) #
+        self.results : Dict[Path, Tuple[float, dict]] = dict()
+
+    def update(self, report : RepoResult, changes : Dict[str, tuple] = dict()) -> None:
+        self.results[report.path] = (time.time(), report.to_dict())
+
+    # Repository holding path, or None #
+    def find(self, path : str) -> Optional[Path]:
+        target = Path(path).absolute()
+        for dir in [target, *target.parents]:
+            if dir in self.results or dir in self.repo_list:
+                return dir
+        return None
+
+    def answer(self, repo : Path) -> dict:
+        if repo not in self.results:
+            return {"ok" : False, "error" : f"{repo} has not been checked yet"}
+        checked, result = self.results[repo]
+        return {"ok" : True, "result" : {**result, "age" : round(time.time() - checked, 3)}}
+
+    def answer_all(self) -> dict:
+        return {"ok" : True, "results" : [self.answer(repo)["result"] for repo in self.repo_list if repo in self.results]}
+
+
+async def serve(
+    repo_list : List[Path],
+    options : GitOptions,
+    runner : AsyncGitRunner,
+    jobs : int,
+    fetch_options : FetchOptions,
+    watch_options : WatchOptions,
+    socket_path : Path,
+) -> None:
+    import asyncio
+    state = DaemonState(repo_list)
+    stopped = asyncio.Event()
+    no_fetch = FetchOptions(enabled=False)
+
+    async def refresh(repo : Path, fetch : bool) -> None:
+        report = await git_check_repo(repo, options, runner, io.StringIO(), fetch_options if fetch else no_fetch)
+        state.update(report)
+
+    async def handle(request : dict) -> dict:
+        cmd = request.get("cmd")
+        if cmd == "ping":
+            return {"ok" : True}
+        if cmd == "stop":
+            stopped.set()
+            return {"ok" : True}
+        if cmd == "list":
+            return state.answer_all()
+        if cmd in ["status", "refresh"]:
+            path = request.get("path")
+            repo = None
+            if path is not None:
+                repo = state.find(str(path))
+                if repo is None:
+                    return {"ok" : False, "error" : f"{path} is not in a watched repository"}
+            if cmd == "status":
+                if repo is None:
+                    return {"ok" : False, "error" : "missing path"}
+                return state.answer(repo)
+            targets = repo_list if repo is None else [repo]
+            await asyncio.gather(*(refresh(r, bool(request.get("fetch", False))) for r in targets))
+            return state.answer_all() if repo is None else state.answer(repo)
+        return {"ok" : False, "error" : f"unknown command: {cmd}"}
+
+    async def client(reader : asyncio.StreamReader, writer : asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                line = await reader.readline()
+                if len(line) == 0:
+                    break
+                try:
+                    request = json.loads(line.decode())
+                    if type(request) is not dict:
+                        raise ValueError("request must be a JSON object")
+                    answer = await handle(request)
+                except ValueError as e:
+                    answer = {"ok" : False, "error" : f"bad request: {e}"}
+                writer.write((json.dumps(answer) + "\n").encode())
+                await writer.drain()
+                if stopped.is_set():
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    # A socket left by a daemon that did not exit cleanly is replaced #
+    if socket_path.exists():
+        try:
+            query({"cmd" : "ping"}, socket_path, timeout=1.0)
+        except (OSError, ValueError):
+            socket_path.unlink()
+        else:
+            raise RuntimeError(f"A daemon is already listening on {socket_path}")
+
+    old_umask = os.umask(0o077)
+    try:
+        server = await asyncio.start_unix_server(client, path=str(socket_path))
+    finally:
+        os.umask(old_umask)
+    print(f"\nListening on {socket_path}", flush=True)
+
+    watch_task = asyncio.ensure_future(watch_repos(
+        repo_list, options, runner, jobs, fetch_options, watch_options, "none", state.update
+    ))
+    stop_task = asyncio.ensure_future(stopped.wait())
+    try:
+        async with server:
+            done, _ = await asyncio.wait([watch_task, stop_task], return_when=asyncio.FIRST_COMPLETED)
+            if watch_task in done:
+                watch_task.result()
+    finally:
+        watch_task.cancel()
+        stop_task.cancel()
+        try:
+            socket_path.unlink()
+        except OSError:
+            pass
+
+
+def git_daemon(
+    dir_list : List[Path],
+    search_list : List[Path],
+    ignore_set : Set[Path],
+    options : GitOptions,
+    recursive : bool,
+    recursive_max_level : Optional[int],
+    jobs : int = 1,
+    runner : Optional[AsyncGitRunner] = None,
+    search_options : Optional[SearchOptions] = None,
+    fetch_options : Optional[FetchOptions] = None,
+    watch_options : Optional[WatchOptions] = None,
+    socket_path : Optional[Path] = None,
+) -> None:
+    import asyncio
+    if runner is None:
+        runner = AsyncGitRunner(max_processes=jobs)
+    if fetch_options is None:
+        fetch_options = FetchOptions()
+    if watch_options is None:
+        watch_options = WatchOptions()
+    if socket_path is None:
+        socket_path = default_socket_path()
+    repo_list = collect_repos(dir_list, search_list, ignore_set, recursive, recursive_max_level, search_options)
+    asyncio.run(serve(repo_list, options, runner, jobs, fetch_options, watch_options, socket_path))
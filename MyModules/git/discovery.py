@@ -0,0 +1,324 @@
+from typing import Dict, List, Optional, Set, Tuple, Union
+from pathlib import Path
+import json, os, sys
+
+from .pathsets import PathLike, PathSet, PathTrie, TrieNode
+from .patterns import IgnorePatterns
+from .colors import printColor, stdcolors
+
+
+# Kinds of repository layout recognised by repo_kind() #
+GIT_DIR  = "git_dir"    # <repo>/.git is a directory
+GIT_FILE = "git_file"   # <repo>/.git is a "gitdir: ..." file (worktrees, submodules)
+BARE     = "bare"       # <repo> itself holds HEAD, objects/ and refs/
+
+
+def scan_dir(path : Path) -> Optional[Dict[str, os.DirEntry]]:
+    try:
+        with os.scandir(path) as it:
+            return {entry.name : entry for entry in it}
+    except OSError:
+        return None
+
+
+def is_gitfile(path : str) -> bool:
+    try:
+        with open(path, "r", encoding="utf-8", errors="replace") as fin:
+            return fin.read(8) == "gitdir: "
+    except OSError:
+        return False
+
+
+# Tells whether the directory whose entries are given is a repository, only #
+# looking at the filesystem. Returns one of GIT_DIR, GIT_FILE, BARE or None. #
+def repo_kind_from_entries(entries : Dict[str, os.DirEntry]) -> Optional[str]:
+    git = entries.get(".git")
+    if git is not None:
+        if git.is_dir():
+            if os.path.isfile(os.path.join(git.path, "HEAD")):
+                return GIT_DIR
+        elif git.is_file():
+            if is_gitfile(git.path):
+                return GIT_FILE
+
+    head = entries.get("HEAD")
+    objects = entries.get("objects")
+    refs = entries.get("refs")
+    if head is not None and objects is not None and refs is not None:
+        if head.is_file() and objects.is_dir() and refs.is_dir():
+            return BARE
+
+    return None
+
+
+def repo_kind(path : Path) -> Optional[str]:
+    entries = scan_dir(path)
+    if entries is None:
+        return None
+    return repo_kind_from_entries(entries)
+
+
+# Returns (git dir, common git dir) of the repository at path, or None.  #
+# They differ for linked worktrees, whose git dir holds HEAD, index and  #
+# FETCH_HEAD while config, objects and refs live in the common git dir.  #
+def git_dirs(path : Path) -> Optional[Tuple[Path, Path]]:
+    dot_git = path / ".git"
+    if dot_git.is_dir():
+        return dot_git, dot_git
+    if dot_git.is_file():
+        try:
+            with dot_git.open("r", encoding="utf-8", errors="replace") as fin:
+                line = fin.readline().strip()
+        except OSError:
+            return None
+        if not line.startswith("gitdir: "):
+            return None
+        git_dir = Path(line[len("gitdir: "):])
+        if not git_dir.is_absolute():
+            git_dir = path / git_dir
+        common_dir = git_dir
+        try:
+            with (git_dir / "commondir").open("r", encoding="utf-8", errors="replace") as fin:
+                common = Path(fin.readline().strip())
+            common_dir = common if common.is_absolute() else git_dir / common
+        except OSError:
+            pass
+        return git_dir, common_dir
+    if repo_kind(path) == BARE:
+        return path, path
+    return None
+
+
+# Directory names that are never searched for repositories #
+DEFAULT_SKIP_DIRS : Set[str] = {
+    "node_modules", "bower_components",
+    ".venv", "venv", ".tox", ".nox", "__pycache__",
+    ".mypy_cache", ".pytest_cache", ".ruff_cache",
+    "build", "dist", "target", "_build", ".gradle",
+    ".cache", ".Trash",
+}
+
+
+# On-disk record of the directories walked by find_repos(). For every #
+# search root, recursion depth and symlink policy it stores, per       #
+# directory, its mtime, whether it is a repository and the names of    #
+# its subdirectories. A directory whose mtime did not change since the #
+# last walk is not read again: adding or removing entries changes the  #
+# mtime of the directory that holds them.                              #
+class DiscoveryCache:
+    default_path : Path = Path(__file__).parent / "discovery_cache.json"
+
+    def __init__(self, path : Optional[Path] = None, rescan : bool = False) -> None:
+        self.path = DiscoveryCache.default_path if path is None else path
+        self.rescan = rescan
+        self._data : Optional[Dict[str, Dict[str, list]]] = None
+
+    @staticmethod
+    def key(root : Path, recursive_max_level : Optional[int], follow_symlinks : bool) -> str:
+        depth = "all" if recursive_max_level is None else str(recursive_max_level)
+        return f"{root}|{depth}|{'follow' if follow_symlinks else 'nofollow'}"
+
+    def load(self) -> Dict[str, Dict[str, list]]:
+        if self._data is None:
+            self._data = dict()
+            if self.path.is_file():
+                try:
+                    with self.path.open() as fin:
+                        data = json.load(fin)
+                    if type(data) is dict:
+                        self._data = data
+                except (OSError, ValueError):
+                    pass
+        return self._data
+
+    # Nodes of a previous walk, or None if they must not be used #
+    def get(self, key : str) -> Optional[Dict[str, list]]:
+        if self.rescan:
+            return None
+        return self.load().get(key)
+
+    def set(self, key : str, nodes : Dict[str, list]) -> None:
+        self.load()[key] = nodes
+
+    def save(self) -> None:
+        # One per process, so that concurrent runs do not write the same one #
+        tmp_path = self.path.with_name(f"{self.path.name}.{os.getpid()}.tmp")
+        try:
+            with tmp_path.open("w") as fout:
+                json.dump(self.load(), fout)
+            os.replace(tmp_path, self.path)
+        except OSError:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+
+
+class SearchOptions:
+    def __init__(
+        self,
+        follow_symlinks : bool = False,
+        threads : int = 8,
+        skip_names : Optional[Set[str]] = None,
+        cache : Optional[DiscoveryCache] = None,
+        ignore_patterns : Optional[IgnorePatterns] = None,
+    ) -> None:
+        self.follow_symlinks = follow_symlinks
+        self.threads = max(1, threads)
+        self.skip_names = set(DEFAULT_SKIP_DIRS if skip_names is None else skip_names)
+        self.cache = cache
+        self.ignore_patterns = ignore_patterns
+
+
+# Node of a walked directory: [mtime_ns, repo kind or None, subdirectory names] #
+DirNode = list
+
+
+# Reads a directory, or takes it from old_nodes if its mtime did not change. #
+# Returns None if it cannot be read, else its node and its stat result (only #
+# if the mtime was needed or follow_symlinks is set).                        #
+def probe_dir(
+    path : PathLike,
+    follow_symlinks : bool,
+    old_nodes : Optional[Dict[str, DirNode]],
+    use_cache : bool,
+) -> Optional[Tuple[DirNode, Optional[os.stat_result]]]:
+    st : Optional[os.stat_result] = None
+    if use_cache or follow_symlinks:
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        if old_nodes is not None:
+            node = old_nodes.get(str(path))
+            if node is not None and node[0] == st.st_mtime_ns:
+                return node, st
+
+    entries = scan_dir(path)
+    if entries is None:
+        return None
+    kind = repo_kind_from_entries(entries)
+    names = sorted(name for name, entry in entries.items() if entry.is_dir(follow_symlinks=follow_symlinks))
+    return [st.st_mtime_ns if st is not None else 0, kind, names], st
+
+
+# Finds the repositories under the directories in search_list. The children #
+# of every search directory are candidates; if recursive, the children of   #
+# candidates that are not repositories are candidates too, down to          #
+# recursive_max_level levels (None for no limit). Repositories are never    #
+# descended into. Directories in ignore_set or checked_dirs, named as one  #
+# of search_options.skip_names or matching search_options.ignore_patterns   #
+# are skipped, without being read, and the directories found are added to  #
+# checked_dirs.                                                             #
+# The tree is walked level by level, and all the directories of a level are #
+# read at the same time by a pool of search_options.threads threads.        #
+# Directories are handled as strings while walking: ignore_set is turned    #
+# into a PathTrie whose nodes are followed alongside the directories, so    #
+# telling whether an entry is ignored is a dict lookup of its name.         #
+def find_repos(
+    search_list : List[Path],
+    ignore_set : Union[Set[Path], PathSet, PathTrie],
+    recursive : bool,
+    recursive_max_level : Optional[int],
+    checked_dirs : Union[Set[Path], PathSet],
+    search_options : Optional[SearchOptions] = None,
+) -> List[Path]:
+    if search_options is None:
+        search_options = SearchOptions()
+    follow_symlinks : bool = search_options.follow_symlinks
+    skip_names : Set[str] = search_options.skip_names
+    cache : Optional[DiscoveryCache] = search_options.cache
+    patterns : Optional[IgnorePatterns] = search_options.ignore_patterns or None
+    if patterns is not None:
+        patterns.compile()
+    if not recursive:
+        recursive_max_level = 0
+    ignore_trie : PathTrie = ignore_set if isinstance(ignore_set, PathTrie) else PathTrie(ignore_set)
+    if not isinstance(checked_dirs, PathSet):
+        # Plain sets hold Path objects #
+        checked_paths = checked_dirs
+        checked_dirs = PathSet(checked_paths)
+    else:
+        checked_paths = None
+
+    repos : List[str] = []
+    # Identity of every directory walked, to detect symlink loops #
+    visited : Set[Tuple[int, int]] = set()
+
+    roots : List[str] = [str(dir) for dir in search_list if dir not in ignore_trie]
+    # Length of "<root>/", to make paths relative to their root #
+    root_lengths : List[int] = [len(os.path.join(root, "")) for root in roots]
+    old_trees : List[Optional[Dict[str, DirNode]]] = [None] * len(roots)
+    new_trees : List[Dict[str, DirNode]] = [dict() for _ in roots]
+    if cache is not None:
+        for i, root in enumerate(roots):
+            old_trees[i] = cache.get(DiscoveryCache.key(Path(root), recursive_max_level, follow_symlinks))
+
+    def probe(item : Tuple[int, str]):
+        i, path = item
+        return probe_dir(path, follow_symlinks, old_trees[i], cache is not None)
+
+    from concurrent.futures import ThreadPoolExecutor
+    pool = ThreadPoolExecutor(max_workers=search_options.threads)
+    try:
+        # (root index, directory, subdirectory names, ignore trie node) #
+        frontier : List[Tuple[int, str, List[str], Optional[TrieNode]]] = []
+        for i, (dir, probed) in enumerate(zip(roots, pool.map(probe, enumerate(roots)))):
+            if probed is None:
+                printColor(f"WARNING: {dir} is not a directory that can be read. Skipping it.", stdcolors["brightyellow"], file=sys.stderr)
+                continue
+            node, st = probed
+            new_trees[i][dir] = node
+            frontier.append((i, dir, node[2], ignore_trie.node(dir)))
+            if st is not None:
+                visited.add((st.st_dev, st.st_ino))
+
+        level : int = 0
+        while len(frontier) > 0:
+            candidates : List[Tuple[int, str]] = []
+            candidate_nodes : List[Optional[TrieNode]] = []
+            for i, dir, names, ignore_node in frontier:
+                for name in names:
+                    if name in skip_names:
+                        continue
+                    child_node : Optional[TrieNode] = None
+                    if ignore_node is not None:
+                        child_node = ignore_node.children.get(name)
+                        if child_node is not None and child_node.terminal:
+                            continue
+                    d = os.path.join(dir, name)
+                    if d in checked_dirs:
+                        continue
+                    if patterns is not None and patterns.matches(d, d[root_lengths[i]:]):
+                        continue
+                    candidates.append((i, d))
+                    candidate_nodes.append(child_node)
+
+            descend : bool = recursive_max_level is None or level < recursive_max_level
+            frontier = []
+            for (i, d), ignore_node, probed in zip(candidates, candidate_nodes, pool.map(probe, candidates)):
+                if probed is None:
+                    continue
+                node, st = probed
+                if follow_symlinks:
+                    if (st.st_dev, st.st_ino) in visited:
+                        continue
+                    visited.add((st.st_dev, st.st_ino))
+                new_trees[i][d] = node
+                checked_dirs.add(d)
+                if node[1] is not None:
+                    repos.append(d)
+                elif descend:
+                    frontier.append((i, d, node[2], ignore_node))
+            level += 1
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    if cache is not None:
+        for root, nodes in zip(roots, new_trees):
+            cache.set(DiscoveryCache.key(Path(root), recursive_max_level, follow_symlinks), nodes)
+        cache.save()
+
+    if checked_paths is not None:
+        checked_paths.update(checked_dirs)
+    return sorted(Path(d) for d in repos)
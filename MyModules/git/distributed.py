@@ -0,0 +1,281 @@
+from typing import Dict, List, Optional, Set, Tuple
+from pathlib import Path
+import asyncio, json, os, shlex, sys, time
+
+from .git_check import collect_repos, GitOptions
+from .discovery import SearchOptions
+from .processes import check_indexed, make_shards, ResultPrinter
+from .remotes import FetchOptions
+from .report import RepoResult
+from .runner import AsyncGitRunner
+from .status_cache import StatusCache
+
+
+# Directory that holds the MyModules package #
+PACKAGE_ROOT : Path = Path(__file__).resolve().parents[2]
+
+
+# A way of starting "python -m MyModules.git --worker" somewhere. The worker #
+# reads one JSON shard from stdin and writes one JSON line per repository   #
+# to stdout (see worker_main()). Other transports only need a name and the  #
+# command and environment that start a worker.                              #
+class Transport:
+    name : str = "transport"
+    # Whether the environment added to git commands here applies there #
+    same_host : bool = False
+
+    def command(self) -> List[str]:
+        raise NotImplementedError
+
+    def env(self) -> Optional[Dict[str, str]]:
+        return None
+
+
+class LocalTransport(Transport):
+    same_host = True
+
+    def __init__(self, index : int = 0) -> None:
+        self.name = f"local#{index}"
+
+    def command(self) -> List[str]:
+        return [sys.executable, "-m", "MyModules.git", "--worker"]
+
+    def env(self) -> Optional[Dict[str, str]]:
+        python_path = os.environ.get("PYTHONPATH")
+        return {**os.environ, "PYTHONPATH" : str(PACKAGE_ROOT) + ("" if not python_path else os.pathsep + python_path)}
+
+
+# Runs the worker on host through ssh, from package_root on that host #
+# (by default, the same directory as here) with python there.         #
+class SSHTransport(Transport):
+    def __init__(self, host : str, package_root : Optional[str] = None, python : str = "python3") -> None:
+        self.name = f"ssh:{host}"
+        self.host = host
+        self.package_root = str(PACKAGE_ROOT) if package_root is None else package_root
+        self.python = python
+
+    def command(self) -> List[str]:
+        remote = f"cd {shlex.quote(self.package_root)} && {shlex.quote(self.python)} -m MyModules.git --worker"
+        return ["ssh", "-o", "BatchMode=yes", self.host, remote]
+
+
+# Parses "local", "local:<n>" (n local workers), "ssh:<host>" or #
+# "ssh:<host>:<package root>". Returns None if spec is not valid. #
+def parse_transports(spec : str) -> Optional[List[Transport]]:
+    kind, _, rest = spec.partition(":")
+    if kind == "local":
+        if rest == "":
+            return [LocalTransport()]
+        if not rest.isdigit() or int(rest) == 0:
+            return None
+        return [LocalTransport(i) for i in range(int(rest))]
+    if kind == "ssh" and rest != "":
+        host, _, package_root = rest.partition(":")
+        return [SSHTransport(host, package_root or None)]
+    return None
+
+
+# --worker: checks the shard read from stdin and streams the results #
+def worker_main() -> None:
+    spec = json.loads(sys.stdin.readline())
+    options = GitOptions(**spec["options"])
+    runner = AsyncGitRunner(max_processes=spec["jobs"], timeouts=spec["timeouts"], env=spec["env"], deadline=spec.get("deadline"))
+    fetch_options = FetchOptions(**spec["fetch"])
+    # Only read here: the entries go back to the coordinator, which saves them #
+    status_cache : Optional[StatusCache] = None
+    if spec.get("cache_max_age") is not None:
+        status_cache = StatusCache(Path(spec["cache_path"]), spec["cache_max_age"])
+    items = [(index, Path(path)) for index, path in spec["repos"]]
+
+    def emit(index : int, report : RepoResult) -> None:
+        sys.stdout.write(json.dumps({"index" : index, "result" : report.to_wire()}) + "\n")
+        sys.stdout.flush()
+
+    asyncio.run(check_indexed(items, options, runner, spec["jobs"], fetch_options, status_cache, emit))
+    entries = {} if status_cache is None else status_cache.entries([dir for _, dir in items])
+    sys.stdout.write(json.dumps({"event" : "done", "cache" : entries}) + "\n")
+    sys.stdout.flush()
+
+
+# Runs shard on a worker started by transport, passing each result to #
+# printer and the status cache entries of a worker on this host to    #
+# status_cache. Returns the items that got no result.                 #
+async def run_remote_shard(
+    transport : Transport,
+    shard : List[Tuple[int, Path]],
+    spec : dict,
+    printer : ResultPrinter,
+    status_cache : Optional[StatusCache] = None,
+) -> List[Tuple[int, Path]]:
+    done : Set[int] = set()
+    error : str = ""
+    try:
+        proc = await asyncio.create_subprocess_exec(
+            *transport.command(),
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            env=transport.env(),
+            limit=16 * 1024 * 1024,
+        )
+        stderr_task = asyncio.ensure_future(proc.stderr.read())
+        try:
+            shard_spec = {**spec, "repos" : [(i, str(p)) for i, p in shard]}
+            if not transport.same_host or status_cache is None:
+                shard_spec["cache_max_age"] = None
+            else:
+                shard_spec["cache_path"] = str(status_cache.path)
+            if not transport.same_host:
+                shard_spec["env"] = {}
+            proc.stdin.write((json.dumps(shard_spec) + "\n").encode())
+            await proc.stdin.drain()
+            proc.stdin.close()
+            async for line in proc.stdout:
+                try:
+                    record = json.loads(line.decode())
+                except ValueError:
+                    continue
+                if "index" in record and record["index"] not in done:
+                    done.add(record["index"])
+                    printer.add(record["index"], RepoResult.from_dict(record["result"]))
+                elif record.get("event") == "done" and shard_spec["cache_max_age"] is not None:
+                    status_cache.merge(record.get("cache", {}))
+            await proc.wait()
+        except (asyncio.CancelledError, ConnectionError):
+            if proc.returncode is None:
+                proc.kill()
+                await proc.wait()
+            if not stderr_task.done():
+                stderr_task.cancel()
+            raise
+        stderr = (await stderr_task).decode("utf-8", errors="replace").strip()
+        if proc.returncode != 0:
+            error = f"exit code {proc.returncode}" + (f": {stderr.splitlines()[-1]}" if stderr else "")
+    except OSError as e:
+        error = str(e)
+
+    missing = [(i, p) for i, p in shard if i not in done]
+    if len(missing) > 0:
+        print(f"\nWorker {transport.name} did not check {len(missing)} repositories ({error or 'no result'})", file=sys.stderr, flush=True)
+    return missing
+
+
+# Splits repo_list into shards (twice as many as workers, so that faster #
+# workers take more) and runs them on the workers. A shard that fails is #
+# retried, with only the repositories still missing, up to retries times #
+# on whichever worker is free. A worker that returns nothing at all is   #
+# not given more shards. Each shard gets the time left until deadline  #
+# (a time.monotonic() value) when it is sent; shards still waiting when #
+# it is reached are reported as timed out instead.                      #
+async def coordinate(
+    repo_list : List[Path],
+    transports : List[Transport],
+    spec : dict,
+    retries : int,
+    output_format : str = "text",
+    status_cache : Optional[StatusCache] = None,
+    deadline : Optional[float] = None,
+) -> List[RepoResult]:
+    printer = ResultPrinter(len(repo_list), output_format)
+    if len(repo_list) == 0:
+        return []
+
+    shards : asyncio.Queue = asyncio.Queue()
+    for shard in make_shards(repo_list, 2 * len(transports)):
+        shards.put_nowait((shard, 0))
+    alive : List[Transport] = list(transports)
+    late : List[Tuple[int, Path]] = []
+
+    async def serve(transport : Transport) -> None:
+        while True:
+            item = await shards.get()
+            if item is None:
+                shards.task_done()
+                return
+            shard, attempt = item
+            left : Optional[float] = None if deadline is None else max(0.0, deadline - time.monotonic())
+            if left == 0.0:
+                late.extend(shard)
+                shards.task_done()
+                continue
+            missing = await run_remote_shard(transport, shard, {**spec, "deadline" : left}, printer, status_cache)
+            if len(missing) > 0 and attempt < retries:
+                shards.put_nowait((missing, attempt + 1))
+            shards.task_done()
+            if len(missing) == len(shard) and len(alive) > 1:
+                alive.remove(transport)
+                print(f"Worker {transport.name} removed", file=sys.stderr, flush=True)
+                return
+
+    tasks = [asyncio.ensure_future(serve(transport)) for transport in transports]
+    try:
+        # Stops when every shard is done or no worker is left #
+        join_task = asyncio.ensure_future(shards.join())
+        while not join_task.done():
+            await asyncio.wait([join_task, *tasks], return_when=asyncio.FIRST_COMPLETED)
+            if all(task.done() for task in tasks):
+                break
+        join_task.cancel()
+        for _ in tasks:
+            shards.put_nowait(None)
+        await asyncio.gather(*tasks, return_exceptions=True)
+    finally:
+        for task in tasks:
+            task.cancel()
+
+    printer.timeout(late, "not started, the deadline was reached")
+    return printer.finish(repo_list, "no worker could check it")
+
+
+def git_check_distributed(
+    dir_list : List[Path],
+    search_list : List[Path],
+    ignore_set : Set[Path],
+    options : GitOptions,
+    recursive : bool,
+    recursive_max_level : Optional[int],
+    transports : List[Transport],
+    jobs : int = 1,
+    runner : Optional[AsyncGitRunner] = None,
+    search_options : Optional[SearchOptions] = None,
+    fetch_options : Optional[FetchOptions] = None,
+    output_format : str = "text",
+    status_cache : Optional[StatusCache] = None,
+    retries : int = 2,
+) -> List[RepoResult]:
+    if runner is None:
+        runner = AsyncGitRunner(max_processes=jobs)
+    if fetch_options is None:
+        fetch_options = FetchOptions()
+    profiler = getattr(runner, "profiler", None)
+
+    start = time.perf_counter()
+    repo_list = collect_repos(dir_list, search_list, ignore_set, recursive, recursive_max_level, search_options)
+    if profiler is not None:
+        profiler.record("discovery", time.perf_counter() - start)
+
+    spec = {
+        "options" : {"status" : options.status, "commit" : options.commit, "push" : options.push, "pull" : options.pull},
+        "jobs" : jobs,
+        "timeouts" : runner.timeouts,
+        "env" : runner.env,
+        "fetch" : {
+            "enabled" : fetch_options.enabled,
+            "max_age" : fetch_options.max_age,
+            "per_host" : fetch_options.limiter.per_host,
+        },
+        # Workers on this host only: entries of another host mean nothing here #
+        "cache_max_age" : None if status_cache is None else status_cache.max_age,
+    }
+    # Read-only sweeps only, as in git_check_repo() #
+    if options.commit or options.push or options.pull:
+        status_cache = None
+    start = time.perf_counter()
+    try:
+        results = asyncio.run(coordinate(repo_list, transports, spec, retries, output_format, status_cache, runner.deadline))
+    finally:
+        if status_cache is not None:
+            status_cache.save()
+    if profiler is not None:
+        profiler.record("distributed check", time.perf_counter() - start)
+    return results
@@ -1,26 +1,26 @@
-from tabnanny import check
-from typing import List, Set, Optional, Union
+from typing import List, Set, Optional, TextIO
 from pathlib import Path
-from subprocess import Popen, PIPE
-import os, sys
+import io, sys, time
 
 from .colors import *
 from .json_readwrite import *
-
-
-def minPositive(arg1, *args) -> Union[int,float]:
-    min_val = arg1
-    for arg in args:
-        if arg >= 0:
-         if arg < min_val:
-            min_val = arg
-    
-    return min_val
+from .runner import AsyncGitRunner, GitResult
+from .profiling import Profiler
+from .status import RepoStatus, parse_porcelain_v2
+from .pathsets import PathSet
+from .discovery import find_repos, repo_kind, BARE, SearchOptions
+from .status_cache import StatusCache
+from .remotes import FetchOptions, fetch_head_age, fetch_host
+from .report import (
+    RepoResult,
+    FETCH_UP_TO_DATE, FETCH_UPDATED, FETCH_SKIPPED, FETCH_NO_REMOTE,
+    FETCH_UNREACHABLE, FETCH_TIMEOUT, FETCH_ERROR,
+)
 
 
 class GitOptions:
     list = ["status", "commit", "push", "pull"]
-    
+
     def __init__(self, status:bool, commit:bool, push:bool, pull:bool) -> None:
         args = list(locals().keys())
         args.remove("self")
@@ -32,278 +32,444 @@ class GitOptions:
         self.push = push
         self.pull = pull
 
-def get_remote_branch_name(dir : Path) -> str:
-    output = Popen(
-        ['git', 'branch', '-vv'],
-        cwd=dir,
-        encoding='utf-8',
-        stdout=PIPE, stderr=PIPE
-    ).communicate()
-    output = output[0] + "\n" + output[1]
-
-    for line in output.split('\n'):
-        if len(line) > 0:
-         if line[0] == "*":
-            i1 = line.find('[') + 1
-            i2 = minPositive(line.find(']'), line.find(':'))
-            if i1 != 0:
-                return line[i1:i2]
+# Steps that git_check_repo() may take after reading the status #
+STEP_COMMIT = "commit"  # git add . && git commit
+STEP_PUSH   = "push"
+STEP_PULL   = "pull"
+
+
+# Steps to take, in order, for a repository with the given status. #
+# Pushing or pulling needs a clean branch, so it implies a commit;  #
+# nothing is pushed or pulled if the branch diverged (or would,     #
+# after the commit), has no upstream or could not be fetched.       #
+def plan_steps(status : RepoStatus, options : GitOptions, fetch_ok : bool) -> List[str]:
+    steps : List[str] = []
+    clean : bool = status.clean
+    ahead : bool = status.is_ahead
+    behind : bool = status.is_behind
+    diverged : bool = status.diverged
+
+    if (not clean) and (options.commit or options.push or options.pull):
+        steps.append(STEP_COMMIT)
+        clean = True
+        if not (ahead or behind or diverged):
+            ahead = True
+        if behind:
+            behind = False
+            diverged = True
+
+    if not (diverged or (not fetch_ok) or (not status.has_upstream)):
+        if options.push and clean and ahead:
+            steps.append(STEP_PUSH)
+        if options.pull and clean and behind:
+            steps.append(STEP_PULL)
+    return steps
+
+
+# Runs one of the STEP_* in dir, recording it in report. Returns whether #
+# it succeeded.                                                          #
+async def run_step(
+    dir : Path,
+    step : str,
+    runner : AsyncGitRunner,
+    report : RepoResult,
+    out : Optional[TextIO] = None,
+) -> bool:
+    commands : List[List[str]] = [[step]]
+    if step == STEP_COMMIT:
+        commands = [['add', '.'], ['commit', '-m', '[Automatic commit]']]
+    for args in commands:
+        with report.timed(args[0]):
+            result = await runner.run(args, dir)
+        if not result.ok:
+            printFailedCommand(args[0], result, out)
+            if result.timed_out:
+                report.timed_out = True
+                report.errors.append(f"{args[0]} {result.stderr}")
+            elif needsCredentials(result.output):
+                report.errors.append(f"{args[0]} failed: credentials needed")
             else:
-                return "-"
-
-    return "-"
-
-def get_branch_name(dir : Path) -> str:
-    output = Popen(
-        ['git', 'rev-parse', '--abbrev-ref', 'HEAD'],
-        cwd=dir,
-        encoding='utf-8',
-        stdout=PIPE, stderr=PIPE
-    ).communicate()
-
-    return (output[0].strip() + output[1].strip())
+                report.errors.append(f"{args[0]} failed")
+            return False
 
+    printColor(f"    - {step.upper()} MADE -", stdcolors["brightgreen"], file=out)
+    report.actions.append(step)
+    return True
 
-def is_git_repo(dir : Path) -> bool:
-    output : str = Popen(
-        ['git', 'branch'],
-        cwd=dir,
-        encoding='utf-8',
-        stdout=PIPE, stderr=PIPE
-    ).communicate()
-    output = output[0] + "\n" + output[1]
 
-    if ("not a git repository" in output) or \
-       ("no es un repositorio git" in output):
-        return False
-    else:
-        return True
-
-
-def git_fetch(dir : Path) -> bool:
-    output : str = Popen(
-        ['git', 'fetch', '-avp'],
-        cwd=dir,
-        encoding='utf-8',
-        stdout=PIPE, stderr=PIPE
-    ).communicate()
-    output = (output[0].strip() + "\n" + output[1].strip()).strip()
-    
-    error : bool = False
-    if output == "":
-        printColor("    - NO REMOTE -", stdcolors["brightgreen"])
-        error = True
+# What git status prints in a directory that is not a working tree: not #
+# a repository at all, or a bare one                                     #
+NOT_A_WORK_TREE : List[str] = [
+    "not a git repository",
+    "must be run in a work tree",
+]
+
+
+# Returns None if dir is not (inside) a git repository, or if the command #
+# timed out or failed. Timeouts and other failures are recorded in report #
+# with what git printed; a directory that is not a working tree, or that  #
+# does not exist, is left for the caller to tell apart.                   #
+async def git_status(
+    dir : Path,
+    runner : AsyncGitRunner,
+    status_cache : Optional[StatusCache] = None,
+    report : Optional[RepoResult] = None,
+) -> Optional[RepoStatus]:
+    before : Optional[list] = None
+    if status_cache is not None:
+        stdout = status_cache.get(dir)
+        if stdout is not None:
+            return parse_porcelain_v2(stdout)
+        before = StatusCache.fingerprint(dir)
+    result : GitResult = await runner.run(['status', '--porcelain=v2', '--branch'], dir)
+    if not result.ok:
+        if report is not None:
+            if result.timed_out:
+                report.timed_out = True
+                report.errors.append(f"status {result.stderr}")
+            elif not any(error in result.stderr for error in NOT_A_WORK_TREE) and dir.is_dir():
+                report.errors.append(f"status failed: {result.stderr.strip()}")
+        return None
+    status = parse_porcelain_v2(result.stdout)
+    if status_cache is not None:
+        status_cache.set(dir, before, result.stdout, status.upstream)
+    return status
+
+
+# Returns one of the FETCH_* outcomes of report.py #
+async def git_fetch(dir : Path, runner : AsyncGitRunner, out : Optional[TextIO] = None) -> str:
+    result : GitResult = await runner.run(['fetch', '-avp'], dir)
+    output = (result.stdout.strip() + "\n" + result.stderr.strip()).strip()
+
+    if result.timed_out:
+        printColor(f"    -- TIMEOUT: Fetch {result.stderr}.", stdcolors["brightred"], file=out)
+        return FETCH_TIMEOUT
+    elif output == "":
+        printColor("    - NO REMOTE -", stdcolors["brightgreen"], file=out)
+        return FETCH_NO_REMOTE
     elif ("Could not read from remote repository" in output) or \
          ("TODO: ESPANOL" in output):
-        printColor("    -- ERROR: Remote repository could not be reached.", stdcolors["brightred"])
-        error = True
+        printColor("    -- ERROR: Remote repository could not be reached.", stdcolors["brightred"], file=out)
+        if needsCredentials(output):
+            printCredentialsHint(out)
+        return FETCH_UNREACHABLE
     elif "fatal" in output:
-        printColor("    -- ERROR: Unknown error in fetch:", stdcolors["brightred"])
-        printColor(output, stdcolors["brightred"])
-        error = True
-
-    if not error:
-        all_up_to_date : bool = True
-        for out in output:
-            for line in out.split("\n")[2:-1]:
-                if not ("[up to date]" in line or "[actualizado]" in line):
-                    all_up_to_date = False
-                    printColor(f"    {line}", stdcolors["brightred"])
-        if (all_up_to_date):
-            printColor("    - REMOTE UP TO DATE -", stdcolors["brightgreen"])
-    
-    return error
-
-
-def git_check_repo(dir : Path, options : GitOptions) -> bool:
+        printColor("    -- ERROR: Unknown error in fetch:", stdcolors["brightred"], file=out)
+        printColor(output, stdcolors["brightred"], file=out)
+        if needsCredentials(output):
+            printCredentialsHint(out)
+        return FETCH_ERROR
+
+    updated : bool = False
+    # Ref update lines look like " = [up to date]  main -> origin/main" #
+    for line in result.stderr.split("\n"):
+        if "->" in line and line.startswith(" "):
+            if not ("[up to date]" in line or "[actualizado]" in line):
+                updated = True
+                printColor(f"    {line}", stdcolors["brightred"], file=out)
+    if not updated:
+        printColor("    - REMOTE UP TO DATE -", stdcolors["brightgreen"], file=out)
+        return FETCH_UP_TO_DATE
+    return FETCH_UPDATED
+
+
+# What git and ssh print when they needed a password or passphrase, which #
+# they are not allowed to ask for (AsyncGitRunner.noninteractive_env())    #
+CREDENTIAL_ERRORS : List[str] = [
+    "terminal prompts disabled",
+    "could not read Username",
+    "could not read Password",
+    "Permission denied (publickey",
+    "Host key verification failed",
+    "Authentication failed",
+]
+
+
+def needsCredentials(output : str) -> bool:
+    return any(error in output for error in CREDENTIAL_ERRORS)
+
+
+def printCredentialsHint(out : Optional[TextIO] = None) -> None:
+    printColor("    -- HINT: git_check cannot ask for passwords or passphrases. Use a credential helper", stdcolors["brightyellow"], file=out)
+    printColor("             for HTTPS remotes, or ssh-agent for SSH keys, and run it again.", stdcolors["brightyellow"], file=out)
+
+
+def printFailedCommand(name : str, result : GitResult, out : Optional[TextIO] = None) -> None:
+    if result.timed_out:
+        printColor(f"    -- TIMEOUT: {name.capitalize()} {result.stderr}.", stdcolors["brightred"], file=out)
+        return
+    printColor(f"    -- ERROR: Error in {name}:", stdcolors["brightred"], file=out)
+    for stream in (result.stdout, result.stderr):
+        for line in stream.split("\n"):
+            printColor(f"    {line}", stdcolors["brightred"], file=out)
+    if needsCredentials(result.output):
+        printCredentialsHint(out)
+
+
+# Prints the git status failure last recorded in report, with what git printed #
+def printStatusError(report : RepoResult, out : Optional[TextIO] = None) -> None:
+    printColor("    -- ERROR: Could not read the status of the repository.", stdcolors["brightred"], file=out)
+    _, _, stderr = report.errors[-1].partition("status failed: ")
+    for line in stderr.split("\n") if stderr != "" else []:
+        printColor(f"    {line}", stdcolors["brightred"], file=out)
+
+
+async def git_check_repo(
+    dir : Path,
+    options : GitOptions,
+    runner : AsyncGitRunner,
+    out : Optional[TextIO] = None,
+    fetch_options : Optional[FetchOptions] = None,
+    status_cache : Optional[StatusCache] = None,
+) -> RepoResult:
+    report = RepoResult(dir)
+    # The cache is only trusted when nothing is done with the status #
+    if options.commit or options.push or options.pull:
+        status_cache = None
 
     msg : str = "-- Checking directory: " + str(dir) + " --"
-    print("\n" + "-" * len(msg))
-    print(msg)
-    print("-" * len(msg), flush=True)
-
-    # Check if it is a repository #
-    if not is_git_repo(dir):
-        printColor("    -- ERROR: Directory is not a git repository.", stdcolors["brightred"])
-        return False
-
-    # Branch names #
-    local_branch : str = get_branch_name(dir)
-    remote_branch : str = get_remote_branch_name(dir)
-    has_upstream : bool
-    print(f"    Local branch:  {local_branch}")
-    if remote_branch == "-":
-        print("    No remote branch")
-        has_upstream = False
+    print("\n" + "-" * len(msg), file=out)
+    print(msg, file=out)
+    print("-" * len(msg), file=out, flush=True)
+
+    # Branch, upstream and working tree, in a single call #
+    with report.timed("status"):
+        status : Optional[RepoStatus] = await git_status(dir, runner, status_cache, report)
+    if status is None:
+        if report.timed_out:
+            printColor(f"    -- TIMEOUT: {report.errors[-1].capitalize()}.", stdcolors["brightred"], file=out)
+            return report
+        if len(report.errors) > 0:
+            report.is_repo = repo_kind(dir) is not None
+            printStatusError(report, out)
+            return report
+        if repo_kind(dir) == BARE:
+            printColor("    - BARE REPOSITORY -", stdcolors["brightgreen"], file=out)
+            report.is_repo = True
+            report.bare = True
+            return report
+        # Only looked at now, so that existing repositories cost no stat #
+        if not dir.is_dir():
+            printColor("    -- ERROR: Directory does not exist.", stdcolors["brightred"], file=out)
+            report.errors.append("not a directory")
+            return report
+        printColor("    -- ERROR: Directory is not a git repository.", stdcolors["brightred"], file=out)
+        report.errors.append("not a git repository")
+        return report
+    report.is_repo = True
+    report.status = status
+
+    print(f"    Local branch:  {status.head}", file=out)
+    if not status.has_upstream:
+        print("    No remote branch", file=out)
     else:
-        print(f"    Remote branch: {remote_branch}")
-        has_upstream = True
-    
+        print(f"    Remote branch: {status.upstream}", file=out)
+    has_upstream : bool = status.has_upstream
+
     # Fetch #
-    fetch_error = git_fetch(dir)
-    
+    if fetch_options is None:
+        fetch_options = FetchOptions()
+    fetch_age : Optional[float] = None
+    if fetch_options.enabled and fetch_options.max_age is not None:
+        fetch_age = fetch_head_age(dir)
+    if not fetch_options.enabled:
+        printColor("    - FETCH SKIPPED -", stdcolors["brightgreen"], file=out)
+        report.fetch = FETCH_SKIPPED
+    elif fetch_age is not None and fetch_age < fetch_options.max_age:
+        printColor(f"    - FETCH SKIPPED (last fetch {fetch_age:.0f} s ago) -", stdcolors["brightgreen"], file=out)
+        report.fetch = FETCH_SKIPPED
+    else:
+        with report.timed("fetch"):
+            async with fetch_options.limiter.slot(fetch_host(dir, status.upstream)):
+                report.fetch = await git_fetch(dir, runner, out)
+        if report.fetch == FETCH_TIMEOUT:
+            report.timed_out = True
+            report.errors.append("fetch timed out")
+    fetch_error : bool = not report.fetch_ok
+
     # Status #
     if options.status or options.commit or options.push or options.pull:
-        output = Popen(
-            ['git', 'status'],
-            cwd=dir,
-            encoding='utf-8',
-            stdout=PIPE, stderr=PIPE
-        ).communicate()
-        total_output = output[0] + output[1]
-
-        branch_clean : bool = False
-        branch_ahead : bool = False
-        branch_behind : bool = False
-        branch_diverged : bool = False
-        if ("nothing to commit" in total_output) or \
-           ("nada para hacer commit" in total_output):
-            branch_clean = True
-        if ("Your branch is behind" in total_output):
-            branch_behind = True
-        elif "Your branch is ahead" in total_output:
-            branch_ahead = True
-        elif "have diverged" in total_output:
-            branch_diverged = True
-        
-        if branch_clean:
-            printColor("    - BRANCH CLEAN -", stdcolors["brightgreen"])
+        # Ahead/behind counts are only stale if the fetch moved a remote ref #
+        if report.fetch == FETCH_UPDATED and has_upstream:
+            with report.timed("status"):
+                status = await git_status(dir, runner, status_cache, report)
+            if status is None:
+                if report.timed_out:
+                    printColor(f"    -- TIMEOUT: {report.errors[-1].capitalize()}.", stdcolors["brightred"], file=out)
+                    return report
+                if len(report.errors) == 0:
+                    report.errors.append("status failed")
+                printStatusError(report, out)
+                return report
+            report.status = status
+
+        if status.clean:
+            printColor("    - BRANCH CLEAN -", stdcolors["brightgreen"], file=out)
         else:
-            printColor("    -- BRANCH NOT CLEAN:", stdcolors["brightred"])
-            for out in output:
-                for line in out.split("\n"):
-                    printColor(f"    {line}", stdcolors["brightred"])
-        
-        if branch_ahead:
-            printColor("    -- BRANCH IS AHEAD REMOTE", stdcolors["brightred"])
-        elif branch_behind:
-            printColor("    -- BRANCH IS BEHIND REMOTE", stdcolors["brightred"])
-        elif branch_diverged:
-            printColor("    -- BRANCH DIVERGED FROM REMOTE", stdcolors["brightred"])
-
-        
-        # Commit #
-        if (not branch_clean) and (options.commit or options.push or options.pull):
-            proc : Popen = Popen(
-                ['git', 'add', '.'],
-                cwd=dir,
-                encoding='utf-8',
-                stdout=PIPE, stderr=PIPE
-            )
-            output = proc.communicate()
-            ret_code : int = proc.returncode
-            if ret_code != 0:
-                printColor("    -- ERROR: Error in add:", stdcolors["brightred"])
-                for out in output:
-                    for line in out.split("\n"):
-                        printColor(f"    {line}", stdcolors["brightred"])
-                return
-
-            proc : Popen = Popen(
-                ['git', 'commit', '-m', '[Automatic commit]'],
-                cwd=dir,
-                encoding='utf-8',
-                stdout=PIPE, stderr=PIPE
-            )
-            output = proc.communicate()
-            ret_code : int = proc.returncode
-            if ret_code != 0:
-                printColor("    -- ERROR: Error in commit:", stdcolors["brightred"])
-                for out in output:
-                    for line in out.split("\n"):
-                        printColor(f"    {line}", stdcolors["brightred"])
-                return
-
-            printColor("    - COMMIT MADE -", stdcolors["brightgreen"])
-            branch_clean = True
-            if not (branch_ahead or branch_behind or branch_diverged):
-                branch_ahead = True
-            if branch_behind:
-                branch_behind = False
-                branch_diverged = True
-                printColor("    -- WARNING: COMMIT MADE BRANCHE DIVERGE FROM REMOTE", stdcolors["brightyellow"])
-        
-        # Pull & push #
-        if not (branch_diverged or fetch_error or not has_upstream):
-            # Push #
-            if options.push and branch_clean and branch_ahead:
-                proc : Popen = Popen(
-                    ['git', 'push'],
-                    cwd=dir,
-                    encoding='utf-8',
-                    stdout=PIPE, stderr=PIPE
-                )
-                output = proc.communicate()
-                ret_code : int = proc.returncode
-                if ret_code != 0:
-                    printColor("    -- ERROR: Error in push:", stdcolors["brightred"])
-                    for out in output:
-                        for line in out.split("\n"):
-                            printColor(f"    {line}", stdcolors["brightred"])
-                    return
-                
-                printColor("    - PUSH MADE -", stdcolors["brightgreen"])
-            
-            # Pull #
-            if options.pull and branch_clean and branch_behind:
-                proc : Popen = Popen(
-                    ['git', 'pull'],
-                    cwd=dir,
-                    encoding='utf-8',
-                    stdout=PIPE, stderr=PIPE
-                )
-                output = proc.communicate()
-                ret_code : int = proc.returncode
-                if ret_code != 0:
-                    printColor("    -- ERROR: Error in pull:", stdcolors["brightred"])
-                    for out in output:
-                        for line in out.split("\n"):
-                            printColor(f"    {line}", stdcolors["brightred"])
-                    return
-                
-                printColor("    - PULL MADE -", stdcolors["brightgreen"])
-    
-    return True
+            printColor("    -- BRANCH NOT CLEAN:", stdcolors["brightred"], file=out)
+            for xy, path in status.entries:
+                printColor(f"    {xy} {path}", stdcolors["brightred"], file=out)
+
+        if status.is_ahead:
+            printColor("    -- BRANCH IS AHEAD REMOTE", stdcolors["brightred"], file=out)
+        elif status.is_behind:
+            printColor("    -- BRANCH IS BEHIND REMOTE", stdcolors["brightred"], file=out)
+        elif status.diverged:
+            printColor("    -- BRANCH DIVERGED FROM REMOTE", stdcolors["brightred"], file=out)
+
+        # Commit, push & pull #
+        for step in plan_steps(status, options, not fetch_error):
+            if not await run_step(dir, step, runner, report, out):
+                return report
+            if step == STEP_COMMIT and status.is_behind:
+                printColor("    -- WARNING: COMMIT MADE BRANCHE DIVERGE FROM REMOTE", stdcolors["brightyellow"], file=out)
+
+    return report
+
+
+# Checks every directory in dir_list and returns their results in the same #
+# order. With jobs > 1 up to jobs repositories are checked at the same     #
+# time. In "text" format the report of each one is printed as a whole, in  #
+# list order; in "jsonl" format one JSON line per repository is printed as #
+# soon as it is done; in "none" format nothing is printed.                #
+async def git_check_dir_list(
+    dir_list : List[Path],
+    options : GitOptions,
+    runner : AsyncGitRunner,
+    jobs : int = 1,
+    fetch_options : Optional[FetchOptions] = None,
+    output_format : str = "text",
+    status_cache : Optional[StatusCache] = None,
+) -> List[RepoResult]:
+    import asyncio
+    profiler : Optional[Profiler] = getattr(runner, "profiler", None)
+
+    async def check(dir : Path, out : Optional[TextIO]) -> RepoResult:
+        start = time.perf_counter()
+        report = await git_check_repo(dir, options, runner, out, fetch_options, status_cache)
+        if profiler is not None:
+            profiler.record("repo", time.perf_counter() - start, dir)
+        return report
+
+    if output_format == "text" and (jobs <= 1 or len(dir_list) <= 1):
+        return [await check(dir, None) for dir in dir_list]
+
+    slots = asyncio.Semaphore(max(1, jobs))
+
+    async def check_buffered(dir : Path) -> RepoResult:
+        async with slots:
+            out = io.StringIO()
+            report = await check(dir, out)
+            report.output = out.getvalue()
+            return report
+
+    tasks = [asyncio.ensure_future(check_buffered(dir)) for dir in dir_list]
+    try:
+        if output_format == "jsonl":
+            for next_done in asyncio.as_completed(tasks):
+                report = await next_done
+                sys.stdout.write(report.to_json() + "\n")
+                sys.stdout.flush()
+        elif output_format == "text":
+            for task in tasks:
+                report = await task
+                sys.stdout.write(report.output)
+                sys.stdout.flush()
+        else:
+            await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+    return [task.result() for task in tasks]
 
 
-def git_check_repos(
+async def git_check_repos(
     dir_list : List[Path],
     ignore_set : Set[Path],
     options : GitOptions,
-    checked_dirs : Set[Path],
-) -> None:
+    checked_dirs : PathSet,
+    runner : AsyncGitRunner,
+    jobs : int = 1,
+    fetch_options : Optional[FetchOptions] = None,
+    output_format : str = "text",
+    status_cache : Optional[StatusCache] = None,
+) -> List[RepoResult]:
+    to_check : List[Path] = []
     for dir in dir_list:
         if dir not in ignore_set:
             if dir not in checked_dirs:
-                git_check_repo(dir, options)
+                to_check.append(dir)
                 checked_dirs.add(dir)
+    return await git_check_dir_list(to_check, options, runner, jobs, fetch_options, output_format, status_cache)
 
 
-def git_check_directories(
+async def git_check_directories(
     dir_list : List[Path],
     ignore_set : Set[Path],
     options : GitOptions,
     recursive : bool,
-    level : int,
     recursive_max_level : Optional[int],
-    checked_dirs : Set[Path] = set(),
-) -> None:
+    checked_dirs : PathSet,
+    runner : AsyncGitRunner,
+    jobs : int = 1,
+    search_options : Optional[SearchOptions] = None,
+    fetch_options : Optional[FetchOptions] = None,
+    output_format : str = "text",
+    status_cache : Optional[StatusCache] = None,
+) -> List[RepoResult]:
+    profiler : Optional[Profiler] = getattr(runner, "profiler", None)
+    start = time.perf_counter()
+    repo_list = find_repos(dir_list, ignore_set, recursive, recursive_max_level, checked_dirs, search_options)
+    if profiler is not None:
+        profiler.record("discovery", time.perf_counter() - start)
+    return await git_check_dir_list(repo_list, options, runner, jobs, fetch_options, output_format, status_cache)
+
+
+# Repositories that git_check() would check, in the same order, without #
+# checking them                                                          #
+def collect_repos(
+    dir_list : List[Path],
+    search_list : List[Path],
+    ignore_set : Set[Path],
+    recursive : bool,
+    recursive_max_level : Optional[int],
+    search_options : Optional[SearchOptions] = None,
+) -> List[Path]:
+    checked_dirs = PathSet()
+    repo_list : List[Path] = []
     for dir in dir_list:
-        if dir not in ignore_set:
-            subdir_list = [dir/d for d in os.listdir(dir) if os.path.isdir(dir/d)]
-            for d in subdir_list:
-                if d not in ignore_set:
-                    if d not in checked_dirs:
-                        is_repo = git_check_repo(d, options)
-                        checked_dirs.add(d)
-                    if recursive and not is_repo:
-                        do_check : bool = False
-                        if recursive_max_level is None:
-                            do_check = True
-                        elif level < recursive_max_level:
-                            do_check = True
-                        if do_check:
-                            git_check_directories([d], ignore_set, options, recursive, level+1, recursive_max_level, checked_dirs)
+        if dir not in ignore_set and dir not in checked_dirs:
+            repo_list.append(dir)
+            checked_dirs.add(dir)
+    repo_list += find_repos(search_list, ignore_set, recursive, recursive_max_level, checked_dirs, search_options)
+    return repo_list
+
+
+async def git_check_async(
+    dir_list : List[Path],
+    search_list : List[Path],
+    ignore_set : Set[Path],
+    options : GitOptions,
+    recursive : bool,
+    recursive_max_level : Optional[int],
+    jobs : int = 1,
+    runner : Optional[AsyncGitRunner] = None,
+    search_options : Optional[SearchOptions] = None,
+    fetch_options : Optional[FetchOptions] = None,
+    output_format : str = "text",
+    status_cache : Optional[StatusCache] = None,
+) -> List[RepoResult]:
+    if runner is None:
+        runner = AsyncGitRunner(max_processes=jobs)
+    checked_dirs = PathSet()
+    results : List[RepoResult] = []
+    try:
+        results += await git_check_repos(dir_list, ignore_set, options, checked_dirs, runner, jobs, fetch_options, output_format, status_cache)
+        results += await git_check_directories(search_list, ignore_set, options, recursive, recursive_max_level, checked_dirs, runner, jobs, search_options, fetch_options, output_format, status_cache)
+    finally:
+        if status_cache is not None:
+            status_cache.save()
+    return results
 
 
 def git_check(
@@ -312,8 +478,15 @@ def git_check(
     ignore_set : Set[Path],
     options : GitOptions,
     recursive : bool,
-    recursive_max_level : Optional[int]
-) -> None:
-    checked_dirs : Set[Path] = set()
-    git_check_repos(dir_list, ignore_set, options, checked_dirs)
-    git_check_directories(search_list, ignore_set, options, recursive, 0, recursive_max_level, checked_dirs)
+    recursive_max_level : Optional[int],
+    jobs : int = 1,
+    runner : Optional[AsyncGitRunner] = None,
+    search_options : Optional[SearchOptions] = None,
+    fetch_options : Optional[FetchOptions] = None,
+    output_format : str = "text",
+    status_cache : Optional[StatusCache] = None,
+) -> List[RepoResult]:
+    import asyncio
+    return asyncio.run(git_check_async(
+        dir_list, search_list, ignore_set, options, recursive, recursive_max_level, jobs, runner, search_options, fetch_options, output_format, status_cache
+    ))
@@ -1,12 +1,27 @@
 from pathlib import Path
-from typing import List, Union
-import sys
+from typing import TYPE_CHECKING, Dict, List, Optional, Union
+import json, os, sys
 
 from .git_check import git_check, GitOptions
+from .discovery import SearchOptions, DiscoveryCache
+from .pathsets import PathSet
+from .patterns import IgnorePatterns, is_pattern
+from .remotes import FetchOptions
+from .status_cache import StatusCache
+from .runner import AsyncGitRunner
+from .profiling import Profiler
+from .watch import git_watch, WatchOptions
+from .planner import git_plan, PlanOptions
 from .colors import printColor, stdcolors
-from .console import main as console_main
 from .json_readwrite import *
 
+# The console, the daemon, worker processes and SSH connection sharing #
+# are imported only when their flags are given, to keep the start of   #
+# the common runs short                                                 #
+if TYPE_CHECKING:
+    from .distributed import Transport
+    from .ssh_mux import SSHMultiplexer
+
 
 def printBasicHelp(options: List[str], default_options: List[str]) -> None:
     print("")
@@ -32,6 +47,22 @@ def printHelpAndExit(options: List[str], default_options: List[str], only_basic
     exit(exit_code)
 
 
+# Parses durations like "90", "90s", "15m", "2h" or "1d" into seconds #
+def parseDuration(text : str) -> Optional[float]:
+    units = {"s" : 1, "m" : 60, "h" : 3600, "d" : 86400}
+    factor = 1
+    if len(text) > 0 and text[-1].lower() in units:
+        factor = units[text[-1].lower()]
+        text = text[:-1]
+    try:
+        value = float(text)
+    except ValueError:
+        return None
+    if value < 0:
+        return None
+    return value * factor
+
+
 def git_check_main(
     dir_list    : List[Union[str,Path]] = [],
     search_list : List[Union[str,Path]] = [],
@@ -46,15 +77,50 @@ def git_check_main(
     real_search_list : List[str] = []
     recursive_max_level : int = 0
     recursive : bool = False
+    jobs : int = 1
+    processes : int = 1
+    transports : List["Transport"] = []
+    retries : int = 2
+    search_options = SearchOptions(cache=DiscoveryCache())
+    fetch_options = FetchOptions()
+    timeouts : Dict[str, Optional[float]] = dict()
+    deadline : Optional[float] = None
+    use_cache : bool = False
+    cache_max_age : Optional[float] = None
+    use_ssh_mux : bool = False
+    watch : bool = False
+    plan : bool = False
+    run_daemon : bool = False
+    socket_path : Optional[Path] = None
+    query_list : List[str] = []
+    daemon_stop : bool = False
+    plan_options = PlanOptions()
+    watch_options = WatchOptions()
+    output_format : str = "text"
+    profile : bool = False
+    profile_top : int = 10
+    profile_dump : Optional[str] = None
     real_ignore_list : List[str] = []
     real_ignore_list.extend(ignore_list)
     use_config_list : List[str] = []
+    include_config_list : List[str] = []
     set_config_list : List[str] = []
     del_config_list : List[str] = []
     while(arg_i < len(sys.argv)):
         arg : str = sys.argv[arg_i]
         if arg == "--console":
-            console_main()
+            from .console import main as console_main
+            script : Optional[str] = None
+            if arg_i+1 < len(sys.argv) and sys.argv[arg_i+1] == "--script":
+                if arg_i+2 == len(sys.argv):
+                    printColor("ERROR: Missing argument for --script", stdcolors["brightred"])
+                    printHelpAndExit(options.list, default_options, True, 1)
+                script = sys.argv[arg_i+2]
+            console_main(script)
+            exit(0)
+        elif arg == "--worker":
+            from .distributed import worker_main
+            worker_main()
             exit(0)
         elif arg in default_options:
             pass
@@ -153,7 +219,287 @@ def git_check_main(
                         printHelpAndExit(options.list, default_options, True, 1)
                     recursive_max_level = int(arg)
 
-        elif arg == "--use-config":
+        elif arg in ["--jobs", "-j"]:
+            flag : str = arg
+            arg_i += 1
+            if arg_i == len(sys.argv):
+                printColor(f"ERROR: Missing argument for {flag}", stdcolors["brightred"])
+                printHelpAndExit(options.list, default_options, True, 1)
+            else:
+                arg = sys.argv[arg_i]
+                if not arg.isdigit() or int(arg) == 0:
+                    printColor(f"ERROR: Argument for {flag} must be a positive integer", stdcolors["brightred"])
+                    printHelpAndExit(options.list, default_options, True, 1)
+                jobs = int(arg)
+
+        elif arg == "--workers":
+            flag : str = arg
+
+            print_help : bool = False
+            if arg_i+1 == len(sys.argv):
+                print_help = True
+            elif sys.argv[arg_i+1][0] == "-":
+                print_help = True
+            if print_help:
+                printColor(f"ERROR: Missing argument for {flag}", stdcolors["brightred"])
+                printHelpAndExit(options.list, default_options, True, 1)
+
+            from .distributed import parse_transports
+            arg_i += 1
+            while arg_i < len(sys.argv):
+                arg = sys.argv[arg_i]
+                if arg[0] == "-":
+                    break
+                parsed = parse_transports(arg)
+                if parsed is None:
+                    printColor(f"ERROR: Invalid worker for {flag}: {arg}", stdcolors["brightred"])
+                    printHelpAndExit(options.list, default_options, True, 1)
+                transports.extend(parsed)
+                arg_i += 1
+            arg_i -= 1
+
+        elif arg == "--retries":
+            flag : str = arg
+            arg_i += 1
+            if arg_i == len(sys.argv):
+                printColor(f"ERROR: Missing argument for {flag}", stdcolors["brightred"])
+                printHelpAndExit(options.list, default_options, True, 1)
+            else:
+                arg = sys.argv[arg_i]
+                if not arg.isdigit():
+                    printColor(f"ERROR: Argument for {flag} must be an unsigned integer", stdcolors["brightred"])
+                    printHelpAndExit(options.list, default_options, True, 1)
+                retries = int(arg)
+
+        elif arg == "--processes":
+            flag : str = arg
+            arg_i += 1
+            if arg_i == len(sys.argv):
+                printColor(f"ERROR: Missing argument for {flag}", stdcolors["brightred"])
+                printHelpAndExit(options.list, default_options, True, 1)
+            else:
+                arg = sys.argv[arg_i]
+                if not arg.isdigit() or int(arg) == 0:
+                    printColor(f"ERROR: Argument for {flag} must be a positive integer", stdcolors["brightred"])
+                    printHelpAndExit(options.list, default_options, True, 1)
+                processes = int(arg)
+
+        elif arg == "--no-fetch":
+            fetch_options.enabled = False
+
+        elif arg == "--fetch-max-age":
+            flag : str = arg
+            arg_i += 1
+            if arg_i == len(sys.argv):
+                printColor(f"ERROR: Missing argument for {flag}", stdcolors["brightred"])
+                printHelpAndExit(options.list, default_options, True, 1)
+            else:
+                max_age = parseDuration(sys.argv[arg_i])
+                if max_age is None:
+                    printColor(f"ERROR: Argument for {flag} must be a duration like 90s, 15m, 2h or 1d", stdcolors["brightred"])
+                    printHelpAndExit(options.list, default_options, True, 1)
+                fetch_options.max_age = max_age
+
+        elif arg == "--timeout":
+            flag : str = arg
+
+            print_help : bool = False
+            if arg_i+1 == len(sys.argv):
+                print_help = True
+            elif sys.argv[arg_i+1][0] == "-":
+                print_help = True
+            if print_help:
+                printColor(f"ERROR: Missing argument for {flag}", stdcolors["brightred"])
+                printHelpAndExit(options.list, default_options, True, 1)
+
+            arg_i += 1
+            while arg_i < len(sys.argv):
+                arg = sys.argv[arg_i]
+                if arg[0] == "-":
+                    break
+                command, _, value = arg.rpartition("=")
+                commands = list(AsyncGitRunner.default_timeouts) if command == "" else [command]
+                seconds = None if value == "none" else parseDuration(value)
+                if any(c not in AsyncGitRunner.default_timeouts for c in commands) or (seconds is None and value != "none") or seconds == 0:
+                    printColor(f"ERROR: Invalid argument for {flag}: {arg}", stdcolors["brightred"])
+                    printHelpAndExit(options.list, default_options, True, 1)
+                for c in commands:
+                    timeouts[c] = seconds
+                arg_i += 1
+            arg_i -= 1
+
+        elif arg == "--deadline":
+            flag : str = arg
+            arg_i += 1
+            if arg_i == len(sys.argv):
+                printColor(f"ERROR: Missing argument for {flag}", stdcolors["brightred"])
+                printHelpAndExit(options.list, default_options, True, 1)
+            else:
+                deadline = parseDuration(sys.argv[arg_i])
+                if deadline is None or deadline == 0:
+                    printColor(f"ERROR: Argument for {flag} must be a duration like 90s, 15m, 2h or 1d", stdcolors["brightred"])
+                    printHelpAndExit(options.list, default_options, True, 1)
+
+        elif arg == "--cache":
+            use_cache = True
+
+        elif arg == "--no-cache":
+            use_cache = False
+
+        elif arg == "--cache-max-age":
+            flag : str = arg
+            arg_i += 1
+            if arg_i == len(sys.argv):
+                printColor(f"ERROR: Missing argument for {flag}", stdcolors["brightred"])
+                printHelpAndExit(options.list, default_options, True, 1)
+            else:
+                cache_max_age = parseDuration(sys.argv[arg_i])
+                if cache_max_age is None:
+                    printColor(f"ERROR: Argument for {flag} must be a duration like 90s, 15m, 2h or 1d", stdcolors["brightred"])
+                    printHelpAndExit(options.list, default_options, True, 1)
+                use_cache = True
+
+        elif arg == "--fetch-per-host":
+            flag : str = arg
+            arg_i += 1
+            if arg_i == len(sys.argv):
+                printColor(f"ERROR: Missing argument for {flag}", stdcolors["brightred"])
+                printHelpAndExit(options.list, default_options, True, 1)
+            else:
+                arg = sys.argv[arg_i]
+                if not arg.isdigit() or int(arg) == 0:
+                    printColor(f"ERROR: Argument for {flag} must be a positive integer", stdcolors["brightred"])
+                    printHelpAndExit(options.list, default_options, True, 1)
+                fetch_options.limiter.per_host = int(arg)
+
+        elif arg == "--format":
+            flag : str = arg
+            arg_i += 1
+            if arg_i == len(sys.argv):
+                printColor(f"ERROR: Missing argument for {flag}", stdcolors["brightred"])
+                printHelpAndExit(options.list, default_options, True, 1)
+            else:
+                arg = sys.argv[arg_i]
+                if arg not in ["text", "jsonl"]:
+                    printColor(f"ERROR: Argument for {flag} must be 'text' or 'jsonl'", stdcolors["brightred"])
+                    printHelpAndExit(options.list, default_options, True, 1)
+                output_format = arg
+
+        elif arg == "--profile":
+            profile = True
+
+        elif arg == "--profile-top":
+            flag : str = arg
+            arg_i += 1
+            if arg_i == len(sys.argv):
+                printColor(f"ERROR: Missing argument for {flag}", stdcolors["brightred"])
+                printHelpAndExit(options.list, default_options, True, 1)
+            else:
+                arg = sys.argv[arg_i]
+                if not arg.isdigit():
+                    printColor(f"ERROR: Argument for {flag} must be an unsigned integer", stdcolors["brightred"])
+                    printHelpAndExit(options.list, default_options, True, 1)
+                profile = True
+                profile_top = int(arg)
+
+        elif arg == "--profile-dump":
+            flag : str = arg
+            arg_i += 1
+            if arg_i == len(sys.argv):
+                printColor(f"ERROR: Missing argument for {flag}", stdcolors["brightred"])
+                printHelpAndExit(options.list, default_options, True, 1)
+            else:
+                profile = True
+                profile_dump = sys.argv[arg_i]
+
+        elif arg == "--ssh-mux":
+            use_ssh_mux = True
+
+        elif arg == "--daemon":
+            run_daemon = True
+
+        elif arg == "--daemon-stop":
+            daemon_stop = True
+
+        elif arg in ["--socket", "--query"]:
+            flag : str = arg
+            arg_i += 1
+            if arg_i == len(sys.argv):
+                printColor(f"ERROR: Missing argument for {flag}", stdcolors["brightred"])
+                printHelpAndExit(options.list, default_options, True, 1)
+            elif flag == "--socket":
+                socket_path = Path(sys.argv[arg_i])
+            else:
+                query_list.append(sys.argv[arg_i])
+
+        elif arg == "--plan":
+            plan = True
+
+        elif arg == "--dry-run":
+            plan = True
+            plan_options.dry_run = True
+
+        elif arg in ["--local-jobs", "--network-jobs"]:
+            flag : str = arg
+            arg_i += 1
+            if arg_i == len(sys.argv):
+                printColor(f"ERROR: Missing argument for {flag}", stdcolors["brightred"])
+                printHelpAndExit(options.list, default_options, True, 1)
+            else:
+                arg = sys.argv[arg_i]
+                if not arg.isdigit() or int(arg) == 0:
+                    printColor(f"ERROR: Argument for {flag} must be a positive integer", stdcolors["brightred"])
+                    printHelpAndExit(options.list, default_options, True, 1)
+                plan = True
+                if flag == "--local-jobs":
+                    plan_options.local_jobs = int(arg)
+                else:
+                    plan_options.network_jobs = int(arg)
+
+        elif arg == "--watch":
+            watch = True
+
+        elif arg in ["--watch-debounce", "--watch-fetch-interval"]:
+            flag : str = arg
+            arg_i += 1
+            if arg_i == len(sys.argv):
+                printColor(f"ERROR: Missing argument for {flag}", stdcolors["brightred"])
+                printHelpAndExit(options.list, default_options, True, 1)
+            else:
+                seconds = parseDuration(sys.argv[arg_i])
+                if seconds is None:
+                    printColor(f"ERROR: Argument for {flag} must be a duration like 90s, 15m, 2h or 1d", stdcolors["brightred"])
+                    printHelpAndExit(options.list, default_options, True, 1)
+                watch = True
+                if flag == "--watch-debounce":
+                    watch_options.debounce = seconds
+                else:
+                    watch_options.fetch_interval = seconds
+
+        elif arg == "--walk-threads":
+            flag : str = arg
+            arg_i += 1
+            if arg_i == len(sys.argv):
+                printColor(f"ERROR: Missing argument for {flag}", stdcolors["brightred"])
+                printHelpAndExit(options.list, default_options, True, 1)
+            else:
+                arg = sys.argv[arg_i]
+                if not arg.isdigit() or int(arg) == 0:
+                    printColor(f"ERROR: Argument for {flag} must be a positive integer", stdcolors["brightred"])
+                    printHelpAndExit(options.list, default_options, True, 1)
+                search_options.threads = int(arg)
+
+        elif arg == "--follow-symlinks":
+            search_options.follow_symlinks = True
+
+        elif arg == "--rescan":
+            search_options.cache.rescan = True
+
+        elif arg == "--no-skip":
+            search_options.skip_names = set()
+            watch_options.skip_names = set()
+
+        elif arg in ["--use-config", "--include-config"]:
             flag : str = arg
 
             print_help : bool = False
@@ -169,7 +515,7 @@ def git_check_main(
             while arg_i < len(sys.argv):
                 arg = sys.argv[arg_i]
                 if arg[0] != "-":
-                    use_config_list.append(arg)
+                    (use_config_list if flag == "--use-config" else include_config_list).append(arg)
                 else:
                     break
                 arg_i += 1
@@ -259,31 +605,95 @@ def git_check_main(
             printHelpAndExit(options.list, default_options, True, 1)
         arg_i += 1
     del arg_i
+
+    # Ways of running the check, of which only one can be chosen. The #
+    # daemon watches the repositories itself, so it takes --watch too #
+    modes : List[str] = [flag for flag, chosen in [
+        ("--plan/--dry-run", plan),
+        ("--daemon", run_daemon),
+        ("--watch", watch and not run_daemon),
+        ("--workers", len(transports) > 0),
+        ("--processes", processes > 1),
+    ] if chosen]
+    if len(modes) > 1:
+        printColor(f"ERROR: {', '.join(modes[:-1])} and {modes[-1]} cannot be used together", stdcolors["brightred"])
+        printHelpAndExit(options.list, default_options, True, 1)
     
-    # Read from JSON if specified #
-    if len(use_config_list) > 0:
-        readJSON(use_config_list, real_dir_list, real_search_list, real_ignore_list)
+    # Questions to a running daemon #
+    if len(query_list) > 0 or daemon_stop:
+        from . import daemon
+        exit_code : int = 0
+        try:
+            for target in query_list:
+                if target == "all":
+                    answer = daemon.query({"cmd" : "list"}, socket_path)
+                else:
+                    answer = daemon.query({"cmd" : "status", "path" : str(Path(target).absolute())}, socket_path)
+                print(json.dumps(answer))
+                if not answer.get("ok"):
+                    exit_code = 1
+            if daemon_stop:
+                daemon.query({"cmd" : "stop"}, socket_path)
+        except (OSError, ValueError) as e:
+            printColor(f"ERROR: Could not reach the git_check daemon: {e}", stdcolors["brightred"], file=sys.stderr)
+            exit(2)
+        exit(exit_code)
+
+    # Read from JSON if specified. The directories of --use-config are #
+    # copied by --set-config, --include-config is saved as an include   #
+    config_repos  : List[str] = []
+    config_search : List[str] = []
+    config_ignore : List[str] = []
+    config_patterns : List[str] = []
+    included : Optional[ResolvedConfig] = None
+    for labels in [use_config_list, include_config_list]:
+        if len(labels) > 0:
+            resolved = config_store.resolve(labels)
+            config_repos.extend(resolved.repos)
+            config_search.extend(resolved.search)
+            config_ignore.extend(resolved.ignore)
+            config_patterns.extend(resolved.patterns)
+            if labels is include_config_list:
+                included = resolved
     
     # Delete JSON configurations if specified #
     if len(del_config_list) > 0:
         deleteJSON(del_config_list)
     
     # Set directory and search lists (default if none specified) #
-    if len(real_dir_list) == 0 and len(real_search_list) == 0:
+    if len(real_dir_list) + len(real_search_list) + len(config_repos) + len(config_search) == 0:
         if len(dir_list) == 0 and len(search_list) == 0:
             printColor("ERROR: No directories specified", stdcolors["brightred"])
             printHelpAndExit(options.list, default_options, True, 1)
         real_dir_list = dir_list
         real_search_list = search_list
     
+    status_cache : Optional[StatusCache] = None
+    if use_cache:
+        status_cache = StatusCache()
+        if cache_max_age is not None:
+            status_cache.max_age = cache_max_age
+
+    # In jsonl format, stdout only holds the JSON records #
+    info_out = sys.stderr if output_format == "jsonl" else None
+
     # Run #
     print("Executing git_check with options: " +
         "--" + ("" if options.status else "no-") + "status " +
         "--" + ("" if options.commit else "no-") + "commit " +
         "--" + ("" if options.push   else "no-") + "push "   +
-        "--" + ("" if options.pull   else "no-") + "pull "
+        "--" + ("" if options.pull   else "no-") + "pull ",
+        file=info_out
     )
 
+    if (watch or run_daemon) and (options.commit or options.push or options.pull):
+        printColor(f"\nWARNING: {'--daemon' if run_daemon else '--watch'} only reports status. Ignoring --commit, --push and --pull.", stdcolors["brightyellow"], file=info_out)
+        options.commit = options.push = options.pull = False
+
+    if (watch or run_daemon) and deadline is not None:
+        printColor(f"\nWARNING: {'--daemon' if run_daemon else '--watch'} runs until stopped. Ignoring --deadline.", stdcolors["brightyellow"], file=info_out)
+        deadline = None
+
     recursive_warning : bool = False
     if recursive and recursive_max_level is None:
         recursive_warning = True    
@@ -291,37 +701,36 @@ def git_check_main(
         recursive_warning = True
     if recursive_warning:
         rec_str : str = "ALL" if recursive_max_level is None else str(recursive_max_level)
-        printColor(f"\nWARNING: Recursive search set to {rec_str}. This can be dangerous.", stdcolors["brightyellow"])
+        printColor(f"\nWARNING: Recursive search set to {rec_str}. This can be dangerous.", stdcolors["brightyellow"], file=info_out)
 
-    # Repositories directories #
-    dir_set : Set[Path] = set()
-    for dir in real_dir_list:
-        path = Path(dir).absolute()
-        if not path.is_dir():
+    # Directories given here must exist. Those of the configurations are #
+    # not checked now: a repository that does not exist is reported when #
+    # it is checked, and a search directory when it is searched          #
+    ignore_patterns = IgnorePatterns(config_patterns)
+    given_dirs   = [(dir, os.path.abspath(dir)) for dir in real_dir_list]
+    given_search = [(dir, os.path.abspath(dir)) for dir in real_search_list]
+    given_ignore = []
+    for dir in real_ignore_list:
+        if is_pattern(str(dir)):
+            ignore_patterns.add(str(dir))
+        else:
+            given_ignore.append((dir, os.path.abspath(os.path.expanduser(dir))))
+    for dir, path in given_dirs + given_search + given_ignore:
+        if not os.path.isdir(path):
             printColor(f"ERROR: {dir} is not a directory", stdcolors["brightred"])
             printHelpAndExit(options.list, default_options, True, 1)
-        else:
-            dir_set.add(path)
+
+    # Repositories directories #
+    dir_set : Set[Path] = {Path(path) for path in [*(path for _, path in given_dirs), *config_repos]}
     
     # Search directories #
-    search_set : Set[Path] = set()
-    for dir in real_search_list:
-        path = Path(dir).absolute()
-        if not path.is_dir():
-            printColor(f"ERROR: {dir} is not a directory", stdcolors["brightred"])
-            printHelpAndExit(options.list, default_options, True, 1)
-        else:
-            search_set.add(path)
+    search_set : Set[Path] = {Path(path) for path in [*(path for _, path in given_search), *config_search]}
 
-    # Ignore directories #
-    ignore_set : Set[Path] = set()
-    for dir in real_ignore_list:
-        path = Path(dir).absolute()
-        if not path.is_dir():
-            printColor(f"ERROR: {dir} is not a directory", stdcolors["brightred"])
-            printHelpAndExit(options.list, default_options, True, 1)
-        else:
-            ignore_set.add(path)
+    # Ignore directories and patterns. Those of the configurations are not #
+    # checked: one that does not exist just never matches                 #
+    ignore_set = PathSet(path for _, path in given_ignore)
+    for path in config_ignore:
+        ignore_set.add(path)
     
     # Create sets
     real_dir_list = sorted(dir_set)
@@ -330,26 +739,87 @@ def git_check_main(
     del dir_set, search_set
 
     if len(real_dir_list) > 0:
-        print("\nRepos to check:")
+        print("\nRepos to check:", file=info_out)
         for dir in real_dir_list:
-            print(f"    {dir}")
+            print(f"    {dir}", file=info_out)
 
     if len(real_search_list) > 0:
-        print("\nRoot directories to check:")
+        print("\nRoot directories to check:", file=info_out)
         for dir in real_search_list:
-            print(f"    {dir}")
+            print(f"    {dir}", file=info_out)
     
     if len(real_ignore_list) > 0:
-        print("\nDirectories to ignore:")
+        print("\nDirectories to ignore:", file=info_out)
         for dir in real_ignore_list:
-            print(f"    {dir}")
+            print(f"    {dir}", file=info_out)
     del real_ignore_list
 
+    if ignore_patterns:
+        print("\nPatterns to ignore:", file=info_out)
+        for pattern in ignore_patterns.patterns:
+            print(f"    {pattern}", file=info_out)
+        search_options.ignore_patterns = ignore_patterns
+
     if len(set_config_list) > 0:
-        writeJSON(set_config_list, real_dir_list, real_search_list, ignore_set)
+        # Reached through the includes, so not copied #
+        if included is not None:
+            included_repos, included_search = set(included.repos), set(included.search)
+            included_ignore = set(included.ignore + included.patterns)
+            real_dir_list = [dir for dir in real_dir_list if str(dir) not in included_repos]
+            real_search_list = [dir for dir in real_search_list if str(dir) not in included_search]
+            saved_ignore = [str(dir) for dir in ignore_set if str(dir) not in included_ignore]
+            saved_ignore += [pattern for pattern in ignore_patterns.patterns if pattern not in included_ignore]
+        else:
+            saved_ignore = [*map(str, ignore_set), *ignore_patterns.patterns]
+        writeJSON(set_config_list, real_dir_list, real_search_list, saved_ignore, include_config_list)
     else:
+        profiler : Optional[Profiler] = Profiler() if profile else None
+        runner = AsyncGitRunner(max_processes=jobs, timeouts=timeouts, profiler=profiler, deadline=deadline)
+        if plan:
+            runner.max_processes = max(
+                jobs,
+                (jobs if plan_options.local_jobs is None else plan_options.local_jobs) +
+                (jobs if plan_options.network_jobs is None else plan_options.network_jobs)
+            )
+        ssh_mux : Optional["SSHMultiplexer"] = None
+        if use_ssh_mux:
+            from .ssh_mux import SSHMultiplexer
+            if SSHMultiplexer.supported():
+                ssh_mux = SSHMultiplexer()
+                runner.env.update(ssh_mux.start())
+            else:
+                printColor("\nWARNING: SSH connection sharing is not supported here. Ignoring --ssh-mux.", stdcolors["brightyellow"], file=info_out)
         try:
-            git_check(real_dir_list, real_search_list, ignore_set, options, recursive, recursive_max_level)
+            if plan:
+                git_plan(real_dir_list, real_search_list, ignore_set, options, recursive, recursive_max_level, jobs, runner, search_options, fetch_options, plan_options, output_format)
+            elif run_daemon:
+                from . import daemon
+                if not daemon.supported():
+                    printColor("ERROR: --daemon needs Unix domain sockets, which are not available here.", stdcolors["brightred"])
+                    exit(1)
+                options.commit = options.push = options.pull = False
+                daemon.git_daemon(real_dir_list, real_search_list, ignore_set, options, recursive, recursive_max_level, jobs, runner, search_options, fetch_options, watch_options, socket_path)
+            elif watch:
+                git_watch(real_dir_list, real_search_list, ignore_set, options, recursive, recursive_max_level, jobs, runner, search_options, fetch_options, watch_options, output_format)
+            elif len(transports) > 0:
+                from .distributed import git_check_distributed
+                git_check_distributed(real_dir_list, real_search_list, ignore_set, options, recursive, recursive_max_level, transports, jobs, runner, search_options, fetch_options, output_format, status_cache, retries)
+            elif processes > 1:
+                from .processes import git_check_processes
+                git_check_processes(real_dir_list, real_search_list, ignore_set, options, recursive, recursive_max_level, processes, jobs, runner, search_options, fetch_options, output_format, status_cache)
+            else:
+                git_check(real_dir_list, real_search_list, ignore_set, options, recursive, recursive_max_level, jobs, runner, search_options, fetch_options, output_format, status_cache)
+        except RuntimeError as e:
+            printColor(f"ERROR: {e}", stdcolors["brightred"])
+            exit(1)
         except KeyboardInterrupt:
             print("\nKeyboard interrupt")
             exit(1)
+        finally:
+            if ssh_mux is not None:
+                ssh_mux.stop()
+
+        if profiler is not None:
+            profiler.print_summary(profile_top, file=info_out)
+            if profile_dump is not None:
+                profiler.dump(Path(profile_dump))
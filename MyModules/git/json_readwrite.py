@@ -1,68 +1,294 @@
-from typing import List, Set
-import json
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+from contextlib import contextmanager
 from pathlib import Path
+import json, os
 
 from .colors import *
+from .patterns import is_pattern
 
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
 
-def createIfNotExists(path : Path, dir_error : bool = True) -> None:
-    json_path = Path(__file__).parent / "config.json"
-    if not json_path.exists():
-        with open(json_path, "w") as fout:
-            json.dump(dict(), fout)
-    elif dir_error and json_path.is_dir():
-        exitOnError(f"YOU SHOULD NEVER SEE THIS: {path} is a directory.")
+# Calls to msvcrt.locking() before giving up, about 10 seconds each #
+LOCK_ATTEMPTS : int = 6
+# Resolved configurations kept on disk, the oldest dropped first #
+RESOLVED_KEEP : int = 16
+
+
+# Writes data as JSON to a per-process temporary file and moves it over #
+# path, so readers see either the old or the new contents, never half. #
+def writeAtomic(path : Path, data) -> None:
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    with tmp_path.open("w") as fout:
+        json.dump(data, fout, indent=4)
+        fout.flush()
+        os.fsync(fout.fileno())
+    os.replace(tmp_path, path)
+
+
+# Holds an exclusive lock on path (created if needed) while in the block #
+@contextmanager
+def lockedFile(path : Path) -> Iterator[None]:
+    with open(path, "a+") as lock_file:
+        fd = lock_file.fileno()
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+        else:
+            for attempt in range(LOCK_ATTEMPTS):
+                try:
+                    lock_file.seek(0)
+                    msvcrt.locking(fd, msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    if attempt == LOCK_ATTEMPTS - 1:
+                        exitOnError(f"ERROR: Could not lock {path}. Another git_check may be saving configurations; try again later.")
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+            else:
+                lock_file.seek(0)
+                msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+
+
+# Directories of a set of saved configurations and of the ones they #
+# include: absolute, without duplicates and in the order they were   #
+# found. Ignore patterns are kept apart from the ignore directories. #
+class ResolvedConfig:
+    def __init__(self, labels : List[str], digest : str) -> None:
+        self.labels = labels
+        self.digest = digest
+        self.repos : List[str] = []
+        self.search : List[str] = []
+        self.ignore : List[str] = []
+        self.patterns : List[str] = []
+
+    def toDict(self) -> Dict[str, List[str]]:
+        return {"repos" : self.repos, "search" : self.search, "ignore" : self.ignore, "patterns" : self.patterns}
+
+    @staticmethod
+    def fromDict(labels : List[str], digest : str, entry) -> Optional["ResolvedConfig"]:
+        resolved = ResolvedConfig(labels, digest)
+        if not type(entry) is dict:
+            return None
+        for t in ["repos", "search", "ignore", "patterns"]:
+            dirs = entry.get(t)
+            if not type(dirs) is list or not all(type(dir) is str for dir in dirs):
+                return None
+            setattr(resolved, t, dirs)
+        return resolved
+
+
+# The saved configurations of config.json, loaded and validated once and #
+# then served from memory. The file is read again only when its mtime or #
+# size changed, e.g. because another git_check saved a configuration.    #
+# Changes go through edit(), which holds config.json.lock, applies them  #
+# to the latest contents and replaces the file atomically, so concurrent #
+# runs neither corrupt it nor lose each other's configurations.          #
+# Resolved configurations are kept in config_resolved.json by digest, so #
+# later runs with the same configurations skip resolving them.           #
+class ConfigStore:
+    default_path : Path = Path(__file__).parent / "config.json"
+    types : List[str] = ["repos", "search", "ignore", "include"]
+
+    def __init__(self, path : Optional[Path] = None) -> None:
+        self.path = ConfigStore.default_path if path is None else path
+        self.lock_path = self.path.with_name(self.path.name + ".lock")
+        self.resolved_path = self.path.with_name(self.path.stem + "_resolved.json")
+        self._data : Optional[Dict[str, dict]] = None
+        self._stamp : Optional[Tuple[int, int]] = None
+        # Resolved configurations by the hash of what they were built from #
+        self._resolved : Dict[str, ResolvedConfig] = dict()
+
+    def stamp(self) -> Optional[Tuple[int, int]]:
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    @staticmethod
+    def validate(data) -> None:
+        if not type(data) is dict:
+            exitOnError("YOU SHOULD NEVER SEE THIS: json.load() did not return dictionary.")
+        for label, config in data.items():
+            if not type(config) is dict:
+                exitOnError(f"YOU SHOULD NEVER SEE THIS: Configuration {label} is not a dictionary.")
+            for t in config:
+                if t not in ConfigStore.types:
+                    exitOnError(f"YOU SHOULD NEVER SEE THIS: Type {t} in the config {label} is not a valid type.")
+                if not type(config[t]) is list:
+                    exitOnError(f"YOU SHOULD NEVER SEE THIS: A type in the config {label} is not a list.")
+                for dir in config[t]:
+                    if not type(dir) is str:
+                        exitOnError(f"YOU SHOULD NEVER SEE THIS: A directory in the config {label} is not a string.")
+
+    def load(self) -> Dict[str, dict]:
+        stamp = self.stamp()
+        if self._data is None or stamp != self._stamp:
+            if self.path.is_dir():
+                exitOnError(f"YOU SHOULD NEVER SEE THIS: {self.path} is a directory.")
+            data : dict = dict()
+            if stamp is not None:
+                with self.path.open() as fin:
+                    data = json.load(fin)
+                ConfigStore.validate(data)
+            self._data = data
+            self._stamp = stamp
+        return self._data
+
+    def names(self) -> List[str]:
+        return list(self.load())
+
+    def __contains__(self, label : str) -> bool:
+        return label in self.load()
+
+    def get(self, label : str) -> dict:
+        return self.load()[label]
+
+    # Labels followed by the configurations they include, recursively. #
+    # Each configuration appears once, the first time it is reached.   #
+    def expand(self, labels : List[str]) -> List[str]:
+        data = self.load()
+        expanded : Dict[str, None] = dict()
+
+        def visit(label : str, chain : List[str]) -> None:
+            if label in chain:
+                exitOnError(f"ERROR: Configuration {label} includes itself: {' > '.join(chain + [label])}")
+            if label in expanded:
+                return
+            if label not in data:
+                if len(chain) == 0:
+                    exitOnError(f"ERROR: Configuration {label} does not exist.")
+                exitOnError(f"ERROR: Configuration {label}, included by {chain[-1]}, does not exist.")
+            expanded[label] = None
+            for included in data[label].get("include", []):
+                visit(included, chain + [label])
+
+        for label in labels:
+            visit(label, [])
+        return list(expanded)
+
+    # Resolved configurations saved by earlier runs, by digest. A missing #
+    # or damaged file only means they are resolved again.                #
+    def loadResolved(self) -> Dict[str, dict]:
+        try:
+            with self.resolved_path.open() as fin:
+                saved = json.load(fin)
+        except (OSError, ValueError):
+            return dict()
+        return saved if type(saved) is dict else dict()
+
+    # Saves resolved under its digest as the newest entry.            #
+    # Losing a race with another run only costs that run's entry.      #
+    def saveResolved(self, saved : Dict[str, dict], resolved : ResolvedConfig) -> None:
+        saved.pop(resolved.digest, None)
+        saved[resolved.digest] = resolved.toDict()
+        while len(saved) > RESOLVED_KEEP:
+            del saved[next(iter(saved))]
+        try:
+            writeAtomic(self.resolved_path, saved)
+        except OSError:
+            pass
+
+    # Directories of labels and of the configurations they include. The #
+    # result is kept, in memory and in config_resolved.json, under a hash #
+    # of the contents of those configurations and of the directories      #
+    # relative paths depend on, so it is built again only when one of     #
+    # them changed. Whether the directories exist is not checked here but #
+    # when they are checked or searched.                                  #
+    def resolve(self, labels : List[str]) -> ResolvedConfig:
+        data = self.load()
+        expanded = self.expand(labels)
+        source = [os.getcwd(), os.path.expanduser("~"), [[label, data[label]] for label in expanded]]
+        import hashlib
+        digest = hashlib.sha256(json.dumps(source, sort_keys=True).encode()).hexdigest()
+        resolved = self._resolved.get(digest)
+        if resolved is not None:
+            return resolved
+        saved = self.loadResolved()
+        resolved = ResolvedConfig.fromDict(list(labels), digest, saved.get(digest))
+        if resolved is not None:
+            self._resolved[digest] = resolved
+            return resolved
+
+        resolved = ResolvedConfig(list(labels), digest)
+        found : Dict[str, Dict[str, None]] = {"repos" : dict(), "search" : dict(), "ignore" : dict()}
+        patterns : Dict[str, None] = dict()
+        for label in expanded:
+            config = data[label]
+            for t in found:
+                for dir in config.get(t, []):
+                    if t == "ignore" and is_pattern(dir):
+                        patterns[dir] = None
+                    else:
+                        found[t][os.path.abspath(os.path.expanduser(dir))] = None
+        resolved.repos = list(found["repos"])
+        resolved.search = list(found["search"])
+        resolved.ignore = list(found["ignore"])
+        resolved.patterns = list(patterns)
+        self._resolved[digest] = resolved
+        self.saveResolved(saved, resolved)
+        return resolved
+
+    # Configurations that include label directly #
+    def includedBy(self, label : str) -> List[str]:
+        return [other for other, config in self.load().items() if label in config.get("include", [])]
+
+    # Yields the configurations to be changed in place, and saves them #
+    @contextmanager
+    def edit(self) -> Iterator[Dict[str, dict]]:
+        with lockedFile(self.lock_path):
+            data = self.load()
+            try:
+                yield data
+            except BaseException:
+                # Dropped, to be read again #
+                self._data = None
+                raise
+            self.save(data)
+
+    def save(self, data : Dict[str, dict]) -> None:
+        writeAtomic(self.path, data)
+        self._data = data
+        self._stamp = self.stamp()
+
+
+config_store = ConfigStore()
 
 
 def getConfigList() -> List[str]:
-    json_path : Path = Path(__file__).parent / "config.json"
-    createIfNotExists(json_path)
-    
-    with json_path.open() as fin:
-        data = json.load(fin)
-    if not type(data) is dict:
-        exitOnError("YOU SHOULD NEVER SEE THIS: json.load() did not return dictionary.")
-    
-    return [key for key in data]
+    return config_store.names()
 
 
 def listOneConfig(config_list : dict, label : str) -> None:
     error : bool = True
     config = config_list[label]
-    if not type(config) is dict:
-        exitOnError(f"YOU SHOULD NEVER SEE THIS: Configuration {label} is not a dictionary.")
-    types : dict = {"repos" : "Repositories", "search" : "Search directories", "ignore" : "Ignore directories"}
+    types : dict = {"include" : "Includes", "repos" : "Repositories", "search" : "Search directories", "ignore" : "Ignore directories"}
     for t in types:
         if t in config:
          if len(config[t]) > 0:
-            if not type(config[t]) is list:
-                exitOnError(f"YOU SHOULD NEVER SEE THIS: A type in the config {label} is not a list.")
             error = False
             print(f"\n        {types[t]}:")
             for dir in config[t]:
-                if not type(dir) is str:
-                    exitOnError(f"YOU SHOULD NEVER SEE THIS: A directory in the config {label} is not a string.")
                 print(f"            {dir}")
-    
+
     if error:
         exitOnError(f"Error: configuration {label} is empty.")
 
 
 def listAllConfigs(specific : List[str] = [], verbose : bool = False) -> None:
-    json_path : Path = Path(__file__).parent / "config.json"
-    createIfNotExists(json_path)
-    
-    with json_path.open() as fin:
-        data = json.load(fin)
-    if not type(data) is dict:
-        print("YOU SHOULD NEVER SEE THIS: json.load() did not return dictionary.")
-        return
-    
+    data = config_store.load()
+
     if len(specific) == 0:
         if len(data) == 0:
             print("\nThere are no saved configurations.")
         else:
-            print("\nConfigurations:")    
+            print("\nConfigurations:")
             for key in data:
                 print(('\n' if verbose else '') + f"    {key}")
                 if (verbose):
@@ -79,19 +305,13 @@ def listAllConfigs(specific : List[str] = [], verbose : bool = False) -> None:
 
 
 def listConfigsAndExit(specific : List[str] = [], verbose : bool = False) -> None:
-    json_path : Path = Path(__file__).parent / "config.json"
-    createIfNotExists(json_path)
-    
-    with json_path.open() as fin:
-        data = json.load(fin)
-    if not type(data) is dict:
-        exitOnError("YOU SHOULD NEVER SEE THIS: json.load() did not return dictionary.")
-    
+    data = config_store.load()
+
     if len(specific) == 0:
         if len(data) == 0:
             print("\nThere are no saved configurations.")
         else:
-            print("\nConfigurations:")    
+            print("\nConfigurations:")
             for key in data:
                 print(('\n' if verbose else '') + f"    {key}")
                 if (verbose):
@@ -105,7 +325,7 @@ def listConfigsAndExit(specific : List[str] = [], verbose : bool = False) -> Non
         for key in specific:
             print(f"\n    {key}")
             listOneConfig(data, key)
-    
+
     exit(0)
 
 
@@ -115,50 +335,24 @@ def readJSON(
     search_list     : List[str],
     ignore_list     : List[str]
 ) -> None:
-    json_path : Path = Path(__file__).parent / "config.json"
-    createIfNotExists(json_path)
-    
-    with json_path.open() as fin:
-        data = json.load(fin)
-    if not type(data) is dict:
-        exitOnError("YOU SHOULD NEVER SEE THIS: json.load() did not return dictionary.")
-    
-    for label in use_config_list:
-        if label not in data:
-            exitOnError(f"ERROR: Configuration {label} does not exist.")
-    
-    for label in use_config_list:
-        config = data[label]
-        if not type(config) is dict:
-            exitOnError(f"YOU SHOULD NEVER SEE THIS: Configuration {label} is not a dictionary.")
-        
-        for t in config:
-            if t not in ["repos", "search", "ignore"]:
-                exitOnError(f"YOU SHOULD NEVER SEE THIS: Type {t} in the config {label} is not a valid type.")
-            if len(config[t]) > 0:
-                if not type(config[t]) is list:
-                    exitOnError(f"YOU SHOULD NEVER SEE THIS: A type in the config {label} is not a list.")
-                for dir in config[t]:
-                    if not type(dir) is str:
-                        exitOnError(f"YOU SHOULD NEVER SEE THIS: A directory in the config {label} is not a string.")
-                    (dir_list if t =="repos" else (search_list if t == "search" else ignore_list)).append(dir)
+    resolved = config_store.resolve(use_config_list)
+    dir_list.extend(resolved.repos)
+    search_list.extend(resolved.search)
+    ignore_list.extend(resolved.ignore)
+    ignore_list.extend(resolved.patterns)
 
 
 def writeJSON(
     set_config_list : List[str],
     dir_list        : List[str],
     search_list     : List[str],
-    ignore_set      : Set [str]
+    ignore_set      : Set [str],
+    include_list    : List[str] = []
 ) -> None:
-    json_path : Path = Path(__file__).parent / "config.json"
-    createIfNotExists(json_path)
-    
-    with json_path.open() as fin:
-        data = json.load(fin)
-    if not type(data) is dict:
-        exitOnError("YOU SHOULD NEVER SEE THIS: json.load() did not return dictionary.")
-    
-    ignore_list = sorted(ignore_set)
+    data = config_store.load()
+
+    # Asked before taking the lock, not to hold it while waiting for input #
+    labels : List[str] = []
     for label in set_config_list:
         if label in data:
             inp = ""
@@ -167,162 +361,113 @@ def writeJSON(
                 inp = input().lower()
             if inp == "n":
                 continue
-        
-        data[label] = dict()
-        config = data[label]
-
-        if len(dir_list) > 0:
-            config["repos"] = list()
-            for dir in dir_list:
-                config["repos"].append(str(dir))
-        
-        if len(search_list) > 0:
-            config["search"] = list()
-            for dir in search_list:
-                config["search"].append(str(dir))
-
-        if len(ignore_list) > 0:
-            config["ignore"] = list()
-            for dir in ignore_list:
-                config["ignore"].append(str(dir))
-
-    with json_path.open("w") as fout:
-        json.dump(data, fout, indent=4)
+        labels.append(label)
+
+    config : Dict[str, List[str]] = dict()
+    if len(include_list) > 0:
+        config["include"] = list(dict.fromkeys(include_list))
+    if len(dir_list) > 0:
+        config["repos"] = [str(dir) for dir in dir_list]
+    if len(search_list) > 0:
+        config["search"] = [str(dir) for dir in search_list]
+    if len(ignore_set) > 0:
+        config["ignore"] = [str(dir) for dir in sorted(ignore_set)]
+
+    with config_store.edit() as data:
+        for label in labels:
+            data[label] = {t : list(dirs) for t, dirs in config.items()}
+        # Refused before anything is saved, so that no cycle is left behind #
+        config_store.expand(labels)
 
 
 def deleteJSON(del_config_list : List[str]) -> None:
-    json_path : Path = Path(__file__).parent / "config.json"
-    createIfNotExists(json_path)
-    
-    with json_path.open() as fin:
-        data = json.load(fin)
-    if not type(data) is dict:
-        exitOnError("YOU SHOULD NEVER SEE THIS: json.load() did not return dictionary.")
-    
+    data = config_store.load()
+
     for label in del_config_list:
         if label not in data:
             exitOnError(f"ERROR: Configuration {label} does not exist.")
-    
+
     printColor("WARNING: The following configurations will be deleted:", stdcolors["yellow"])
     for label in del_config_list:
         printColor(f"    {label}", stdcolors["yellow"])
+    for label in del_config_list:
+        included_by = [other for other in config_store.includedBy(label) if other not in del_config_list]
+        if len(included_by) > 0:
+            printColor(f"WARNING: {label} is included by {', '.join(included_by)}, which will not work until it is removed from them.", stdcolors["yellow"])
     inp = ""
     while inp not in ["y", "n"]:
         printColor("Continue? [y/n]", stdcolors["yellow"])
         inp = input().lower()
-    
+
     if inp == "y":
-        for label in del_config_list:
-            del data[label]
-        with json_path.open("w") as fout:
-            json.dump(data, fout, indent=4)
+        with config_store.edit() as data:
+            for label in del_config_list:
+                data.pop(label, None)
 
     exit(0)
 
 
 # Used to delete any directory in the JSON that does not exist anymore #
 def purgeJSON() -> None:
-    json_path : Path = Path(__file__).parent / "config.json"
-    createIfNotExists(json_path)
-    
-    with json_path.open() as fin:
-        data = json.load(fin)
-    if not type(data) is dict:
-        exitOnError("YOU SHOULD NEVER SEE THIS: json.load() did not return dictionary.")
-    
     print("")
-    del_configs = []
-    something_done : bool = False
-    for label in data:
-        config = data[label]
-        if not type(config) is dict:
-            exitOnError(f"YOU SHOULD NEVER SEE THIS: Configuration {label} is not a dictionary.")
-        for t in config:
-            if t not in ["repos", "search", "ignore"]:
-                exitOnError(f"YOU SHOULD NEVER SEE THIS: Type {t} in the config {label} is not a valid type.")
-            if len(config[t]) > 0:
-                if not type(config[t]) is list:
-                    exitOnError(f"YOU SHOULD NEVER SEE THIS: A type in the config {label} is not a list.")
-                for dir in config[t]:
-                    if not type(dir) is str:
-                        exitOnError(f"YOU SHOULD NEVER SEE THIS: A directory in the config {label} is not a string.")
-                    if not Path(dir).is_dir():
-                        something_done = True
-                        print(f"Purging: {label} > {t} > {dir}")
-                        config[t].remove(dir)
-        del_config : bool = True
-        for t in config:
-            if len(config[t]) > 0:
-                del_config = False
-                break
-        if del_config:
-            something_done = True
-            del_configs.append(label)
-    
-    if len(del_configs) > 0:
-        printColor("\nThe following configurations do not hold valid directories anymore and will be deleted:", stdcolors["yellow"])
-        for label in del_configs:
-            printColor(f"    {label}", stdcolors["yellow"])
-            del data[label]
-
-    with json_path.open("w") as fout:
-        json.dump(data, fout, indent=4)
-    
-    if not something_done:
-        print("Nothing to purge")
-    else:
-        printColor("\n-- Purge complete --", stdcolors["green"])
-    
+    purgeJSON_Console()
     exit(0)
 
 
 # Used to delete any directory in the JSON that does not exist anymore #
 def purgeJSON_Console() -> None:
-    json_path : Path = Path(__file__).parent / "config.json"
-    createIfNotExists(json_path)
-    
-    with json_path.open() as fin:
-        data = json.load(fin)
-    if not type(data) is dict:
-        exitOnError("YOU SHOULD NEVER SEE THIS: json.load() did not return dictionary.")
-    
-    del_configs = []
     something_done : bool = False
-    for label in data:
-        config = data[label]
-        if not type(config) is dict:
-            exitOnError(f"YOU SHOULD NEVER SEE THIS: Configuration {label} is not a dictionary.")
-        for t in config:
-            if t not in ["repos", "search", "ignore"]:
-                exitOnError(f"YOU SHOULD NEVER SEE THIS: Type {t} in the config {label} is not a valid type.")
-            if len(config[t]) > 0:
-                if not type(config[t]) is list:
-                    exitOnError(f"YOU SHOULD NEVER SEE THIS: A type in the config {label} is not a list.")
+    with config_store.edit() as data:
+        del_configs = []
+        for label, config in data.items():
+            for t in config:
+                if t == "include":
+                    continue
+                kept : List[str] = []
                 for dir in config[t]:
-                    if not type(dir) is str:
-                        exitOnError(f"YOU SHOULD NEVER SEE THIS: A directory in the config {label} is not a string.")
-                    if not Path(dir).is_dir():
+                    if (t == "ignore" and is_pattern(dir)) or Path(dir).is_dir():
+                        kept.append(dir)
+                    else:
                         something_done = True
                         print(f"Purging: {label} > {t} > {dir}")
-                        config[t].remove(dir)
-        del_config : bool = True
-        for t in config:
-            if len(config[t]) > 0:
-                del_config = False
+                config[t] = kept
+            if all(len(config[t]) == 0 for t in config):
+                something_done = True
+                del_configs.append(label)
+
+        # Includes of deleted configurations are dropped too, which can leave #
+        # a configuration made only of includes with nothing, in turn         #
+        empty : List[str] = list(del_configs)
+        while True:
+            for label in empty:
+                del data[label]
+            empty = []
+            for label, config in data.items():
+                if "include" not in config:
+                    continue
+                kept : List[str] = []
+                for included in config["include"]:
+                    if included in data:
+                        kept.append(included)
+                    else:
+                        something_done = True
+                        print(f"Purging: {label} > include > {included}")
+                if len(kept) > 0:
+                    config["include"] = kept
+                else:
+                    del config["include"]
+                if all(len(config[t]) == 0 for t in config):
+                    something_done = True
+                    empty.append(label)
+            if len(empty) == 0:
                 break
-        if del_config:
-            something_done = True
-            del_configs.append(label)
-    
-    if len(del_configs) > 0:
-        printColor("\nThe following configurations do not hold valid directories anymore and will be deleted:", stdcolors["yellow"])
-        for label in del_configs:
-            printColor(f"    {label}", stdcolors["yellow"])
-            del data[label]
-
-    with json_path.open("w") as fout:
-        json.dump(data, fout, indent=4)
-    
+            del_configs += empty
+
+        if len(del_configs) > 0:
+            printColor("\nThe following configurations do not hold valid directories anymore and will be deleted:", stdcolors["yellow"])
+            for label in del_configs:
+                printColor(f"    {label}", stdcolors["yellow"])
+
     if not something_done:
         print("Nothing to purge")
     else:
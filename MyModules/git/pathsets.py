@@ -0,0 +1,112 @@
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Union
+from pathlib import Path
+import os
+
+
+# Sets of paths for the directory walker and the configurations. Paths #
+# are kept as their normalised strings, not interned as ids: an intern #
+# table has to outlive the sets that use it, so in --daemon, --watch   #
+# and the console it kept every directory ever walked, and a set of    #
+# ints saved nothing over a set of the strings that the table held     #
+# anyway. What remains is PathSet, which takes the strings the walker  #
+# builds without making Path objects, and PathTrie, which answers      #
+# whether a directory is under an ignored one in O(depth).             #
+
+
+PathLike = Union[str, Path]
+
+
+# Key of a path in a PathSet or PathTrie. Strings are taken as they  #
+# are: they must be normalised, like str(Path(...)) or os.path.join() #
+# of normalised parts, to match the same path given as a Path.        #
+def path_key(path : PathLike) -> str:
+    return path if type(path) is str else str(path)
+
+
+# Set of paths stored as strings, so that the directory walker can add #
+# the ones it builds with os.path.join() without making Path objects.  #
+# Accepts str or Path and yields Path objects, so it can stand in for  #
+# a Set[Path].                                                          #
+class PathSet:
+    def __init__(self, paths : Iterable[PathLike] = ()) -> None:
+        self._keys : Set[str] = {path_key(path) for path in paths}
+
+    def add(self, path : PathLike) -> None:
+        self._keys.add(path_key(path))
+
+    def remove(self, path : PathLike) -> None:
+        self._keys.remove(path_key(path))
+
+    def discard(self, path : PathLike) -> None:
+        self._keys.discard(path_key(path))
+
+    def clear(self) -> None:
+        self._keys.clear()
+
+    def __contains__(self, path : PathLike) -> bool:
+        return path_key(path) in self._keys
+
+    def __iter__(self) -> Iterator[Path]:
+        return (Path(key) for key in list(self._keys))
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def __repr__(self) -> str:
+        return f"PathSet({sorted(self._keys)})"
+
+
+class TrieNode:
+    __slots__ = ("terminal", "children")
+
+    def __init__(self) -> None:
+        self.terminal : bool = False
+        self.children : Dict[str, "TrieNode"] = dict()
+
+
+# Trie of path components. Tells in O(depth) whether a path, or any  #
+# directory above it, was added; the directory walker also follows   #
+# its nodes alongside the directories, one component at a time.      #
+class PathTrie:
+    def __init__(self, paths : Iterable[PathLike] = ()) -> None:
+        self.root = TrieNode()
+        for path in paths:
+            self.add(path)
+
+    @staticmethod
+    def parts(path : PathLike) -> List[str]:
+        return [part for part in path_key(path).split(os.sep) if part != ""] or [os.sep]
+
+    def add(self, path : PathLike) -> None:
+        node = self.root
+        for part in PathTrie.parts(path):
+            child = node.children.get(part)
+            if child is None:
+                child = TrieNode()
+                node.children[part] = child
+            node = child
+        node.terminal = True
+
+    # Node of path, or None if no added path goes through it #
+    def node(self, path : PathLike) -> Optional[TrieNode]:
+        node = self.root
+        for part in PathTrie.parts(path):
+            node = node.children.get(part)
+            if node is None:
+                return None
+        return node
+
+    def __contains__(self, path : PathLike) -> bool:
+        node = self.node(path)
+        return node is not None and node.terminal
+
+    # Whether path or a directory above it was added #
+    def covers(self, path : PathLike) -> bool:
+        node = self.root
+        for part in PathTrie.parts(path):
+            node = node.children.get(part)
+            if node is None:
+                return False
+            if node.terminal:
+                return True
+        return False
@@ -0,0 +1,122 @@
+from typing import Iterable, List, Optional, Pattern, Tuple
+from pathlib import Path
+import os, re
+
+
+# gitignore-style patterns for --ignore, matched against directories: #
+#   "vendor*"          a directory name, at any depth                  #
+#   "**/vendor"        the same                                         #
+#   "*/tmp-*"          a path relative to the --search directory        #
+#   "~/scratch/**"     everything under an absolute path ("~" expands)  #
+# "*" and "?" do not match "/", "**" matches any number of directories #
+# and "[...]" is a character class ("[!...]" negated). A trailing "/"  #
+# is ignored. All the patterns are compiled into two regular           #
+# expressions, one for relative and one for absolute paths.            #
+
+
+def is_pattern(text : str) -> bool:
+    return any(c in text for c in "*?[")
+
+
+def glob_to_regex(pattern : str) -> str:
+    out : List[str] = []
+    i : int = 0
+    n : int = len(pattern)
+    while i < n:
+        c = pattern[i]
+        if c == "*":
+            if pattern.startswith("**", i):
+                i += 2
+                if i < n and pattern[i] == "/":
+                    out.append("(?:.*/)?")
+                    i += 1
+                else:
+                    out.append(".*")
+                continue
+            out.append("[^/]*")
+        elif c == "?":
+            out.append("[^/]")
+        elif c == "[":
+            j = pattern.find("]", i + 2)
+            if j < 0:
+                out.append(re.escape(c))
+            else:
+                body = pattern[i+1:j]
+                if body.startswith("!"):
+                    body = "^" + body[1:]
+                out.append("[" + body.replace("\\", "\\\\") + "]")
+                i = j
+        else:
+            out.append(re.escape(c))
+        i += 1
+    return "".join(out)
+
+
+class IgnorePatterns:
+    def __init__(self, patterns : Iterable[str] = ()) -> None:
+        # As given, to be saved in configurations #
+        self.patterns : List[str] = []
+        self._relative : Optional[Pattern] = None
+        self._absolute : Optional[Pattern] = None
+        for pattern in patterns:
+            self.add(pattern)
+
+    def __bool__(self) -> bool:
+        return len(self.patterns) > 0
+
+    def add(self, pattern : str) -> None:
+        if pattern not in self.patterns:
+            self.patterns.append(pattern)
+            self._relative = self._absolute = None
+
+    # (regex, is absolute) of a pattern #
+    @staticmethod
+    def translate(pattern : str) -> Tuple[str, bool]:
+        pattern = os.path.expanduser(pattern)
+        if os.sep != "/":
+            pattern = pattern.replace(os.sep, "/")
+        pattern = pattern.rstrip("/")
+        if pattern.startswith("./"):
+            pattern = pattern[2:]
+        if os.path.isabs(pattern):
+            return glob_to_regex(pattern), True
+        if "/" in pattern:
+            return glob_to_regex(pattern), False
+        return "(?:.*/)?" + glob_to_regex(pattern), False
+
+    def compile(self) -> None:
+        relative : List[str] = []
+        absolute : List[str] = []
+        for pattern in self.patterns:
+            regex, is_absolute = IgnorePatterns.translate(pattern)
+            (absolute if is_absolute else relative).append(regex)
+        self._relative = re.compile("|".join(f"(?:{r})" for r in relative)) if len(relative) > 0 else None
+        self._absolute = re.compile("|".join(f"(?:{r})" for r in absolute)) if len(absolute) > 0 else None
+
+    # path is absolute, relative is the same path relative to the search #
+    # directory it was found under                                       #
+    def matches(self, path : str, relative : str) -> bool:
+        if self._relative is None and self._absolute is None:
+            if len(self.patterns) == 0:
+                return False
+            self.compile()
+        if os.sep != "/":
+            path = path.replace(os.sep, "/")
+            relative = relative.replace(os.sep, "/")
+        if self._relative is not None and self._relative.fullmatch(relative) is not None:
+            return True
+        return self._absolute is not None and self._absolute.fullmatch(path) is not None
+
+
+# Splits --ignore arguments (or the "ignore" list of a configuration) #
+# into directories and patterns                                       #
+def split_ignores(items : Iterable) -> Tuple[List[Path], IgnorePatterns]:
+    dirs : List[Path] = []
+    patterns = IgnorePatterns()
+    for item in items:
+        text = str(item)
+        if is_pattern(text):
+            patterns.add(text)
+        else:
+            dirs.append(Path(os.path.expanduser(text)))
+    return dirs, patterns
@@ -0,0 +1,196 @@
+from typing import List, Optional, Set, TextIO, Tuple
+from pathlib import Path
+import io, sys, time
+
+from .colors import printColor, stdcolors
+from .git_check import GitOptions, collect_repos, git_check_dir_list, plan_steps, run_step, STEP_COMMIT
+from .discovery import SearchOptions
+from .remotes import FetchOptions, fetch_host
+from .report import RepoResult
+from .runner import AsyncGitRunner
+
+
+class PlanOptions:
+    def __init__(
+        self,
+        local_jobs : Optional[int] = None,
+        network_jobs : Optional[int] = None,
+        dry_run : bool = False,
+    ) -> None:
+        # None uses the value of --jobs #
+        self.local_jobs = local_jobs
+        self.network_jobs = network_jobs
+        self.dry_run = dry_run
+
+
+# (result of the status pass, steps to take) for every repository with steps #
+Plan = List[Tuple[RepoResult, List[str]]]
+
+
+def build_plan(reports : List[RepoResult], options : GitOptions) -> Plan:
+    plan : Plan = []
+    for report in reports:
+        if report.status is None or len(report.errors) > 0:
+            continue
+        steps = plan_steps(report.status, options, report.fetch_ok)
+        if len(steps) > 0:
+            plan.append((report, steps))
+    return plan
+
+
+# (result of the status pass, warning) for every repository whose push or #
+# pull is left out of the plan because its branch diverged from the       #
+# remote, or will after the planned commit. The warnings are the ones an  #
+# inline run prints for them.                                             #
+def diverged_repos(plan : Plan, reports : List[RepoResult], options : GitOptions) -> List[Tuple[RepoResult, str]]:
+    planned = {id(report) : steps for report, steps in plan}
+    diverged : List[Tuple[RepoResult, str]] = []
+    for report in reports:
+        if report.status is None or len(report.errors) > 0:
+            continue
+        if STEP_COMMIT in planned.get(id(report), []) and report.status.is_behind:
+            diverged.append((report, "-- WARNING: COMMIT WILL MAKE BRANCH DIVERGE FROM REMOTE"))
+        elif report.status.diverged and (options.push or options.pull):
+            diverged.append((report, "-- BRANCH DIVERGED FROM REMOTE"))
+    return diverged
+
+
+def print_plan(plan : Plan, out : Optional[TextIO] = None, diverged : List[Tuple[RepoResult, str]] = []) -> None:
+    if len(diverged) > 0:
+        print("\nDiverged from the remote, not pushed or pulled:", file=out)
+        for report, warning in diverged:
+            printColor(f"    {warning}  {report.path}", stdcolors["brightyellow"], file=out)
+    if len(plan) == 0:
+        printColor("\nNothing to commit, push or pull.", stdcolors["brightgreen"], file=out)
+        return
+    counts = {step : sum(step in steps for _, steps in plan) for step in ["commit", "push", "pull"]}
+    print("\nPlanned actions (" + ", ".join(f"{n} {step}" for step, n in counts.items() if n > 0) + "):", file=out)
+    width = max(len(", ".join(steps)) for _, steps in plan)
+    for report, steps in plan:
+        print(f"    {', '.join(steps):<{width}}  {report.path}", file=out)
+    print("", file=out, flush=True)
+
+
+# Runs the steps of every repository of the plan. Commits run at most   #
+# local_jobs at a time and pushes/pulls at most network_jobs at a time, #
+# plus fetch_options.limiter per remote host. The steps of a repository #
+# run in order, and stop at the first one that fails.                   #
+async def execute_plan(
+    plan : Plan,
+    runner : AsyncGitRunner,
+    local_jobs : int,
+    network_jobs : int,
+    fetch_options : FetchOptions,
+    output_format : str = "text",
+) -> None:
+    import asyncio
+    local_slots = asyncio.Semaphore(max(1, local_jobs))
+    network_slots = asyncio.Semaphore(max(1, network_jobs))
+
+    async def execute(report : RepoResult, steps : List[str]) -> None:
+        out = io.StringIO()
+        msg : str = "-- Executing in: " + str(report.path) + " --"
+        print("\n" + "-" * len(msg), file=out)
+        print(msg, file=out)
+        print("-" * len(msg), file=out)
+        for step in steps:
+            if step == STEP_COMMIT:
+                async with local_slots:
+                    ok = await run_step(report.path, step, runner, report, out)
+            else:
+                async with network_slots:
+                    async with fetch_options.limiter.slot(fetch_host(report.path, report.status.upstream)):
+                        ok = await run_step(report.path, step, runner, report, out)
+            if not ok:
+                break
+            if step == STEP_COMMIT and report.status.is_behind:
+                printColor("    -- WARNING: COMMIT MADE BRANCHE DIVERGE FROM REMOTE", stdcolors["brightyellow"], file=out)
+        report.output += out.getvalue()
+        if output_format == "text":
+            sys.stdout.write(out.getvalue())
+            sys.stdout.flush()
+
+    await asyncio.gather(*(execute(report, steps) for report, steps in plan))
+
+
+# Two-phase git_check(): a read-only pass (status and fetch) over every  #
+# repository, then the commits, pushes and pulls that options ask for,   #
+# listed once and run with their own concurrency limits. In "jsonl"      #
+# format the records are printed at the end, with the actions taken.     #
+async def git_plan_async(
+    dir_list : List[Path],
+    search_list : List[Path],
+    ignore_set : Set[Path],
+    options : GitOptions,
+    recursive : bool,
+    recursive_max_level : Optional[int],
+    jobs : int = 1,
+    runner : Optional[AsyncGitRunner] = None,
+    search_options : Optional[SearchOptions] = None,
+    fetch_options : Optional[FetchOptions] = None,
+    plan_options : Optional[PlanOptions] = None,
+    output_format : str = "text",
+) -> List[RepoResult]:
+    if runner is None:
+        runner = AsyncGitRunner(max_processes=jobs)
+    if fetch_options is None:
+        fetch_options = FetchOptions()
+    if plan_options is None:
+        plan_options = PlanOptions()
+    profiler = getattr(runner, "profiler", None)
+    info_out = sys.stderr if output_format == "jsonl" else None
+
+    start = time.perf_counter()
+    repo_list = collect_repos(dir_list, search_list, ignore_set, recursive, recursive_max_level, search_options)
+    if profiler is not None:
+        profiler.record("discovery", time.perf_counter() - start)
+
+    start = time.perf_counter()
+    status_options = GitOptions(status=True, commit=False, push=False, pull=False)
+    reports = await git_check_dir_list(
+        repo_list, status_options, runner, jobs, fetch_options, "text" if output_format == "text" else "none"
+    )
+    if profiler is not None:
+        profiler.record("status pass", time.perf_counter() - start)
+
+    plan = build_plan(reports, options)
+    print_plan(plan, info_out, diverged_repos(plan, reports, options))
+
+    if plan_options.dry_run:
+        printColor("Dry run: nothing was done.", stdcolors["brightyellow"], file=info_out)
+    elif len(plan) > 0:
+        start = time.perf_counter()
+        await execute_plan(
+            plan, runner,
+            jobs if plan_options.local_jobs is None else plan_options.local_jobs,
+            jobs if plan_options.network_jobs is None else plan_options.network_jobs,
+            fetch_options, output_format,
+        )
+        if profiler is not None:
+            profiler.record("execution", time.perf_counter() - start)
+
+    if output_format == "jsonl":
+        for report in reports:
+            sys.stdout.write(report.to_json() + "\n")
+        sys.stdout.flush()
+    return reports
+
+
+def git_plan(
+    dir_list : List[Path],
+    search_list : List[Path],
+    ignore_set : Set[Path],
+    options : GitOptions,
+    recursive : bool,
+    recursive_max_level : Optional[int],
+    jobs : int = 1,
+    runner : Optional[AsyncGitRunner] = None,
+    search_options : Optional[SearchOptions] = None,
+    fetch_options : Optional[FetchOptions] = None,
+    plan_options : Optional[PlanOptions] = None,
+    output_format : str = "text",
+) -> List[RepoResult]:
+    import asyncio
+    return asyncio.run(git_plan_async(
+        dir_list, search_list, ignore_set, options, recursive, recursive_max_level, jobs, runner, search_options, fetch_options, plan_options, output_format
+    ))
@@ -0,0 +1,230 @@
+from typing import Callable, List, Optional, Set, Tuple
+from pathlib import Path
+import asyncio, io, multiprocessing, queue, sys, time, traceback
+
+from .git_check import git_check_repo, collect_repos, GitOptions
+from .discovery import SearchOptions
+from .remotes import FetchOptions
+from .report import RepoResult
+from .runner import AsyncGitRunner
+from .profiling import Profiler
+from .status_cache import StatusCache
+
+
+# Repositories of shard i out of n. Neighbouring repositories tend to be #
+# alike, so they are dealt round-robin instead of in contiguous blocks.  #
+def make_shards(repo_list : List[Path], n : int) -> List[List[Tuple[int, Path]]]:
+    shards : List[List[Tuple[int, Path]]] = [[] for _ in range(max(1, min(n, len(repo_list))))]
+    for i, repo in enumerate(repo_list):
+        shards[i % len(shards)].append((i, repo))
+    return shards
+
+
+# Checks the (index, repository) items with up to jobs repositories at a #
+# time, and calls emit(index, report) as each one finishes, with its text #
+# report in report.output.                                                #
+async def check_indexed(
+    items : List[Tuple[int, Path]],
+    options : GitOptions,
+    runner : AsyncGitRunner,
+    jobs : int,
+    fetch_options : FetchOptions,
+    status_cache : Optional[StatusCache],
+    emit : Callable[[int, RepoResult], None],
+) -> None:
+    profiler : Optional[Profiler] = getattr(runner, "profiler", None)
+    slots = asyncio.Semaphore(max(1, jobs))
+
+    async def check(index : int, dir : Path) -> None:
+        async with slots:
+            start = time.perf_counter()
+            out = io.StringIO()
+            report = await git_check_repo(dir, options, runner, out, fetch_options, status_cache)
+            report.output = out.getvalue()
+            if profiler is not None:
+                profiler.record("repo", time.perf_counter() - start, dir)
+        emit(index, report)
+
+    await asyncio.gather(*(check(index, dir) for index, dir in items))
+
+
+# Prints results that arrive in any order: in "text" format in list order, #
+# as soon as all the previous ones arrived; in "jsonl" format at once.     #
+class ResultPrinter:
+    def __init__(self, total : int, output_format : str = "text") -> None:
+        self.reports : List[Optional[RepoResult]] = [None] * total
+        self.output_format = output_format
+        self._next : int = 0
+
+    def add(self, index : int, report : RepoResult) -> None:
+        self.reports[index] = report
+        if self.output_format == "jsonl":
+            sys.stdout.write(report.to_json() + "\n")
+            sys.stdout.flush()
+        elif self.output_format == "text":
+            while self._next < len(self.reports) and self.reports[self._next] is not None:
+                sys.stdout.write(self.reports[self._next].output)
+                self._next += 1
+            sys.stdout.flush()
+
+    # Reports the items that were not started because the deadline was #
+    # reached as timed out                                              #
+    def timeout(self, items : List[Tuple[int, Path]], reason : str) -> None:
+        for i, repo in items:
+            if self.reports[i] is None:
+                report = RepoResult(repo)
+                report.timed_out = True
+                report.errors.append(reason)
+                report.output = f"\n-- {repo}: TIMEOUT: {reason} --\n"
+                self.add(i, report)
+
+    # Reports the repositories that never arrived as failed, with reason #
+    def finish(self, repo_list : List[Path], reason : str) -> List[RepoResult]:
+        for i, repo in enumerate(repo_list):
+            if self.reports[i] is None:
+                report = RepoResult(repo)
+                report.errors.append(reason)
+                report.output = f"\n-- {repo}: ERROR: {reason} --\n"
+                self.add(i, report)
+        return self.reports
+
+
+# Body of a worker process. Puts on results, as each repository finishes: #
+#     ("result", index in the full list, RepoResult with its output)      #
+# and at the end ("done", shard, status cache entries, profile records),  #
+# or ("error", shard, traceback) if the worker failed.                    #
+def run_shard(
+    shard_id : int,
+    shard : List[Tuple[int, Path]],
+    options : GitOptions,
+    jobs : int,
+    runner_settings : dict,
+    fetch_settings : dict,
+    use_cache : Optional[Path],
+    profile : bool,
+    results : "multiprocessing.Queue",
+) -> None:
+    try:
+        profiler : Optional[Profiler] = Profiler() if profile else None
+        runner = AsyncGitRunner(
+            max_processes=runner_settings["max_processes"],
+            timeouts=runner_settings["timeouts"],
+            env=runner_settings["env"],
+            profiler=profiler,
+            deadline=runner_settings["deadline"],
+        )
+        fetch_options = FetchOptions(**fetch_settings)
+        status_cache : Optional[StatusCache] = None if use_cache is None else StatusCache(use_cache, runner_settings["cache_max_age"])
+
+        def emit(index : int, report : RepoResult) -> None:
+            results.put(("result", index, report))
+
+        asyncio.run(check_indexed(shard, options, runner, jobs, fetch_options, status_cache, emit))
+        entries = {} if status_cache is None else status_cache.entries([dir for _, dir in shard])
+        results.put(("done", shard_id, entries, [] if profiler is None else profiler.records))
+    except BaseException:
+        results.put(("error", shard_id, traceback.format_exc()))
+
+
+# git_check() with the repositories split into processes shards, each one #
+# checked by a worker process with its own event loop, up to jobs         #
+# repositories and runner.max_processes git commands at a time. Results   #
+# are printed by this process: in "text" format in list order, as soon as #
+# all the previous ones are done; in "jsonl" format as they arrive. Per    #
+# host fetch limits apply within each worker.                             #
+def git_check_processes(
+    dir_list : List[Path],
+    search_list : List[Path],
+    ignore_set : Set[Path],
+    options : GitOptions,
+    recursive : bool,
+    recursive_max_level : Optional[int],
+    processes : int,
+    jobs : int = 1,
+    runner : Optional[AsyncGitRunner] = None,
+    search_options : Optional[SearchOptions] = None,
+    fetch_options : Optional[FetchOptions] = None,
+    output_format : str = "text",
+    status_cache : Optional[StatusCache] = None,
+) -> List[RepoResult]:
+    if runner is None:
+        runner = AsyncGitRunner(max_processes=jobs)
+    if fetch_options is None:
+        fetch_options = FetchOptions()
+    profiler : Optional[Profiler] = getattr(runner, "profiler", None)
+
+    start = time.perf_counter()
+    repo_list = collect_repos(dir_list, search_list, ignore_set, recursive, recursive_max_level, search_options)
+    if profiler is not None:
+        profiler.record("discovery", time.perf_counter() - start)
+    if len(repo_list) == 0:
+        return []
+
+    runner_settings = {
+        "max_processes" : runner.max_processes,
+        "timeouts" : runner.timeouts,
+        "env" : runner.env,
+        "deadline" : runner.remaining(),
+        "cache_max_age" : None if status_cache is None else status_cache.max_age,
+    }
+    fetch_settings = {
+        "enabled" : fetch_options.enabled,
+        "max_age" : fetch_options.max_age,
+        "per_host" : fetch_options.limiter.per_host,
+    }
+    # Read-only sweeps only, as in git_check_repo() #
+    use_cache : Optional[Path] = None
+    if status_cache is not None and not (options.commit or options.push or options.pull):
+        use_cache = status_cache.path
+
+    shards = make_shards(repo_list, processes)
+    results : "multiprocessing.Queue" = multiprocessing.Queue()
+    workers = [
+        multiprocessing.Process(
+            target=run_shard,
+            args=(shard_id, shard, options, jobs, runner_settings, fetch_settings, use_cache, profiler is not None, results),
+            daemon=True,
+        )
+        for shard_id, shard in enumerate(shards)
+    ]
+    for worker in workers:
+        worker.start()
+
+    printer = ResultPrinter(len(repo_list), output_format)
+    finished : Set[int] = set()
+    try:
+        while len(finished) < len(workers):
+            try:
+                message = results.get(timeout=0.5)
+            except queue.Empty:
+                # A worker killed without a word (e.g. by the OOM killer) #
+                for shard_id, worker in enumerate(workers):
+                    if shard_id not in finished and not worker.is_alive() and results.empty():
+                        finished.add(shard_id)
+                        print(f"\nWorker {shard_id} exited with code {worker.exitcode}", file=sys.stderr)
+                continue
+
+            kind = message[0]
+            if kind == "result":
+                _, index, report = message
+                printer.add(index, report)
+            elif kind == "done":
+                _, shard_id, entries, records = message
+                finished.add(shard_id)
+                if status_cache is not None:
+                    status_cache.merge(entries)
+                if profiler is not None:
+                    profiler.records.extend(records)
+            else:
+                _, shard_id, text = message
+                finished.add(shard_id)
+                print(f"\nWorker {shard_id} failed:\n{text}", file=sys.stderr)
+    finally:
+        for worker in workers:
+            if worker.is_alive():
+                worker.terminate()
+            worker.join()
+        if status_cache is not None:
+            status_cache.save()
+
+    return printer.finish(repo_list, "worker process failed")
@@ -0,0 +1,86 @@
+from typing import Dict, List, Optional, TextIO, Tuple
+from pathlib import Path
+from contextlib import contextmanager
+import json, math, sys, threading, time
+
+
+# Collects wall times of the steps of a sweep: every git subprocess   #
+# ("git fetch", "git status", ...), the time spent waiting for a free #
+# process slot, the discovery phase and the whole check of each repo. #
+class Profiler:
+    def __init__(self) -> None:
+        # (step, repository or None, seconds) #
+        self.records : List[Tuple[str, Optional[str], float]] = []
+        self._lock = threading.Lock()
+        self.start_time = time.time()
+
+    def record(self, step : str, seconds : float, repo : Optional[Path] = None) -> None:
+        with self._lock:
+            self.records.append((step, None if repo is None else str(repo), seconds))
+
+    @contextmanager
+    def timed(self, step : str, repo : Optional[Path] = None):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(step, time.perf_counter() - start, repo)
+
+    def steps(self) -> Dict[str, List[float]]:
+        steps : Dict[str, List[float]] = dict()
+        for step, _, seconds in self.records:
+            steps.setdefault(step, []).append(seconds)
+        return steps
+
+    def slowest_repos(self, n : int) -> List[Tuple[str, float]]:
+        totals = [(repo, seconds) for step, repo, seconds in self.records if step == "repo" and repo is not None]
+        return sorted(totals, key=lambda item: item[1], reverse=True)[:n]
+
+    def print_summary(self, top : int = 10, file : Optional[TextIO] = None) -> None:
+        steps = self.steps()
+        if len(steps) == 0:
+            print("\nNo timings recorded.", file=file)
+            return
+
+        name_width = max(len("Step"), max(len(step) for step in steps))
+        header = f"{'Step':<{name_width}}  {'Count':>6}  {'Total':>9}  {'Mean':>8}  {'p95':>8}  {'Max':>8}"
+        print("\nProfile (seconds):", file=file)
+        print("    " + header, file=file)
+        print("    " + "-" * len(header), file=file)
+        for step in sorted(steps, key=lambda s: sum(steps[s]), reverse=True):
+            times = sorted(steps[step])
+            total = sum(times)
+            print(
+                f"    {step:<{name_width}}  {len(times):>6}  {total:>9.3f}  {total/len(times):>8.3f}  "
+                f"{percentile(times, 95):>8.3f}  {times[-1]:>8.3f}",
+                file=file
+            )
+
+        slowest = self.slowest_repos(top)
+        if len(slowest) > 0:
+            print(f"\nSlowest {len(slowest)} repositories:", file=file)
+            for repo, seconds in slowest:
+                print(f"    {seconds:>8.3f}  {repo}", file=file)
+
+    def dump(self, path : Path) -> None:
+        import platform
+        data = {
+            "start_time" : self.start_time,
+            "argv" : sys.argv,
+            "python" : platform.python_version(),
+            "platform" : platform.platform(),
+            "records" : [
+                {"step" : step, "repo" : repo, "seconds" : seconds}
+                for step, repo, seconds in self.records
+            ],
+        }
+        with open(path, "w") as fout:
+            json.dump(data, fout, indent=1)
+
+
+# Nearest-rank percentile of an already sorted list #
+def percentile(sorted_values : List[float], p : float) -> float:
+    if len(sorted_values) == 0:
+        return 0.0
+    rank = max(1, math.ceil(p / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
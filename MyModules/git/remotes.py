@@ -0,0 +1,116 @@
+from typing import TYPE_CHECKING, Dict, Optional
+from pathlib import Path
+import time
+
+# asyncio is imported where it is used, as in runner.py #
+if TYPE_CHECKING:
+    import asyncio
+
+from .discovery import git_dirs
+
+
+class FetchOptions:
+    def __init__(
+        self,
+        enabled : bool = True,
+        max_age : Optional[float] = None,
+        per_host : Optional[int] = None,
+    ) -> None:
+        self.enabled = enabled
+        self.max_age = max_age
+        self.limiter = HostLimiter(per_host)
+
+
+# Limits how many network operations run at the same time against each #
+# remote host. Operations on local remotes (host None) are not limited. #
+class HostLimiter:
+    def __init__(self, per_host : Optional[int] = None) -> None:
+        self.per_host = per_host
+        self._semaphores : Dict[str, "asyncio.Semaphore"] = dict()
+
+    def slot(self, host : Optional[str]):
+        import asyncio
+        if self.per_host is None or host is None:
+            return _NoLimit()
+        if host not in self._semaphores:
+            self._semaphores[host] = asyncio.Semaphore(self.per_host)
+        return self._semaphores[host]
+
+
+class _NoLimit:
+    async def __aenter__(self) -> None:
+        return None
+
+    async def __aexit__(self, *args) -> None:
+        return None
+
+
+# Host of a remote URL, or None for local remotes. Understands           #
+# "scheme://[user@]host[:port]/path" and scp-like "[user@]host:path" URLs. #
+def url_host(url : str) -> Optional[str]:
+    if "://" in url:
+        scheme, rest = url.split("://", 1)
+        if scheme == "file":
+            return None
+        netloc = rest.split("/", 1)[0]
+        netloc = netloc.rsplit("@", 1)[-1]
+        if netloc.startswith("["):
+            return netloc[1:netloc.find("]")].lower()
+        return netloc.split(":", 1)[0].lower() or None
+
+    colon = url.find(":")
+    slash = url.find("/")
+    if colon > 0 and (slash < 0 or colon < slash):
+        return url[:colon].rsplit("@", 1)[-1].lower()
+    return None
+
+
+def remote_urls(config_path : Path) -> Dict[str, str]:
+    urls : Dict[str, str] = dict()
+    remote : Optional[str] = None
+    try:
+        with config_path.open("r", encoding="utf-8", errors="replace") as fin:
+            for line in fin:
+                line = line.strip()
+                if line.startswith("["):
+                    remote = None
+                    if line.startswith('[remote "') and line.endswith('"]'):
+                        remote = line[len('[remote "'):-2]
+                elif remote is not None and remote not in urls:
+                    key, _, value = line.partition("=")
+                    if key.strip().lower() == "url":
+                        urls[remote] = value.strip()
+    except OSError:
+        pass
+    return urls
+
+
+# Host that "git fetch" contacts for the repository at dir: the remote of #
+# the upstream branch if there is one, else origin.                        #
+def fetch_host(dir : Path, upstream : Optional[str]) -> Optional[str]:
+    dirs = git_dirs(dir)
+    if dirs is None:
+        return None
+    urls = remote_urls(dirs[1] / "config")
+    remote = "origin"
+    if upstream is not None:
+        for name in urls:
+            if upstream.startswith(name + "/"):
+                remote = name
+                break
+    if remote not in urls:
+        return None
+    return url_host(urls[remote])
+
+
+# Seconds since the last fetch of the repository at dir, or None if it was #
+# never fetched                                                             #
+def fetch_head_age(dir : Path) -> Optional[float]:
+    dirs = git_dirs(dir)
+    if dirs is None:
+        return None
+    try:
+        mtime = (dirs[0] / "FETCH_HEAD").stat().st_mtime
+    except OSError:
+        return None
+    return max(0.0, time.time() - mtime)
@@ -0,0 +1,114 @@
+from typing import Dict, List, Optional
+from pathlib import Path
+from contextlib import contextmanager
+import json, time
+
+from .status import RepoStatus
+
+
+# Outcomes of the fetch step #
+FETCH_UP_TO_DATE  = "up_to_date"
+FETCH_UPDATED     = "updated"
+FETCH_SKIPPED     = "skipped"
+FETCH_NO_REMOTE   = "no_remote"
+FETCH_UNREACHABLE = "unreachable"
+FETCH_TIMEOUT     = "timeout"
+FETCH_ERROR       = "error"
+
+
+# Everything git_check_repo() learnt and did in one repository #
+class RepoResult:
+    def __init__(self, path : Path) -> None:
+        self.path = path
+        self.is_repo : bool = False
+        self.bare : bool = False
+        self.status : Optional[RepoStatus] = None
+        self.fetch : Optional[str] = None
+        self.actions : List[str] = []
+        self.errors : List[str] = []
+        # Whether a git command was killed by its timeout or the deadline #
+        self.timed_out : bool = False
+        self.timings : Dict[str, float] = dict()
+        # Text report, when it was buffered instead of printed #
+        self.output : str = ""
+
+    @property
+    def fetch_ok(self) -> bool:
+        return self.fetch in (FETCH_UP_TO_DATE, FETCH_UPDATED, FETCH_SKIPPED)
+
+    def add_timing(self, step : str, seconds : float) -> None:
+        self.timings[step] = self.timings.get(step, 0.0) + seconds
+
+    @contextmanager
+    def timed(self, step : str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_timing(step, time.perf_counter() - start)
+
+    def to_dict(self) -> dict:
+        data = {
+            "path" : str(self.path),
+            "repo" : self.is_repo,
+            "bare" : self.bare,
+        }
+        status = self.status
+        if status is not None:
+            data.update({
+                "branch" : status.head,
+                "upstream" : status.upstream,
+                "ahead" : status.ahead,
+                "behind" : status.behind,
+                "clean" : status.clean,
+                "staged" : status.staged,
+                "unstaged" : status.unstaged,
+                "untracked" : status.untracked,
+                "conflicted" : status.conflicted,
+            })
+        data.update({
+            "fetch" : self.fetch,
+            "actions" : self.actions,
+            "errors" : self.errors,
+            "timeout" : self.timed_out,
+            "timings" : {step : round(seconds, 6) for step, seconds in self.timings.items()},
+        })
+        return data
+
+    def to_json(self) -> str:
+        return json.dumps(self.to_dict())
+
+    # to_dict() plus what from_dict() needs to rebuild the result exactly #
+    def to_wire(self) -> dict:
+        data = self.to_dict()
+        if self.status is not None:
+            data["oid"] = self.status.oid
+            data["entries"] = self.status.entries
+        data["output"] = self.output
+        return data
+
+    @staticmethod
+    def from_dict(data : dict) -> "RepoResult":
+        report = RepoResult(Path(data["path"]))
+        report.is_repo = data.get("repo", False)
+        report.bare = data.get("bare", False)
+        if "branch" in data:
+            status = RepoStatus()
+            status.oid = data.get("oid")
+            status.head = data["branch"]
+            status.upstream = data.get("upstream")
+            status.ahead = data.get("ahead")
+            status.behind = data.get("behind")
+            status.staged = data.get("staged", 0)
+            status.unstaged = data.get("unstaged", 0)
+            status.untracked = data.get("untracked", 0)
+            status.conflicted = data.get("conflicted", 0)
+            status.entries = [tuple(entry) for entry in data.get("entries", [])]
+            report.status = status
+        report.fetch = data.get("fetch")
+        report.actions = list(data.get("actions", []))
+        report.errors = list(data.get("errors", []))
+        report.timed_out = data.get("timeout", False)
+        report.timings = dict(data.get("timings", {}))
+        report.output = data.get("output", "")
+        return report
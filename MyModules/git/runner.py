@@ -0,0 +1,180 @@
+from typing import TYPE_CHECKING, Dict, List, Optional
+from pathlib import Path
+import os, signal, time
+
+# asyncio is imported where it is used: loading it is the largest part #
+# of the start of a run, and --query, --help or --list-configs never  #
+# need it                                                             #
+if TYPE_CHECKING:
+    import asyncio
+
+from .profiling import Profiler
+
+
+class GitResult:
+    def __init__(
+        self,
+        args : List[str],
+        returncode : Optional[int],
+        stdout : str,
+        stderr : str,
+        timed_out : bool = False,
+        elapsed : float = 0.0,
+        deadline : bool = False,
+    ) -> None:
+        self.args = args
+        self.returncode = returncode
+        self.stdout = stdout
+        self.stderr = stderr
+        self.timed_out = timed_out
+        self.elapsed = elapsed
+        # Whether it timed out because the deadline of the sweep was reached #
+        self.deadline = deadline
+
+    @property
+    def ok(self) -> bool:
+        return (not self.timed_out) and self.returncode == 0
+
+    @property
+    def output(self) -> str:
+        return self.stdout + "\n" + self.stderr
+
+
+# Runs git commands as asyncio subprocesses. Every command waits for a slot #
+# of a semaphore shared by the whole sweep, so at most max_processes git    #
+# processes are alive at any time. Commands that exceed their timeout, or  #
+# the deadline of the whole sweep (deadline seconds from now, None for no  #
+# limit), are killed and reported with timed_out = True; commands that     #
+# would start after the deadline are not started at all.                   #
+# On POSIX every command runs in a process group of its own, so that the   #
+# ssh or git-remote-* helpers it starts are killed along with it. Nothing  #
+# can be typed into them, so git and ssh are told not to ask for passwords #
+# or passphrases (noninteractive_env()) and fail with their own message.   #
+# Any object with an equivalent "async run(args, cwd, timeout)" method can #
+# be passed to git_check() in place of this one.                           #
+class AsyncGitRunner:
+    default_timeouts : Dict[str, Optional[float]] = {
+        "status" : 120.0,
+        "fetch"  : 300.0,
+        "push"   : 300.0,
+        "pull"   : 300.0,
+    }
+
+    def __init__(
+        self,
+        max_processes : int = 8,
+        timeouts : Dict[str, Optional[float]] = {},
+        env : Dict[str, str] = {},
+        profiler : Optional[Profiler] = None,
+        deadline : Optional[float] = None,
+    ) -> None:
+        self.max_processes = max(1, max_processes)
+        self.timeouts = dict(AsyncGitRunner.default_timeouts)
+        self.timeouts.update(timeouts)
+        # Variables added to the environment of every git command #
+        self.env = dict(env)
+        self.profiler = profiler
+        self._semaphore : Optional["asyncio.Semaphore"] = None
+        self.set_deadline(deadline)
+
+    # GIT_TERMINAL_PROMPT=0 makes git fail with "terminal prompts disabled" #
+    # and BatchMode makes ssh fail instead of asking. A GIT_SSH program    #
+    # may not be ssh, so it is left alone.                                 #
+    @staticmethod
+    def noninteractive_env() -> Dict[str, str]:
+        env = {"GIT_TERMINAL_PROMPT" : "0"}
+        if os.environ.get("GIT_SSH_COMMAND"):
+            env["GIT_SSH_COMMAND"] = os.environ["GIT_SSH_COMMAND"] + " -o BatchMode=yes"
+        elif not os.environ.get("GIT_SSH"):
+            env["GIT_SSH_COMMAND"] = "ssh -o BatchMode=yes"
+        return env
+
+    def timeout_for(self, args : List[str]) -> Optional[float]:
+        if len(args) == 0:
+            return None
+        return self.timeouts.get(args[0])
+
+    def set_deadline(self, seconds : Optional[float]) -> None:
+        self.deadline : Optional[float] = None if seconds is None else time.monotonic() + seconds
+
+    # Seconds left until the deadline, or None if there is none #
+    def remaining(self) -> Optional[float]:
+        if self.deadline is None:
+            return None
+        return max(0.0, self.deadline - time.monotonic())
+
+    async def run(
+        self,
+        args : List[str],
+        cwd : Path,
+        timeout : Optional[float] = None,
+    ) -> GitResult:
+        import asyncio
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_processes)
+        if timeout is None:
+            timeout = self.timeout_for(args)
+
+        wait_start = time.perf_counter()
+        async with self._semaphore:
+            start = time.perf_counter()
+            if self.profiler is not None:
+                self.profiler.record("wait for process slot", start - wait_start, cwd)
+
+            left = self.remaining()
+            by_deadline : bool = left is not None and (timeout is None or left < timeout)
+            if by_deadline:
+                if left <= 0:
+                    return GitResult(args, None, "", "not started, the deadline was reached", timed_out=True, deadline=True)
+                timeout = left
+
+            try:
+                proc = await asyncio.create_subprocess_exec(
+                    "git", *args,
+                    cwd=cwd,
+                    env={**os.environ, **AsyncGitRunner.noninteractive_env(), **self.env},
+                    stdin=asyncio.subprocess.DEVNULL,
+                    stdout=asyncio.subprocess.PIPE,
+                    stderr=asyncio.subprocess.PIPE,
+                    start_new_session=(os.name == "posix"),
+                )
+            except OSError as e:
+                # cwd does not exist, or git is not installed #
+                return GitResult(args, None, "", str(e))
+            try:
+                stdout, stderr = await asyncio.wait_for(proc.communicate(), timeout)
+            except asyncio.TimeoutError:
+                await self._kill(proc)
+                elapsed = time.perf_counter() - start
+                self._record(args, cwd, elapsed)
+                message = "killed at the deadline" if by_deadline else f"timed out after {timeout:g} s"
+                return GitResult(args, None, "", message, timed_out=True, elapsed=elapsed, deadline=by_deadline)
+            except asyncio.CancelledError:
+                await self._kill(proc)
+                raise
+
+        elapsed = time.perf_counter() - start
+        self._record(args, cwd, elapsed)
+        return GitResult(
+            args,
+            proc.returncode,
+            stdout.decode("utf-8", errors="replace"),
+            stderr.decode("utf-8", errors="replace"),
+            elapsed=elapsed,
+        )
+
+    def _record(self, args : List[str], cwd : Path, seconds : float) -> None:
+        if self.profiler is not None:
+            self.profiler.record("git " + (args[0] if len(args) > 0 else ""), seconds, cwd)
+
+    @staticmethod
+    async def _kill(proc : "asyncio.subprocess.Process") -> None:
+        if proc.returncode is None:
+            try:
+                if os.name == "posix":
+                    os.killpg(proc.pid, signal.SIGKILL)
+                else:
+                    proc.kill()
+            except ProcessLookupError:
+                pass
+            await proc.wait()
@@ -0,0 +1,67 @@
+from typing import Dict, Optional
+from pathlib import Path
+import os, shlex, shutil, subprocess, tempfile
+
+
+# Shares one SSH connection per remote host between all the git commands of #
+# a run. The connections are opened on first use by ssh itself              #
+# (ControlMaster=auto) and their sockets live in a private temporary        #
+# directory, injected into git through GIT_SSH_COMMAND. stop() closes every #
+# connection and removes the directory. If the run dies without stop(), the #
+# connections close themselves after persist seconds without use.          #
+class SSHMultiplexer:
+    def __init__(self, persist : int = 120, ssh_command : Optional[str] = None) -> None:
+        self.persist = persist
+        if ssh_command is None:
+            if os.environ.get("GIT_SSH_COMMAND"):
+                ssh_command = os.environ["GIT_SSH_COMMAND"]
+            elif os.environ.get("GIT_SSH"):
+                ssh_command = shlex.quote(os.environ["GIT_SSH"])
+            else:
+                ssh_command = "ssh"
+        self.ssh_command = ssh_command
+        self.socket_dir : Optional[Path] = None
+
+    @staticmethod
+    def supported() -> bool:
+        return os.name == "posix" and shutil.which("ssh") is not None
+
+    def start(self) -> Dict[str, str]:
+        if self.socket_dir is None:
+            # Socket paths are limited to ~100 characters, so keep it short #
+            self.socket_dir = Path(tempfile.mkdtemp(prefix="gitmux-", dir="/tmp"))
+        return self.env()
+
+    def env(self) -> Dict[str, str]:
+        if self.socket_dir is None:
+            return dict()
+        control_path = shlex.quote(str(self.socket_dir / "%C"))
+        return {
+            "GIT_SSH_COMMAND" :
+                f"{self.ssh_command} -o BatchMode=yes -o ControlMaster=auto -o ControlPath={control_path} "
+                f"-o ControlPersist={self.persist}",
+            "GIT_SSH_VARIANT" : "ssh",
+        }
+
+    def stop(self) -> None:
+        if self.socket_dir is None:
+            return
+        try:
+            for socket in self.socket_dir.iterdir():
+                # The host is not used when ControlPath is a literal path #
+                subprocess.run(
+                    ["ssh", "-o", f"ControlPath={socket}", "-O", "exit", "git-check-mux"],
+                    stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                    timeout=10,
+                )
+        except (OSError, subprocess.TimeoutExpired):
+            pass
+        shutil.rmtree(self.socket_dir, ignore_errors=True)
+        self.socket_dir = None
+
+    def __enter__(self) -> "SSHMultiplexer":
+        self.start()
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.stop()
@@ -0,0 +1,89 @@
+from typing import List, Optional, Tuple
+
+
+# Status of a repository as reported by                   #
+# "git status --porcelain=v2 --branch" (branch, upstream, #
+# ahead/behind counts and changed files).                 #
+class RepoStatus:
+    def __init__(self) -> None:
+        self.oid : Optional[str] = None
+        self.head : Optional[str] = None
+        self.upstream : Optional[str] = None
+        self.ahead : Optional[int] = None
+        self.behind : Optional[int] = None
+        self.staged : int = 0
+        self.unstaged : int = 0
+        self.untracked : int = 0
+        self.conflicted : int = 0
+        self.entries : List[Tuple[str, str]] = []
+
+    @property
+    def clean(self) -> bool:
+        return len(self.entries) == 0
+
+    @property
+    def detached(self) -> bool:
+        return self.head == "(detached)"
+
+    @property
+    def has_upstream(self) -> bool:
+        return self.upstream is not None
+
+    @property
+    def diverged(self) -> bool:
+        return (self.ahead or 0) > 0 and (self.behind or 0) > 0
+
+    @property
+    def is_ahead(self) -> bool:
+        return (self.ahead or 0) > 0 and not self.diverged
+
+    @property
+    def is_behind(self) -> bool:
+        return (self.behind or 0) > 0 and not self.diverged
+
+
+def parse_porcelain_v2(text : str) -> RepoStatus:
+    status = RepoStatus()
+    for line in text.split("\n"):
+        if line == "":
+            continue
+
+        if line.startswith("# "):
+            fields = line[2:].split(" ")
+            key = fields[0]
+            if key == "branch.oid":
+                status.oid = fields[1]
+            elif key == "branch.head":
+                status.head = fields[1]
+            elif key == "branch.upstream":
+                status.upstream = fields[1]
+            elif key == "branch.ab":
+                status.ahead = int(fields[1].lstrip("+"))
+                status.behind = int(fields[2].lstrip("-"))
+
+        elif line[0] == "1":
+            fields = line.split(" ", 8)
+            add_changed_entry(status, fields[1], fields[8])
+
+        elif line[0] == "2":
+            fields = line.split(" ", 9)
+            add_changed_entry(status, fields[1], fields[9].split("\t")[0])
+
+        elif line[0] == "u":
+            fields = line.split(" ", 10)
+            status.conflicted += 1
+            status.entries.append((fields[1], fields[10]))
+
+        elif line[0] == "?":
+            status.untracked += 1
+            status.entries.append(("??", line[2:]))
+
+    return status
+
+
+def add_changed_entry(status : RepoStatus, xy : str, path : str) -> None:
+    if xy[0] != ".":
+        status.staged += 1
+    if xy[1] != ".":
+        status.unstaged += 1
+    status.entries.append((xy.replace(".", " "), path))
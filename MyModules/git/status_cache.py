@@ -0,0 +1,129 @@
+from typing import Dict, List, Optional
+from pathlib import Path
+import json, os, time
+
+from .discovery import git_dirs
+
+
+# On-disk record of the last "git status" output of every repository,     #
+# with a fingerprint of the files that the status depends on: index,      #
+# HEAD, the current and upstream refs (or packed-refs), the config and    #
+# the modification time of the working tree root. While the fingerprint   #
+# does not change, the stored output is used instead of running git.      #
+# Taking it costs a few stats, whatever the size of the repository, but   #
+# edits to files already in the working tree do not change it: that is    #
+# why the cache is only used when asked for (--cache), and entries expire #
+# after max_age seconds.                                                  #
+class StatusCache:
+    default_path : Path = Path(__file__).parent / "status_cache.json"
+
+    def __init__(self, path : Optional[Path] = None, max_age : float = 300.0) -> None:
+        self.path = StatusCache.default_path if path is None else path
+        self.max_age = max_age
+        self.hits : int = 0
+        self.misses : int = 0
+        self._data : Optional[Dict[str, dict]] = None
+        self._dirty : bool = False
+
+    def load(self) -> Dict[str, dict]:
+        if self._data is None:
+            self._data = dict()
+            if self.path.is_file():
+                try:
+                    with self.path.open() as fin:
+                        data = json.load(fin)
+                    if type(data) is dict:
+                        self._data = data
+                except (OSError, ValueError):
+                    pass
+        return self._data
+
+    @staticmethod
+    def stamp(path : Path) -> Optional[List[int]]:
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return [st.st_mtime_ns, st.st_size]
+
+    # Stamps of index, HEAD, current ref, packed-refs, config and working #
+    # tree root. Returns None if the repository layout cannot be read.    #
+    @staticmethod
+    def fingerprint(repo : Path) -> Optional[list]:
+        dirs = git_dirs(repo)
+        if dirs is None:
+            return None
+        git_dir, common_dir = dirs
+        try:
+            with (git_dir / "HEAD").open("r", encoding="utf-8", errors="replace") as fin:
+                head = fin.readline().strip()
+        except OSError:
+            return None
+        ref = StatusCache.stamp(common_dir / head[len("ref: "):]) if head.startswith("ref: ") else None
+        return [
+            head,
+            StatusCache.stamp(git_dir / "index"),
+            StatusCache.stamp(git_dir / "HEAD"),
+            ref,
+            StatusCache.stamp(common_dir / "packed-refs"),
+            StatusCache.stamp(common_dir / "config"),
+            StatusCache.stamp(repo),
+        ]
+
+    @staticmethod
+    def upstream_stamp(repo : Path, upstream : Optional[str]) -> Optional[List[int]]:
+        dirs = git_dirs(repo)
+        if upstream is None or dirs is None:
+            return None
+        return StatusCache.stamp(dirs[1] / "refs" / "remotes" / upstream)
+
+    # Stored "git status" output, or None if it must be run again #
+    def get(self, repo : Path) -> Optional[str]:
+        entry = self.load().get(str(repo))
+        if entry is None or time.time() - entry["time"] > self.max_age or \
+           StatusCache.fingerprint(repo) != entry["fingerprint"] or \
+           StatusCache.upstream_stamp(repo, entry["upstream"]) != entry["upstream_ref"]:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry["stdout"]
+
+    # before is the fingerprint taken before running git. If git status #
+    # refreshed the index meanwhile, the next run misses once more.     #
+    def set(self, repo : Path, before : Optional[list], stdout : str, upstream : Optional[str]) -> None:
+        if before is None:
+            return
+        self.load()[str(repo)] = {
+            "time" : time.time(),
+            "fingerprint" : before,
+            "upstream" : upstream,
+            "upstream_ref" : StatusCache.upstream_stamp(repo, upstream),
+            "stdout" : stdout,
+        }
+        self._dirty = True
+
+    # Entries of the given repositories, to merge into another process' cache #
+    def entries(self, repos : List[Path]) -> Dict[str, dict]:
+        data = self.load()
+        return {str(repo) : data[str(repo)] for repo in repos if str(repo) in data}
+
+    def merge(self, entries : Dict[str, dict]) -> None:
+        if len(entries) > 0:
+            self.load().update(entries)
+            self._dirty = True
+
+    def save(self) -> None:
+        if not self._dirty:
+            return
+        # One per process, so that concurrent runs do not write the same one #
+        tmp_path = self.path.with_name(f"{self.path.name}.{os.getpid()}.tmp")
+        try:
+            with tmp_path.open("w") as fout:
+                json.dump(self.load(), fout)
+            os.replace(tmp_path, self.path)
+            self._dirty = False
+        except OSError:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
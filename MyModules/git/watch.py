@@ -0,0 +1,373 @@
+from typing import Callable, Dict, List, Optional, Set, Tuple
+from pathlib import Path
+import errno, io, json, os, struct, sys, time
+
+from .colors import printColor, stdcolors
+from .git_check import git_check_repo, git_check_dir_list, collect_repos, GitOptions
+from .discovery import git_dirs, DEFAULT_SKIP_DIRS, SearchOptions
+from .remotes import FetchOptions
+from .report import RepoResult
+from .runner import AsyncGitRunner
+
+
+class WatchOptions:
+    def __init__(
+        self,
+        debounce : float = 1.0,
+        fetch_interval : Optional[float] = 900.0,
+        poll_interval : float = 2.0,
+        skip_names : Optional[Set[str]] = None,
+    ) -> None:
+        self.debounce = debounce
+        # None or 0 never fetches after the first sweep #
+        self.fetch_interval = fetch_interval
+        # Only used when inotify is not available #
+        self.poll_interval = poll_interval
+        self.skip_names = set(DEFAULT_SKIP_DIRS if skip_names is None else skip_names)
+
+
+# Files of the git dir whose changes affect the status #
+GIT_DIR_NAMES : Set[str] = {"HEAD", "index", "packed-refs", "FETCH_HEAD", "ORIG_HEAD", "MERGE_HEAD"}
+
+
+# Minimal inotify(7) binding through ctypes (Linux only). ctypes is only #
+# imported when a watcher is created.                                    #
+class Inotify:
+    IN_MODIFY      = 0x00000002
+    IN_MOVED_FROM  = 0x00000040
+    IN_MOVED_TO    = 0x00000080
+    IN_CREATE      = 0x00000100
+    IN_DELETE      = 0x00000200
+    IN_DELETE_SELF = 0x00000400
+    IN_MOVE_SELF   = 0x00000800
+    IN_Q_OVERFLOW  = 0x00004000
+    IN_IGNORED     = 0x00008000
+    IN_ONLYDIR     = 0x01000000
+    IN_ISDIR       = 0x40000000
+    IN_NONBLOCK    = 0o00004000
+    IN_CLOEXEC     = 0o02000000
+
+    DIR_MASK = IN_MODIFY | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | \
+               IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR
+
+    _header = struct.Struct("iIII")
+
+    def __init__(self) -> None:
+        import ctypes
+        # The symbols of the running process, libc included #
+        self._libc = ctypes.CDLL(None, use_errno=True)
+        self.fd : int = self._libc.inotify_init1(Inotify.IN_NONBLOCK | Inotify.IN_CLOEXEC)
+        if self.fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+
+    @staticmethod
+    def available() -> bool:
+        return sys.platform.startswith("linux")
+
+    def add_watch(self, path : Path, mask : int) -> int:
+        import ctypes
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(str(path)), ctypes.c_uint32(mask))
+        if wd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err), str(path))
+        return wd
+
+    # Returns (wd, mask, name) for every pending event #
+    def read_events(self) -> List[Tuple[int, int, str]]:
+        events : List[Tuple[int, int, str]] = []
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            if len(data) == 0:
+                break
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = Inotify._header.unpack_from(data, offset)
+                offset += Inotify._header.size
+                name = os.fsdecode(data[offset:offset+length].rstrip(b"\0"))
+                offset += length
+                events.append((wd, mask, name))
+        return events
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+# What an inotify watch covers #
+WATCH_GIT_DIR = "git_dir"   # HEAD, index... of the git dir
+WATCH_REFS    = "refs"      # a directory under refs/
+WATCH_TREE    = "tree"      # a directory of the working tree
+
+
+# Reports which repositories changed, using inotify watches on every #
+# directory of their working trees plus their git dir and refs.      #
+class InotifyWatcher:
+    def __init__(self, skip_names : Set[str]) -> None:
+        import asyncio
+        self.inotify = Inotify()
+        self.skip_names = skip_names
+        # wd -> (repository, directory, WATCH_*) #
+        self.watches : Dict[int, Tuple[Path, Path, str]] = dict()
+        self.out_of_watches : bool = False
+        self._event = asyncio.Event()
+        asyncio.get_running_loop().add_reader(self.inotify.fd, self._event.set)
+
+    def _watch(self, repo : Path, dir : Path, kind : str) -> bool:
+        try:
+            wd = self.inotify.add_watch(dir, Inotify.DIR_MASK)
+        except OSError as e:
+            if e.errno == errno.ENOSPC and not self.out_of_watches:
+                self.out_of_watches = True
+                printColor(
+                    "WARNING: Out of inotify watches (see fs.inotify.max_user_watches). "
+                    "Some working tree changes will not be noticed.",
+                    stdcolors["brightyellow"], file=sys.stderr
+                )
+            return False
+        self.watches[wd] = (repo, dir, kind)
+        return True
+
+    def _watch_tree(self, repo : Path, root : Path, kind : str) -> None:
+        stack : List[Path] = [root]
+        while len(stack) > 0:
+            dir = stack.pop()
+            if not self._watch(repo, dir, kind):
+                continue
+            try:
+                with os.scandir(dir) as it:
+                    for entry in it:
+                        if entry.is_dir(follow_symlinks=False) and entry.name != ".git" and entry.name not in self.skip_names:
+                            stack.append(Path(entry.path))
+            except OSError:
+                pass
+
+    def add_repo(self, repo : Path) -> None:
+        dirs = git_dirs(repo)
+        # The git dir is watched first, so that it is never left out #
+        if dirs is not None:
+            git_dir, common_dir = dirs
+            self._watch(repo, git_dir, WATCH_GIT_DIR)
+            if common_dir != git_dir:
+                self._watch(repo, common_dir, WATCH_GIT_DIR)
+            self._watch_tree(repo, common_dir / "refs", WATCH_REFS)
+        if dirs is None or dirs[0] != repo:
+            self._watch_tree(repo, repo, WATCH_TREE)
+
+    async def wait(self, timeout : Optional[float]) -> Set[Path]:
+        import asyncio
+        try:
+            await asyncio.wait_for(self._event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        self._event.clear()
+
+        changed : Set[Path] = set()
+        for wd, mask, name in self.inotify.read_events():
+            if mask & Inotify.IN_Q_OVERFLOW:
+                # Events were lost: any repository may have changed #
+                changed.update(repo for repo, _, _ in self.watches.values())
+                continue
+            if mask & Inotify.IN_IGNORED:
+                self.watches.pop(wd, None)
+                continue
+            if wd not in self.watches:
+                continue
+            repo, dir, kind = self.watches[wd]
+            if kind == WATCH_GIT_DIR and name not in GIT_DIR_NAMES:
+                # objects/, logs/, lock files... #
+                continue
+            if kind == WATCH_REFS and name.endswith(".lock"):
+                continue
+            changed.add(repo)
+            # New directories must be watched too #
+            if kind != WATCH_GIT_DIR and (mask & Inotify.IN_ISDIR) and (mask & (Inotify.IN_CREATE | Inotify.IN_MOVED_TO)):
+                if name != ".git" and name not in self.skip_names:
+                    self._watch_tree(repo, dir / name, kind)
+        return changed
+
+    def close(self) -> None:
+        import asyncio
+        try:
+            asyncio.get_running_loop().remove_reader(self.inotify.fd)
+        except RuntimeError:
+            pass
+        self.inotify.close()
+
+
+# Fallback for systems without inotify: compares, every poll_interval  #
+# seconds, the mtimes of HEAD, index, packed-refs and the refs and the #
+# working tree root of every repository. Edits to existing files that  #
+# are not staged are only noticed by the periodic fetch sweep.         #
+class PollWatcher:
+    def __init__(self, poll_interval : float) -> None:
+        self.poll_interval = poll_interval
+        self.fingerprints : Dict[Path, tuple] = dict()
+
+    @staticmethod
+    def fingerprint(repo : Path) -> tuple:
+        paths : List[Path] = [repo]
+        dirs = git_dirs(repo)
+        if dirs is not None:
+            git_dir, common_dir = dirs
+            paths += [git_dir / name for name in GIT_DIR_NAMES]
+            paths += [common_dir / "packed-refs", common_dir / "refs" / "heads", common_dir / "refs" / "remotes"]
+        stamps = []
+        for path in paths:
+            try:
+                st = os.stat(path)
+                stamps.append((st.st_mtime_ns, st.st_size))
+            except OSError:
+                stamps.append(None)
+        return tuple(stamps)
+
+    def add_repo(self, repo : Path) -> None:
+        self.fingerprints[repo] = PollWatcher.fingerprint(repo)
+
+    async def wait(self, timeout : Optional[float]) -> Set[Path]:
+        import asyncio
+        await asyncio.sleep(self.poll_interval if timeout is None else min(timeout, self.poll_interval))
+        changed : Set[Path] = set()
+        for repo, old in self.fingerprints.items():
+            new = PollWatcher.fingerprint(repo)
+            if new != old:
+                self.fingerprints[repo] = new
+                changed.add(repo)
+        return changed
+
+    def close(self) -> None:
+        pass
+
+
+# Fields of a result whose changes are reported #
+def summary(report : RepoResult) -> dict:
+    data = report.to_dict()
+    for key in ["fetch", "actions", "timings"]:
+        data.pop(key, None)
+    return data
+
+
+def print_delta(report : RepoResult, changes : Dict[str, tuple], output_format : str) -> None:
+    if output_format == "jsonl":
+        record = {"time" : time.time(), "event" : "change", "changes" : {k : list(v) for k, v in changes.items()}}
+        record.update(report.to_dict())
+        print(json.dumps(record), flush=True)
+        return
+    stamp = time.strftime("%H:%M:%S")
+    text = ", ".join(f"{key}: {old} -> {new}" for key, (old, new) in changes.items())
+    printColor(f"[{stamp}] {report.path}: {text}", stdcolors["brightyellow"])
+
+
+# Keeps running: re-checks (without fetching) the repositories whose     #
+# working tree or git dir changed, once no event arrived for them during #
+# watch_options.debounce seconds, and re-checks every repository with a  #
+# fetch every watch_options.fetch_interval seconds. Prints what changed, #
+# or passes every new result and its changes to on_result if given.      #
+async def watch_repos(
+    repo_list : List[Path],
+    options : GitOptions,
+    runner : AsyncGitRunner,
+    jobs : int,
+    fetch_options : FetchOptions,
+    watch_options : WatchOptions,
+    output_format : str = "text",
+    on_result : Optional[Callable[[RepoResult, Dict[str, tuple]], None]] = None,
+) -> None:
+    import asyncio
+    # git status must not rewrite the index, or it would wake us up again #
+    runner.env["GIT_OPTIONAL_LOCKS"] = "0"
+
+    # First sweep, printed as usual #
+    latest : Dict[Path, dict] = dict()
+    for report in await git_check_dir_list(repo_list, options, runner, jobs, fetch_options, output_format):
+        latest[report.path] = summary(report)
+        if on_result is not None:
+            on_result(report, dict())
+
+    watcher = None
+    if Inotify.available():
+        try:
+            watcher = InotifyWatcher(watch_options.skip_names)
+        except OSError:
+            watcher = None
+    if watcher is None:
+        watcher = PollWatcher(watch_options.poll_interval)
+    for repo in repo_list:
+        watcher.add_repo(repo)
+
+    info_out = sys.stderr if output_format == "jsonl" else None
+    print(f"\nWatching {len(repo_list)} repositories ({type(watcher).__name__}). Press Ctrl+C to stop.", file=info_out, flush=True)
+
+    no_fetch = FetchOptions(enabled=False)
+    slots = asyncio.Semaphore(max(1, jobs))
+
+    async def recheck(repo : Path, with_fetch : bool) -> None:
+        async with slots:
+            report = await git_check_repo(repo, options, runner, io.StringIO(), fetch_options if with_fetch else no_fetch)
+        new = summary(report)
+        old = latest.get(repo, dict())
+        changes = {key : (old.get(key), value) for key, value in new.items() if old.get(key) != value}
+        latest[repo] = new
+        if on_result is not None:
+            on_result(report, changes)
+        elif len(changes) > 0:
+            print_delta(report, changes, output_format)
+
+    pending : Dict[Path, float] = dict()
+    fetch_interval = watch_options.fetch_interval if watch_options.fetch_interval else None
+    next_fetch : Optional[float] = None if fetch_interval is None or not fetch_options.enabled \
+                                   else time.monotonic() + fetch_interval
+    try:
+        while True:
+            now = time.monotonic()
+            timeouts : List[float] = []
+            if len(pending) > 0:
+                timeouts.append(max(0.0, min(pending.values()) + watch_options.debounce - now))
+            if next_fetch is not None:
+                timeouts.append(max(0.0, next_fetch - now))
+            changed = await watcher.wait(min(timeouts) if len(timeouts) > 0 else None)
+
+            now = time.monotonic()
+            for repo in changed:
+                pending[repo] = now
+
+            if next_fetch is not None and now >= next_fetch:
+                pending.clear()
+                await asyncio.gather(*(recheck(repo, True) for repo in repo_list))
+                next_fetch = time.monotonic() + fetch_interval
+                continue
+
+            due = [repo for repo, last in pending.items() if now - last >= watch_options.debounce]
+            for repo in due:
+                del pending[repo]
+            if len(due) > 0:
+                await asyncio.gather(*(recheck(repo, False) for repo in due))
+    finally:
+        watcher.close()
+
+
+def git_watch(
+    dir_list : List[Path],
+    search_list : List[Path],
+    ignore_set : Set[Path],
+    options : GitOptions,
+    recursive : bool,
+    recursive_max_level : Optional[int],
+    jobs : int = 1,
+    runner : Optional[AsyncGitRunner] = None,
+    search_options : Optional[SearchOptions] = None,
+    fetch_options : Optional[FetchOptions] = None,
+    watch_options : Optional[WatchOptions] = None,
+    output_format : str = "text",
+) -> None:
+    import asyncio
+    if runner is None:
+        runner = AsyncGitRunner(max_processes=jobs)
+    if fetch_options is None:
+        fetch_options = FetchOptions()
+    if watch_options is None:
+        watch_options = WatchOptions()
+    repo_list = collect_repos(dir_list, search_list, ignore_set, recursive, recursive_max_level, search_options)
+    asyncio.run(watch_repos(repo_list, options, runner, jobs, fetch_options, watch_options, output_format))